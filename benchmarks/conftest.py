@@ -0,0 +1,36 @@
+# (фикстуры замеров: синтетические данные в БД и fakeredis)
+# Данные генерируются один раз на каждое кол-во сотрудников (EMPLOYEES)
+# за 92 дня до сегодня. По умолчанию они загружаются в SQLite во
+# временном каталоге, BENCH_DATABASE=<url> - в другую БД (например,
+# MySQL для проверки пространственных индексов; таблицы пересоздаются).
+import datetime as dt
+import os
+
+import pytest
+from sqlalchemy import create_engine
+
+from benchmarks.synthetic import generate, load, use_fakeredis
+from trajectory_report import database
+
+EMPLOYEES = (10, 200, 2000)
+# Дней данных (самый длинный период замеров)
+DAYS = 92
+
+
+@pytest.fixture(scope='session', params=EMPLOYEES,
+                ids=[f'{n}emp' for n in EMPLOYEES])
+def scale(request, tmp_path_factory):
+    """Синтетические таблицы request.param сотрудников, загруженные в
+    database.DB_ENGINE, и пустой fakeredis вместо database.REDIS_CONN"""
+    n = request.param
+    data = generate(n, days=DAYS, date_to=dt.date.today())
+    url = os.getenv('BENCH_DATABASE') or \
+        f'sqlite:///{tmp_path_factory.mktemp("bench") / f"tr{n}.db"}'
+    engine = create_engine(url)
+    load(data, engine)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(database, 'DB_ENGINE', engine, raising=False)
+        monkeypatch.setattr(database, 'REDIS_CONN', None, raising=False)
+        use_fakeredis()
+        yield data
+    engine.dispose()
@@ -0,0 +1,66 @@
+# (время импорта точек входа: cron-скриптов, отчетов и карт)
+# Каждый модуль импортируется в отдельном процессе с python -X importtime,
+# из вывода берется суммарное время импорта модуля (cumulative, мкс).
+# Импорт повторяется RUNS раз, учитывается минимальное время.
+# Если время превышает бюджет из BUDGET_MS, скрипт завершается с кодом 1.
+# Запуск:
+#   python -m benchmarks.import_time
+#   python -m benchmarks.import_time trajectory_report.gather.journal
+import os
+import subprocess
+import sys
+from typing import Optional
+
+
+# Бюджет времени импорта, мс. Тяжелые зависимости (skmob, sklearn, scipy,
+# folium, redis) не должны загружаться при импорте точек входа, которые
+# их не используют.
+BUDGET_MS = {
+    'trajectory_report.database': 300,
+    'trajectory_report.gather.journal': 1000,
+    'trajectory_report.gather.coordinates': 1000,
+    'trajectory_report.gather.clusters': 1000,
+    'trajectory_report.report': 800,
+    'trajectory_report.map': 50,
+    'trajectory_report.map.movements': 1500,
+}
+RUNS = 3
+
+
+def import_time_ms(module: str) -> Optional[float]:
+    """Время импорта module в новом процессе, мс. None - модуль не
+    импортируется (например, не установлена зависимость)."""
+    env = dict(os.environ)
+    # Для импорта нужен адрес БД, подключение при этом не выполняется
+    env.setdefault('DATABASE_DEVELOPMENT', 'sqlite://')
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                          f'import {module}'],
+                         capture_output=True, text=True, env=env)
+    if res.returncode:
+        return None
+    for line in res.stderr.splitlines():
+        parts = [i.strip() for i in line.split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1000
+
+
+def main(modules) -> int:
+    failed = 0
+    for module in modules:
+        times = [i for i in (import_time_ms(module) for _ in range(RUNS))
+                 if i is not None]
+        ms = min(times) if times else None
+        budget = BUDGET_MS.get(module)
+        if ms is None:
+            status = 'не импортируется'
+        elif budget is not None and ms > budget:
+            status = f'ПРЕВЫШЕН бюджет {budget} мс'
+            failed += 1
+        else:
+            status = 'ok'
+        print(f'{module:<40} {ms or 0:>8.0f} мс  {status}')
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:] or list(BUDGET_MS)))
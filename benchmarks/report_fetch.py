@@ -0,0 +1,72 @@
+# (замер объема данных, запрашиваемых для каждого вида отчета)
+# Для каждого класса отчета запрашиваются только его REQUIRED_TABLES.
+# Скрипт считает кол-во запросов к БД, кол-во команд redis и объем
+# полученных данных (байт) по каждому виду отчета.
+# Запуск:
+#   python -m benchmarks.report_fetch 2023-08-01 2023-08-31 ПВТ1
+import sys
+import pandas as pd
+from sqlalchemy import event
+from trajectory_report.database import DB_ENGINE, REDIS_CONN
+from trajectory_report.report.CacheNamespace import key as cache_key
+from trajectory_report.report.ConstructReport import (
+    CachedReportDataGetter, report_data_factory, resolve_tables)
+from trajectory_report.report.Report import (Report,
+                                             ReportWithAdditionalColumns)
+from trajectory_report.map.movements import StatementsBindings
+
+
+REPORT_CLASSES = [Report, ReportWithAdditionalColumns, StatementsBindings]
+
+
+def count_db_round_trips(func, *args, **kwargs) -> tuple:
+    """Выполняет func и возвращает (результат, кол-во запросов к БД)"""
+    executed = []
+
+    def before_cursor_execute(conn, cursor, statement, *_):
+        executed.append(statement)
+
+    event.listen(DB_ENGINE, 'before_cursor_execute', before_cursor_execute)
+    try:
+        res = func(*args, **kwargs)
+    finally:
+        event.remove(DB_ENGINE, 'before_cursor_execute',
+                     before_cursor_execute)
+    return res, len(executed)
+
+
+def cached_bytes(tables) -> int:
+    """Размер ключей redis, которые читаются для набора таблиц"""
+    keys = [key for table in resolve_tables(tables)
+            for key in CachedReportDataGetter.TABLE_KEYS[table]]
+    statements = REDIS_CONN.hgetall(cache_key('statements'))
+    return sum(REDIS_CONN.strlen(cache_key(key)) for key in keys) \
+        + sum(len(k) + len(v) for k, v in statements.items())
+
+
+def frames_bytes(data: dict) -> int:
+    return sum(int(df.memory_usage(deep=True).sum())
+               for df in data.values())
+
+
+def main(date_from, date_to, division=None) -> pd.DataFrame:
+    res = []
+    for cls in REPORT_CLASSES:
+        for use_cache in (True, False):
+            data, round_trips = count_db_round_trips(
+                report_data_factory, date_from, date_to, division,
+                use_cache=use_cache, tables=cls.REQUIRED_TABLES)
+            res.append({
+                'report': cls.__name__,
+                'use_cache': use_cache,
+                'tables': len(data),
+                'db_round_trips': round_trips,
+                'redis_bytes': (cached_bytes(cls.REQUIRED_TABLES)
+                                if use_cache else 0),
+                'frames_bytes': frames_bytes(data)
+            })
+    return pd.DataFrame(res)
+
+
+if __name__ == "__main__":
+    print(main(*sys.argv[1:4]).to_string(index=False))
@@ -0,0 +1,391 @@
+# (синтетические данные для замеров: подразделения, сотрудники, объекты,
+# выходы, журнал со сменой устройств, отметки, кластеры и локации)
+# Данные детерминированы: одинаковые параметры и seed дают одинаковые
+# таблицы, поэтому замеры разных версий можно сравнивать между собой.
+# Загрузка в SQLite (или локальный MySQL) и подмена redis на fakeredis:
+#
+#     data = generate(n_employees=200, days=92)
+#     load(data, DB_ENGINE)
+#     use_fakeredis()
+import datetime as dt
+import math
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Index, MetaData, event
+from sqlalchemy.engine import Engine
+
+from trajectory_report.models import Base, SPATIAL_TABLES, location_column
+
+
+# Порядок загрузки (сначала таблицы, на которые ссылаются другие)
+TABLES = ['division', 'schedule', 'employees_site', 'objects_site',
+          'statements_site', 'journal_site', 'serves_site', 'clusters_site',
+          'coordinates', 'comment', 'frequency']
+
+# Центр, вокруг которого расположены объекты (Москва)
+CENTER = (55.75, 37.62)
+# Градусов широты в метре
+DEG_PER_M = 1 / 111320
+# Интервал между локациями, мин.
+LOCATION_INTERVAL = 2
+
+
+def _meters_to_degrees(lat: float, north_m, east_m):
+    d_lat = np.asarray(north_m) * DEG_PER_M
+    d_lon = np.asarray(east_m) * DEG_PER_M / np.cos(np.radians(lat))
+    return d_lat, d_lon
+
+
+def _visits(rnd: np.random.Generator, employees: pd.DataFrame,
+            objects: pd.DataFrame, stmts: pd.DataFrame) -> pd.DataFrame:
+    """
+    План посещений: для каждого выхода (кроме объекта 1) с вероятностью
+    0.8 сотрудник приходит к объекту. Время прихода последовательное в
+    течение дня, длительность 15-90 мин. 10% посещений смещены на
+    300-1500 м от объекта, чтобы часть кластеров не попадала в радиус.
+    """
+    visits = stmts[(stmts.object_id != 1)
+                   & (rnd.random(len(stmts)) < 0.8)] \
+        .merge(objects[['object_id', 'latitude', 'longitude']],
+               on='object_id') \
+        .sort_values(['name_id', 'date', 'object_id']) \
+        .reset_index(drop=True)
+    n = len(visits)
+    visits['order'] = visits.groupby(['name_id', 'date']).cumcount()
+    visits['duration'] = rnd.integers(15, 91, n)
+    # Начало дня 8:00-10:00, между посещениями 20-60 мин. дороги
+    day_start = visits.groupby(['name_id', 'date'])['order'] \
+        .transform(lambda x: rnd.integers(480, 601))
+    step = rnd.integers(20, 61, n) + visits['duration']
+    offset = step.groupby([visits.name_id, visits.date]).cumsum() - step
+    visits['start'] = pd.to_datetime(visits['date']) \
+        + pd.to_timedelta(day_start + offset, unit='min')
+    visits['end'] = visits['start'] \
+        + pd.to_timedelta(visits['duration'], unit='min')
+
+    far = rnd.random(n) < 0.1
+    distance = np.where(far, rnd.uniform(300, 1500, n),
+                        rnd.uniform(0, 50, n))
+    angle = rnd.uniform(0, 2 * np.pi, n)
+    d_lat, d_lon = _meters_to_degrees(CENTER[0], distance * np.cos(angle),
+                                      distance * np.sin(angle))
+    visits['latitude'] = visits['latitude'] + d_lat
+    visits['longitude'] = visits['longitude'] + d_lon
+    return visits
+
+
+def _trajectory(rnd: np.random.Generator, day: pd.DataFrame) -> tuple:
+    """Локации одного сотрудника за день: точки с шумом GPS ~15 м во
+    время посещений и точки на отрезках пути между ними"""
+    times, lats, lons = [], [], []
+    prev = None
+    for row in day.itertuples():
+        if prev is not None:
+            way = int((row.start - prev.end).total_seconds()
+                      // 60 // LOCATION_INTERVAL)
+            share = np.arange(1, way) / way
+            times.append(prev.end + pd.to_timedelta(
+                share * (row.start - prev.end).total_seconds(), unit='s'))
+            lats.append(prev.latitude + share
+                        * (row.latitude - prev.latitude))
+            lons.append(prev.longitude + share
+                        * (row.longitude - prev.longitude))
+        stay = pd.date_range(row.start, row.end,
+                             freq=f'{LOCATION_INTERVAL}min')
+        d_lat, d_lon = _meters_to_degrees(
+            row.latitude, rnd.normal(0, 15, len(stay)),
+            rnd.normal(0, 15, len(stay)))
+        times.append(stay)
+        lats.append(row.latitude + d_lat)
+        lons.append(row.longitude + d_lon)
+        prev = row
+    times = np.concatenate([np.asarray(i, dtype='datetime64[ns]')
+                            for i in times])
+    # Локации приходят с задержкой, около 3% теряются
+    keep = rnd.random(len(times)) > 0.03
+    return times[keep], np.concatenate(lats)[keep], \
+        np.concatenate(lons)[keep]
+
+
+def coordinates_for(visits: pd.DataFrame, seed: int = 0) -> pd.DataFrame:
+    """Таблица coordinates по плану посещений (subscriberID уже
+    определен для каждого посещения)"""
+    rnd = np.random.default_rng(seed)
+    res = []
+    for (subs_id, _), day in visits.groupby(['subscriberID', 'date']):
+        times, lats, lons = _trajectory(rnd, day)
+        res.append(pd.DataFrame({
+            'requestDate': times + np.timedelta64(1, 'm'),
+            'subscriberID': subs_id,
+            'locationDate': times,
+            'longitude': lons,
+            'latitude': lats,
+        }))
+    if not res:
+        return pd.DataFrame(columns=['requestDate', 'subscriberID',
+                                     'locationDate', 'longitude',
+                                     'latitude'])
+    return pd.concat(res, ignore_index=True).sort_values('requestDate') \
+        .reset_index(drop=True)
+
+
+def generate(n_employees: int = 10,
+             days: int = 31,
+             date_to: Optional[dt.date] = None,
+             coordinates_days: int = 2,
+             seed: int = 0) -> Dict[str, pd.DataFrame]:
+    """
+    Синтетические таблицы БД за days дней, заканчивая date_to
+    (по умолчанию - сегодня). Выходы заполнены ещё на 7 дней вперед.
+    Кластеры сформированы за прошедшие дни, локации (coordinates) - за
+    последние coordinates_days дней, включая date_to.
+    Возвращает {имя таблицы: DataFrame} в порядке TABLES.
+    """
+    rnd = np.random.default_rng(seed)
+    date_to = date_to or dt.date.today()
+    date_from = date_to - dt.timedelta(days=days - 1)
+    dates = pd.date_range(date_from, date_to + dt.timedelta(days=7)).date
+
+    n_divisions = max(1, n_employees // 100)
+    division = pd.DataFrame({
+        'id': np.arange(1, n_divisions + 1),
+        'division': [f'ПВТ{i}' for i in range(1, n_divisions + 1)]})
+    schedule = pd.DataFrame({'id': [1, 2, 3],
+                             'schedule': ['5/2', '2/2', 'ван']})
+
+    name_ids = np.arange(1, n_employees + 1)
+    employees = pd.DataFrame({
+        'name_id': name_ids,
+        'name': [f'Сотрудник {i:05d}' for i in name_ids],
+        'phone': [f'+79{i:09d}' for i in name_ids],
+        'address': [f'Адрес сотрудника {i}' for i in name_ids],
+        'hire_date': date_from - dt.timedelta(days=365),
+        'quit_date': None,
+        'division': (name_ids - 1) % n_divisions + 1,
+        'schedule': rnd.integers(1, 4, n_employees)})
+
+    # У каждого сотрудника 3-8 объектов в радиусе ~5 км от своей точки,
+    # точки сотрудников - в радиусе ~15 км от центра
+    per_employee = rnd.integers(3, 9, n_employees)
+    owner = np.repeat(name_ids, per_employee)
+    n_objects = len(owner)
+    home_lat, home_lon = _meters_to_degrees(
+        CENTER[0], rnd.normal(0, 7500, n_employees),
+        rnd.normal(0, 7500, n_employees))
+    obj_lat, obj_lon = _meters_to_degrees(
+        CENTER[0], rnd.normal(0, 2500, n_objects),
+        rnd.normal(0, 2500, n_objects))
+    object_ids = np.arange(2, n_objects + 2)
+    objects = pd.DataFrame({
+        'object_id': object_ids,
+        'name': [f'Подопечный {i:06d}' for i in object_ids],
+        'division': employees.division.to_numpy()[owner - 1],
+        'address': [f'Адрес подопечного {i}' for i in object_ids],
+        'phone': [f'+74{i:09d}' for i in object_ids],
+        'longitude': CENTER[1] + home_lon[owner - 1] + obj_lon,
+        'latitude': CENTER[0] + home_lat[owner - 1] + obj_lat,
+        'radius': None,
+        'active': True,
+        'no_payments': rnd.random(n_objects) < 0.05,
+    })
+    objects = pd.concat([pd.DataFrame({
+        'object_id': [1], 'name': [' БОЛЬНИЧНЫЙ/ОТПУСК/УВОЛ.'],
+        'division': [1], 'address': [''], 'phone': [''],
+        'longitude': [None], 'latitude': [None], 'radius': [None],
+        'active': [True], 'no_payments': [False]}), objects],
+        ignore_index=True)
+
+    # Выходы: каждый день к каждому своему объекту. В 2% дней сотрудник
+    # на больничном - выход к объекту 1 вместо объектов.
+    stmts = pd.DataFrame({
+        'name_id': np.repeat(owner, len(dates)),
+        'object_id': np.repeat(object_ids, len(dates)),
+        'date': np.tile(dates, n_objects)})
+    sick = pd.DataFrame({
+        'name_id': np.repeat(name_ids, len(dates)),
+        'date': np.tile(dates, n_employees)})
+    sick = sick[rnd.random(len(sick)) < 0.02]
+    stmts = stmts.merge(sick.assign(sick=True), how='left',
+                        on=['name_id', 'date'])
+    stmts = pd.concat([stmts[stmts['sick'].isna()],
+                       sick.assign(object_id=1)], ignore_index=True) \
+        .drop(columns='sick')
+    stmts['statement'] = np.where(stmts.object_id == 1, 'Б', 'В')
+    stmts['division'] = employees.division.to_numpy()[stmts.name_id - 1]
+    stmts = stmts.sort_values(['date', 'name_id', 'object_id']) \
+        .reset_index(drop=True)
+
+    # Журнал: у 20% сотрудников в середине периода меняется устройство
+    swap = rnd.random(n_employees) < 0.2
+    swap_date = np.array([date_from + dt.timedelta(
+        days=int(i)) for i in rnd.integers(1, max(days, 2), n_employees)])
+    journal = pd.DataFrame({
+        'name_id': name_ids,
+        'subscriberID': 1_000_000 + name_ids,
+        'period_init': date_from - dt.timedelta(days=30),
+        'period_end': np.where(swap, swap_date - dt.timedelta(days=1),
+                               None)})
+    journal = pd.concat([journal, pd.DataFrame({
+        'name_id': name_ids[swap],
+        'subscriberID': 2_000_000 + name_ids[swap],
+        'period_init': swap_date[swap],
+        'period_end': None})], ignore_index=True)
+
+    visits = _visits(rnd, employees, objects,
+                     stmts[stmts.date <= date_to])
+    period_init = pd.Series(swap_date, index=name_ids)
+    swapped = swap[visits.name_id - 1] & \
+        (visits.date >= period_init[visits.name_id].to_numpy())
+    visits['subscriberID'] = np.where(swapped, 2_000_000, 1_000_000) \
+        + visits.name_id
+
+    past = visits[visits.date < date_to]
+    clusters = pd.DataFrame({
+        'subscriberID': past.subscriberID,
+        'date': past.date,
+        'datetime': past.start,
+        'longitude': past.longitude,
+        'latitude': past.latitude,
+        'leaving_datetime': past.end,
+        'cluster': past.order}).reset_index(drop=True)
+
+    # Отметки: 5% выходов без посещения подтверждены вручную
+    no_visit = stmts[(stmts.object_id != 1) & (stmts.date < date_to)] \
+        .merge(visits[['name_id', 'object_id', 'date']], how='left',
+               on=['name_id', 'object_id', 'date'], indicator=True)
+    no_visit = no_visit[no_visit['_merge'] == 'left_only']
+    serves = no_visit[rnd.random(len(no_visit)) < 0.05] \
+        .loc[:, ['name_id', 'object_id', 'date']]
+    serves['comment'] = ''
+    serves['address'] = ''
+    serves['approval'] = rnd.choice([1, 3], len(serves))
+
+    coordinates = coordinates_for(
+        visits[visits.date > date_to - dt.timedelta(days=coordinates_days)],
+        seed)
+
+    # Комментарий и частота посещений - у 30% сотрудников к первому объекту
+    extra = pd.DataFrame({'object_id': object_ids, 'name_id': owner}) \
+        .drop_duplicates('name_id') \
+        .sample(frac=0.3, random_state=seed)
+    extra['division_id'] = employees.division.to_numpy()[extra.name_id - 1]
+    extra = extra.rename(columns={'name_id': 'employee_id'})
+    comment = extra.assign(comment='Комментарий')
+    frequency = extra.assign(frequency=rnd.integers(1, 4, len(extra)))
+
+    return {'division': division,
+            'schedule': schedule,
+            'employees_site': employees,
+            'objects_site': objects,
+            'statements_site': stmts,
+            'journal_site': journal,
+            'serves_site': serves.reset_index(drop=True),
+            'clusters_site': clusters,
+            'coordinates': coordinates,
+            'comment': comment.reset_index(drop=True),
+            'frequency': frequency.reset_index(drop=True)}
+
+
+def _sqlite_point(longitude, latitude):
+    return f'POINT({longitude} {latitude})'
+
+
+def _sqlite_xy(point: str) -> tuple:
+    longitude, latitude = point[len('POINT('):-1].split()
+    return float(longitude), float(latitude)
+
+
+def _sqlite_envelope(point1: str, point2: str) -> str:
+    return f'{point1};{point2}'
+
+
+def _sqlite_mbr_contains(envelope: str, point: str) -> int:
+    (x1, y1), (x2, y2) = map(_sqlite_xy, envelope.split(';'))
+    x, y = _sqlite_xy(point)
+    return int(x1 <= x <= x2 and y1 <= y <= y2)
+
+
+def _sqlite_distance_sphere(point1: str, point2: str, radius: float) -> float:
+    (lon1, lat1), (lon2, lat2) = _sqlite_xy(point1), _sqlite_xy(point2)
+    p = math.pi / 180
+    a = 0.5 - math.cos((lat2 - lat1) * p) / 2 \
+        + math.cos(lat1 * p) * math.cos(lat2 * p) \
+        * (1 - math.cos((lon2 - lon1) * p)) / 2
+    return 2 * radius * math.asin(math.sqrt(a))
+
+
+def _register_sqlite_functions(dbapi_conn, _):
+    # Вычисляемые столбцы location используют функцию MySQL point().
+    # В SQLite её нет, а функции в вычисляемых столбцах должны быть
+    # детерминированными.
+    dbapi_conn.create_function('point', 2, _sqlite_point,
+                               deterministic=True)
+    # Функции MySQL из construct_select.attends_in_radius
+    # (REPORT_BASE['SQL_DISTANCE'])
+    dbapi_conn.create_function('ST_MakeEnvelope', 2, _sqlite_envelope,
+                               deterministic=True)
+    dbapi_conn.create_function('MBRContains', 2, _sqlite_mbr_contains,
+                               deterministic=True)
+    dbapi_conn.create_function('ST_Distance_Sphere', 3,
+                               _sqlite_distance_sphere, deterministic=True)
+    dbapi_conn.create_function('cos', 1, math.cos, deterministic=True)
+    dbapi_conn.create_function('radians', 1, math.radians,
+                               deterministic=True)
+
+
+def _schema(engine: Engine, spatial: bool = False) -> MetaData:
+    """
+    Схема для загрузки. В рабочей БД период журнала без окончания,
+    объект 1 без координат и т.д. хранятся как NULL, а в моделях эти
+    столбцы не отмечены nullable. Поэтому для SQLite схема копируется
+    с разрешенными NULL, модели при этом не меняются.
+    spatial - добавить столбцы location (как после миграции
+    migrations.spatial_location).
+    """
+    sqlite = engine.dialect.name == 'sqlite'
+    if not sqlite and not spatial:
+        return Base.metadata
+    metadata = MetaData()
+    for table in Base.metadata.sorted_tables:
+        table.to_metadata(metadata)
+    for table in metadata.tables.values():
+        for column in table.columns:
+            if sqlite and not column.primary_key:
+                column.nullable = True
+    if spatial:
+        for name, index in SPATIAL_TABLES.items():
+            table = metadata.tables[name]
+            table.append_column(location_column())
+            Index(index, table.c.location, mysql_prefix='SPATIAL')
+    return metadata
+
+
+def load(data: Dict[str, pd.DataFrame], engine: Engine,
+         spatial: bool = False) -> None:
+    """Создание таблиц и загрузка данных generate(). Существующие
+    таблицы удаляются. spatial - см. _schema."""
+    if engine.dialect.name == 'sqlite' and not event.contains(
+            engine, 'connect', _register_sqlite_functions):
+        event.listen(engine, 'connect', _register_sqlite_functions)
+        engine.dispose()
+    metadata = _schema(engine, spatial)
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        for table in TABLES:
+            data[table].to_sql(table, conn, if_exists='append',
+                               index=False, chunksize=10_000)
+
+
+def use_fakeredis():
+    """Подменяет соединение redis (database.REDIS_CONN) на fakeredis.
+    Возвращает новое соединение (кэш пустой)."""
+    import fakeredis
+    from trajectory_report import database
+    from trajectory_report.report import ConstructReport
+    r_conn = fakeredis.FakeRedis()
+    database.REDIS_CONN = r_conn
+    ConstructReport._redis_health.update(available=False, checked_at=None)
+    return r_conn
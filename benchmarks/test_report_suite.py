@@ -0,0 +1,97 @@
+# (замеры времени формирования отчетов и карт на синтетических данных)
+# Замеры pytest-benchmark для 10/200/2000 сотрудников (conftest.py) и
+# отчетов за день, месяц и 3 месяца до вчерашнего дня. Каждый случай -
+# один прогон для прогрева (и заполнения кэша) и ROUNDS замеров.
+# Результат сохраняется в json, чтобы сравнивать версии между собой:
+#   python -m pytest benchmarks --benchmark-json=bench.json
+#   python -m pytest benchmarks -k "10emp or 200emp" --benchmark-save=base
+#   python -m pytest benchmarks --benchmark-compare=0001
+#   pytest-benchmark compare 0001 0002 --group-by=group
+# Тесты не входят в обычный прогон (testpaths = tests в pytest.ini).
+import datetime as dt
+
+import pytest
+
+from trajectory_report import database
+from trajectory_report.report.ClusterGenerator import prepare_clusters
+from trajectory_report.report.Report import (Report,
+                                             ReportWithAdditionalColumns,
+                                             OneEmployeeReport)
+from trajectory_report.map.movements import (MapMovements, MapBindings,
+                                             StatementsBindings)
+
+PERIODS = {'day': 1, 'month': 31, '3months': 92}
+# Кол-во замеров каждого случая (после одного прогрева)
+ROUNDS = 3
+PERIOD_CASES = ['Report', 'Report(use_cache=False)',
+                'ReportWithAdditionalColumns', 'Report.horizontal_report',
+                'Report.xlsx', 'Report.as_json_dict', 'MapBindings',
+                'StatementsBindings']
+DAY_CASES = ['OneEmployeeReport', 'MapMovements', 'MapMovements.map_html',
+             'prepare_clusters']
+YESTERDAY = dt.date.today() - dt.timedelta(days=1)
+
+
+def period_cases(date_from: dt.date, date_to: dt.date) -> dict:
+    """Замеры, зависящие от периода отчета"""
+    report = Report(date_from, date_to)
+    return {
+        'Report': lambda: Report(date_from, date_to),
+        'Report(use_cache=False)':
+            lambda: Report(date_from, date_to, use_cache=False),
+        'ReportWithAdditionalColumns':
+            lambda: ReportWithAdditionalColumns(date_from, date_to),
+        'Report.horizontal_report': lambda: report.horizontal_report,
+        'Report.xlsx': report.xlsx,
+        'Report.as_json_dict': lambda: report.as_json_dict,
+        'MapBindings': lambda: MapBindings(date_from, date_to),
+        'StatementsBindings': lambda: StatementsBindings(date_from, date_to),
+    }
+
+
+def day_cases(data: dict, date: dt.date) -> dict:
+    """Замеры одного дня: индивидуальный отчет, карта, кластеры по
+    локациям всех сотрудников за день"""
+    coordinates = data['coordinates']
+    coordinates = coordinates[coordinates.requestDate.dt.date == date]
+    name_id = int(data['employees_site'].name_id.iloc[0])
+    division = int(data['employees_site'].division.iloc[0])
+    return {
+        'OneEmployeeReport': lambda: OneEmployeeReport(name_id, date,
+                                                       division),
+        'MapMovements': lambda: MapMovements(name_id, date, division),
+        'MapMovements.map_html':
+            lambda: MapMovements(name_id, date, division).map_html,
+        'prepare_clusters': lambda: prepare_clusters(coordinates),
+    }
+
+
+def _extra_info(data: dict) -> dict:
+    return {'employees': len(data['employees_site']),
+            'statements': len(data['statements_site']),
+            'clusters': len(data['clusters_site']),
+            'coordinates': len(data['coordinates']),
+            'database': database.DB_ENGINE.dialect.name}
+
+
+@pytest.fixture(scope='session', params=list(PERIODS))
+def period(request, scale):
+    """Случаи period_cases за период request.param и данные scale"""
+    date_from = YESTERDAY - dt.timedelta(days=PERIODS[request.param] - 1)
+    return request.param, scale, period_cases(date_from, YESTERDAY)
+
+
+@pytest.mark.parametrize('case', PERIOD_CASES)
+def test_period(benchmark, period, case):
+    name, data, cases = period
+    benchmark.group = f'{len(data["employees_site"])} employees, {name}'
+    benchmark.extra_info.update(_extra_info(data), period=name)
+    benchmark.pedantic(cases[case], warmup_rounds=1, rounds=ROUNDS)
+
+
+@pytest.mark.parametrize('case', DAY_CASES)
+def test_day(benchmark, scale, case):
+    benchmark.group = f'{len(scale["employees_site"])} employees, one day'
+    benchmark.extra_info.update(_extra_info(scale), period=None)
+    benchmark.pedantic(day_cases(scale, YESTERDAY)[case], warmup_rounds=1,
+                       rounds=ROUNDS)
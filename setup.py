@@ -18,4 +18,9 @@ setup(
         'aiohttp==3.8.4',
         'python-dotenv'
     ],
+    extras_require={
+        'parquet': ['pyarrow'],
+        'test': ['pytest', 'fakeredis[lua]', 'pyarrow'],
+        'bench': ['pytest', 'pytest-benchmark', 'fakeredis[lua]'],
+    },
 )
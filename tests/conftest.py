@@ -0,0 +1,44 @@
+# (общие фикстуры тестов: синтетические данные в SQLite и fakeredis)
+import pytest
+from sqlalchemy import create_engine
+
+from benchmarks.synthetic import generate, load, use_fakeredis
+from trajectory_report import database
+
+
+@pytest.fixture(scope='session')
+def synthetic():
+    """Синтетические таблицы: 20 сотрудников за 60 дней до сегодня
+    (период начинается раньше окна кэша)"""
+    return generate(n_employees=20, days=60)
+
+
+@pytest.fixture
+def make_db(tmp_path, monkeypatch):
+    """Загружает таблицы (как generate) в SQLite и подставляет ее вместо
+    database.DB_ENGINE"""
+    engines = []
+
+    def make(data, **kwargs):
+        engine = create_engine(f'sqlite:///{tmp_path / f"tr{len(engines)}.db"}')
+        load(data, engine, **kwargs)
+        monkeypatch.setattr(database, 'DB_ENGINE', engine, raising=False)
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.dispose()
+
+
+@pytest.fixture
+def db(synthetic, make_db):
+    """SQLite с синтетическими данными вместо database.DB_ENGINE"""
+    return make_db(synthetic)
+
+
+@pytest.fixture
+def redis_conn(monkeypatch):
+    """Пустой fakeredis вместо database.REDIS_CONN"""
+    monkeypatch.setattr(database, 'REDIS_CONN', None, raising=False)
+    return use_fakeredis()
@@ -0,0 +1,42 @@
+# (кэш кластеров: дни, за которые кластеры ещё не сформированы)
+import datetime as dt
+
+from trajectory_report.report.CacheNamespace import key as cache_key
+from trajectory_report.report.ConstructReport import (CLUSTERS_KEY,
+                                                      append_clusters)
+from trajectory_report.report.Report import Report
+from tests.test_report_cache import assert_reports_equal
+
+TODAY = dt.date.today()
+YESTERDAY = TODAY - dt.timedelta(days=1)
+PERIOD = (TODAY - dt.timedelta(days=7), YESTERDAY)
+
+
+def _without_yesterday(synthetic):
+    """Данные до запуска gather/clusters за вчера и кластеры за вчера"""
+    clusters = synthetic['clusters_site']
+    dates = clusters['date'].astype(str)
+    data = dict(synthetic, clusters_site=clusters[dates != str(YESTERDAY)])
+    return data, clusters[dates == str(YESTERDAY)]
+
+
+def test_day_without_clusters_is_not_cached(synthetic, make_db, redis_conn):
+    data, yesterday = _without_yesterday(synthetic)
+    engine = make_db(data)
+    Report(*PERIOD)
+    assert not redis_conn.hexists(cache_key(CLUSTERS_KEY), str(YESTERDAY))
+
+    # gather/clusters записал кластеры в БД, но не в кэш
+    yesterday.to_sql('clusters_site', engine, if_exists='append', index=False)
+    assert_reports_equal(Report(*PERIOD), Report(*PERIOD, use_cache=False))
+
+
+def test_append_clusters(synthetic, make_db, redis_conn):
+    data, yesterday = _without_yesterday(synthetic)
+    engine = make_db(data)
+    Report(*PERIOD)
+
+    yesterday.to_sql('clusters_site', engine, if_exists='append', index=False)
+    append_clusters(YESTERDAY, yesterday)
+    assert redis_conn.hexists(cache_key(CLUSTERS_KEY), str(YESTERDAY))
+    assert_reports_equal(Report(*PERIOD), Report(*PERIOD, use_cache=False))
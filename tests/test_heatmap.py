@@ -0,0 +1,65 @@
+# (шестиугольные ячейки тепловой карты)
+import numpy as np
+
+from trajectory_report.map.heatmap import (METERS_PER_DEGREE, MapHeatmap,
+                                           hex_bin, hex_corners)
+from tests.test_report_cache import PERIODS
+
+LAT0, LNG0 = 55.75, 37.62
+SIZE_M = 250
+
+
+def _centers(q: np.ndarray, r: np.ndarray) -> tuple:
+    """Центры ячеек (среднее вершин без замыкающей)"""
+    lat, lng = hex_corners(q, r, SIZE_M, LAT0, LNG0)
+    return lat[:, :6].mean(axis=1), lng[:, :6].mean(axis=1)
+
+
+def _to_meters(lat: np.ndarray, lng: np.ndarray) -> tuple:
+    return ((lng - LNG0) * METERS_PER_DEGREE * np.cos(np.radians(LAT0)),
+            (lat - LAT0) * METERS_PER_DEGREE)
+
+
+def test_cell_centers_bin_to_themselves():
+    q, r = np.meshgrid(np.arange(-5, 6), np.arange(-5, 6))
+    q, r = q.ravel(), r.ravel()
+    lat, lng = _centers(q, r)
+    found_q, found_r = hex_bin(lat, lng, SIZE_M, LAT0, LNG0)
+    assert np.array_equal(found_q, q) and np.array_equal(found_r, r)
+
+
+def test_points_bin_to_nearest_center():
+    rng = np.random.default_rng(0)
+    lat = LAT0 + rng.uniform(-0.02, 0.02, 2000)
+    lng = LNG0 + rng.uniform(-0.03, 0.03, 2000)
+    q, r = hex_bin(lat, lng, SIZE_M, LAT0, LNG0)
+    x, y = _to_meters(lat, lng)
+    cx, cy = _to_meters(*_centers(q, r))
+    distance = np.hypot(x - cx, y - cy)
+    # Точка внутри шестиугольника: не дальше вершины
+    assert (distance <= SIZE_M + 1e-6).all()
+    # и не дальше центра любой из шести соседних ячеек
+    for dq, dr in ((1, 0), (-1, 0), (0, 1), (0, -1), (1, -1), (-1, 1)):
+        nx, ny = _to_meters(*_centers(q + dq, r + dr))
+        assert (distance <= np.hypot(x - nx, y - ny) + 1e-6).all()
+
+
+def test_corners_are_closed_hexagon():
+    lat, lng = hex_corners(np.array([0, 3]), np.array([0, -2]),
+                           SIZE_M, LAT0, LNG0)
+    assert lat.shape == lng.shape == (2, 7)
+    assert np.allclose(lat[:, 0], lat[:, 6]) \
+        and np.allclose(lng[:, 0], lng[:, 6])
+    x, y = _to_meters(lat, lng)
+    # Все стороны равны size_m
+    sides = np.hypot(np.diff(x, axis=1), np.diff(y, axis=1))
+    assert np.allclose(sides, SIZE_M)
+
+
+def test_heatmap_cells_sum_stays(db, redis_conn):
+    heatmap = MapHeatmap(*PERIODS['hybrid'], use_cache=False)
+    stays = heatmap._stays
+    assert len(stays)
+    assert heatmap.cells.visits.sum() == len(stays)
+    assert np.isclose(heatmap.cells.hours.sum(), stays.hours.sum())
+    assert len(heatmap.as_geojson()['features']) == len(heatmap.cells)
@@ -0,0 +1,82 @@
+# (subscriberID сотрудника на дату по журналу)
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+from trajectory_report.report.JournalIndex import JournalIndex
+
+DAY = dt.date(2023, 8, 1)
+
+
+def _day(n: int) -> dt.date:
+    return DAY + dt.timedelta(days=n)
+
+
+def _journal() -> pd.DataFrame:
+    # name_id, subscriberID, period_init, period_end
+    rows = [(1, 11, _day(0), _day(9)), (1, 12, _day(10), None),
+            # 22 - вложенный период внутри более длинного 21
+            (2, 21, _day(0), _day(15)), (2, 22, _day(3), _day(6)),
+            (3, 31, _day(0), _day(2)),
+            # Между периодами 41 и 42 устройства нет
+            (4, 41, _day(0), _day(2)), (4, 42, _day(6), _day(8)),
+            # 52 начался позже и закончился позже 51
+            (5, 51, _day(0), _day(5)), (5, 52, _day(3), _day(9))]
+    return pd.DataFrame(rows, columns=['name_id', 'subscriberID',
+                                       'period_init', 'period_end'])
+
+
+def _covering(journal: pd.DataFrame, name_id: int, date: dt.date):
+    """Периоды, действующие на дату (period_init <= date <= period_end,
+    как при объединении со всем журналом); из нескольких - начавшийся
+    позже"""
+    period_end = journal.period_end.fillna(dt.date.today())
+    periods = journal[(journal.name_id == name_id)
+                      & (journal.period_init <= date)
+                      & (date <= period_end)]
+    if not len(periods):
+        return None
+    return int(periods.sort_values('period_init').subscriberID.iloc[-1])
+
+
+def test_subscriber_id():
+    index = JournalIndex(_journal())
+    assert index.subscriber_id(1, DAY) == 11
+    assert index.subscriber_id(1, '2023-08-10') == 11
+    assert index.subscriber_id(1, '2023-08-11') == 12
+    # После окончания периода
+    assert index.subscriber_id(3, '2023-08-04') is None
+    # Между периодами устройства нет
+    assert index.subscriber_id(4, '2023-08-04') is None
+    assert index.subscriber_id(4, '2023-08-07') == 42
+    # До первого периода и неизвестный сотрудник
+    assert index.subscriber_id(1, '2023-07-31') is None
+    assert index.subscriber_id(9, DAY) is None
+    # Пересекающиеся периоды: берется начавшийся позже
+    assert index.subscriber_id(2, '2023-08-05') == 22
+    assert index.subscriber_id(5, '2023-08-05') == 52
+    # После окончания вложенного периода - снова действующий ранний
+    assert index.subscriber_id(2, '2023-08-08') == 21
+    assert index.subscriber_id(2, '2023-08-16') == 21
+    assert index.subscriber_id(2, '2023-08-17') is None
+    # Открытый период действует по сегодня
+    assert index.subscriber_id(1, dt.date.today()) == 12
+
+
+def test_attach_keeps_rows_and_matches_interval_filter():
+    journal = _journal()
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'name_id': rng.integers(1, 7, 300),
+        'date': [_day(int(i)) for i in rng.integers(-3, 20, 300)],
+    }, index=rng.permutation(np.arange(1000, 1300)))
+
+    attached = JournalIndex(journal).attach(df)
+    assert attached.index.equals(df.index)
+    assert attached[['name_id', 'date']].equals(df)
+    expected = [_covering(journal, name_id, date)
+                for name_id, date in zip(df.name_id, df.date)]
+    assert attached['j_exist'].tolist() == [i is not None for i in expected]
+    assert [None if pd.isna(i) else int(i)
+            for i in attached['subscriberID']] == expected
@@ -0,0 +1,39 @@
+# (анализ доступности телефонов подразделения)
+import datetime as dt
+
+from sqlalchemy import text
+
+from trajectory_report.report.ConstructReport import report_data_factory
+from trajectory_report.report.LocationAnalytics import location_stats
+from trajectory_report.report.Report import OneEmployeeReport
+
+TODAY = dt.date.today()
+
+
+def test_location_stats_match_one_employee_report(db, redis_conn):
+    # Часть локаций без ответа: периоды недоступности разной длины
+    with db.begin() as conn:
+        conn.execute(text('UPDATE coordinates SET locationDate = NULL '
+                          'WHERE rowid % 7 IN (0, 1, 2) OR rowid % 11 = 0'))
+    date_from = TODAY - dt.timedelta(days=1)
+    stats = location_stats(date_from, TODAY, use_cache=False)
+    assert len(stats)
+    assert stats.recommended_for_checkout.any()
+
+    stmts = report_data_factory(date_from, TODAY, use_cache=False,
+                                tables={'journal'})['_stmts']
+    divisions = dict(zip(stmts.name_id, stmts.division))
+    for row in stats.itertuples():
+        report = OneEmployeeReport(row.name_id, row.date,
+                                   divisions[row.name_id])
+        assert row.recommended_for_checkout == \
+            report.recommended_for_checkout
+        expected = report.stats.droplevel(0, axis=1)
+        for state, prefix in ((True, 'available'), (False, 'unavailable')):
+            if state in expected.index:
+                assert getattr(row, f'{prefix}_sum') == \
+                    expected.loc[state, 'sum']
+                assert getattr(row, f'{prefix}_count') == \
+                    expected.loc[state, 'count']
+            else:
+                assert getattr(row, f'{prefix}_count') == 0
@@ -0,0 +1,32 @@
+# (карта привязок: с отчетом, без отчета и слои из кэша)
+import datetime as dt
+
+from trajectory_report.map.movements import MapBindings, StatementsBindings
+from trajectory_report.report.Report import Report
+from tests.test_report_cache import assert_reports_equal
+
+TODAY = dt.date.today()
+DATE_FROM, DATE_TO = TODAY - dt.timedelta(days=7), TODAY - dt.timedelta(days=1)
+
+
+def test_map_bindings_is_report(db, redis_conn):
+    bindings = MapBindings(DATE_FROM, DATE_TO, 1)
+    assert isinstance(bindings, Report)
+    assert_reports_equal(bindings, Report(DATE_FROM, DATE_TO, 1))
+
+
+def test_statements_bindings(db, redis_conn):
+    bindings = MapBindings(DATE_FROM, DATE_TO, 1)
+    statements = StatementsBindings(DATE_FROM, DATE_TO, 1)
+    assert statements.report is None
+    assert statements._clusters is None
+    assert statements.layer_geojson(3) == bindings.layer_geojson(3)
+    assert len(statements.layer_geojson(3)['features'])
+
+
+def test_cached_layer_normalizes_key(db, redis_conn):
+    layer = MapBindings.cached_layer(str(DATE_FROM), str(DATE_TO), '1', '3')
+    assert layer == StatementsBindings(DATE_FROM, DATE_TO, 1) \
+        .layer_geojson(3)
+    assert MapBindings.cached_layer(DATE_FROM, DATE_TO, 1, 3) == layer
+    assert len(redis_conn.keys('*map_bindings*')) == 1
@@ -0,0 +1,76 @@
+# (карта передвижений за прошедший день из кэша redis)
+import datetime as dt
+
+import pandas as pd
+from sqlalchemy import event, text
+
+from trajectory_report.map.movements import MapMovements
+from trajectory_report.report.JournalIndex import JournalIndex
+
+YESTERDAY = dt.date.today() - dt.timedelta(days=1)
+
+
+def test_cached_json_follows_statements(db, redis_conn):
+    cached = MapMovements.cached_json(1, YESTERDAY, 1)
+    # Повторный запрос - из кэша (карта с теми же id элементов)
+    assert MapMovements.cached_json(1, YESTERDAY, 1) == cached
+
+    # Выход изменен в БД без invalidate: карта формируется заново
+    with db.begin() as conn:
+        conn.execute(text('DELETE FROM statements_site WHERE name_id = 1 '
+                          'AND object_id = 2 AND date = :date'),
+                     {'date': str(YESTERDAY)})
+    changed = MapMovements.cached_json(1, YESTERDAY, 1)
+    assert changed['map'] != cached['map']
+    assert changed.get('report') == \
+        MapMovements(1, YESTERDAY, 1).as_json_dict.get('report')
+
+
+def _statements_log(db):
+    """Список, в который записываются запросы к db"""
+    executed = []
+
+    @event.listens_for(db, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, *_):
+        executed.append(statement)
+    return executed
+
+
+def test_cached_json_hit_skips_locations(db, redis_conn):
+    cached = MapMovements.cached_json(1, YESTERDAY, 1)
+    executed = _statements_log(db)
+    assert MapMovements.cached_json(1, YESTERDAY, 1) == cached
+    # Локации не читаются: только их кол-во и последний locationID
+    assert not [i for i in executed if 'coordinates.latitude' in i]
+    assert [i for i in executed if 'max(coordinates."locationID")' in i]
+
+    # Новая локация устройства за день меняет версию: карта формируется
+    # заново
+    with db.connect() as conn:
+        journal = pd.read_sql(text('SELECT * FROM journal_site'), conn)
+    subscriber_id = JournalIndex(journal).subscriber_id(1, YESTERDAY)
+    with db.begin() as conn:
+        conn.execute(text(
+            'INSERT INTO coordinates ("requestDate", "subscriberID", '
+            '"locationDate", longitude, latitude) '
+            'SELECT "requestDate", "subscriberID", "locationDate", '
+            'longitude, latitude FROM coordinates '
+            'WHERE "subscriberID" = :subscriber_id '
+            'AND date("requestDate") = :date LIMIT 1'),
+            {'subscriber_id': subscriber_id, 'date': str(YESTERDAY)})
+    executed.clear()
+    MapMovements.cached_json(1, YESTERDAY, 1)
+    assert [i for i in executed if 'coordinates.latitude' in i]
+
+
+def test_points_layer_payload(db, redis_conn):
+    movements = MapMovements(1, YESTERDAY, 1)
+    page = movements.map.get_root().render()
+    # Одна вставка данных на все точки, без объектов GeoJSON и Marker
+    assert page.count('var data = ') == 1
+    assert '"Feature"' not in page
+    assert page.count('L.polyline.antPath(') == 1
+    # Кириллица без \u-последовательностей
+    name = movements._stmts.object.iloc[0]
+    assert name in page
+    assert '\\u04' not in page
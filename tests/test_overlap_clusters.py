@@ -0,0 +1,47 @@
+# (кластеры перекрывающихся точек на карте)
+import numpy as np
+
+from trajectory_report.map.movements import MapsBase
+
+LAT0, LNG0 = 55.75, 37.62
+
+
+def _brute_force(lat: np.ndarray, lng: np.ndarray,
+                 radius_m: float) -> np.ndarray:
+    """Компоненты связности по всем парам точек (номер - первая точка)"""
+    cos_lat = np.cos(np.radians(np.nanmean(lat)))
+    d = np.hypot((lat[:, None] - lat[None, :]) * 111320,
+                 (lng[:, None] - lng[None, :]) * 111320 * cos_lat)
+    close = d <= radius_m
+    labels = np.arange(len(lat))
+    for i in range(len(lat)):
+        if labels[i] != i:
+            continue
+        stack = [i]
+        while stack:
+            j = stack.pop()
+            for k in np.flatnonzero(close[j]):
+                if labels[k] == k and k > i:
+                    labels[k] = i
+                    stack.append(k)
+    return labels
+
+
+def test_chain_and_missing_coordinates():
+    # Точки 0-1-2 цепочкой через 4 м, точка 3 в 20 м, точка 4 без координат
+    step = 4 / 111320
+    lat = np.array([LAT0, LAT0 + step, LAT0 + 2 * step, LAT0 + 20 * step,
+                    np.nan])
+    lng = np.array([LNG0] * 4 + [np.nan])
+    labels = MapsBase._overlap_clusters(lat, lng, 5)
+    assert labels.tolist() == [0, 0, 0, 3, 4]
+
+
+def test_matches_brute_force():
+    rng = np.random.default_rng(0)
+    for size in (1, 2, 50, 400):
+        # Около 100 м на 100 м: много соседних и связанных цепочкой точек
+        lat = LAT0 + rng.uniform(0, 0.001, size)
+        lng = LNG0 + rng.uniform(0, 0.0016, size)
+        assert np.array_equal(MapsBase._overlap_clusters(lat, lng, 5),
+                              _brute_force(lat, lng, 5))
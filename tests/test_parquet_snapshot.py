@@ -0,0 +1,32 @@
+# (отчет из снимка parquet)
+from sqlalchemy import text
+
+from trajectory_report.report.ParquetSnapshot import (
+    ParquetReportDataGetter, export_snapshot)
+from trajectory_report.report.Report import Report
+from tests.test_report_cache import PERIODS, assert_reports_equal
+
+
+def test_report_from_snapshot(db, redis_conn, tmp_path):
+    date_from, date_to = PERIODS['hybrid']
+    export_snapshot(str(tmp_path), date_from, date_to, db)
+    source = ParquetReportDataGetter(str(tmp_path))
+    assert_reports_equal(Report(date_from, date_to, source=source),
+                         Report(date_from, date_to, use_cache=False))
+
+
+def test_snapshot_without_dated_rows(db, redis_conn, tmp_path):
+    """Служебных записок за период нет: каталог serves не создается"""
+    with db.begin() as conn:
+        conn.execute(text('DELETE FROM serves_site'))
+    date_from, date_to = PERIODS['hybrid']
+    export_snapshot(str(tmp_path), date_from, date_to, db)
+    assert not (tmp_path / 'serves').exists()
+
+    source = ParquetReportDataGetter(str(tmp_path))
+    serves = source.get_data(date_from, date_to)['_serves']
+    assert not len(serves)
+    assert list(serves.columns) == ['name_id', 'object_id', 'date',
+                                    'approval']
+    assert_reports_equal(Report(date_from, date_to, source=source),
+                         Report(date_from, date_to, use_cache=False))
@@ -0,0 +1,40 @@
+# (замеры этапов отчета)
+import threading
+import tracemalloc
+
+import pytest
+
+from trajectory_report import profiling
+from trajectory_report.config import PROFILING
+
+
+@pytest.fixture
+def memory_profiling(monkeypatch):
+    monkeypatch.setitem(PROFILING, 'ENABLED', True)
+    monkeypatch.setitem(PROFILING, 'MEMORY', True)
+    monkeypatch.setitem(PROFILING, 'LOG', False)
+    profiling.reset()
+    yield
+    profiling.reset()
+    # span запускает tracemalloc, он замедляет остальные тесты
+    tracemalloc.stop()
+
+
+def test_memory_only_in_main_thread(memory_profiling):
+    spans = dict()
+
+    def worker():
+        with profiling.span('worker') as s:
+            data = [0] * 100_000
+        spans['worker'] = s
+        del data
+
+    with profiling.span('main') as s:
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        data = [0] * 100_000
+    del data
+    assert spans['worker'].memory_peak is None
+    assert spans['worker'].seconds is not None
+    assert s.memory_peak >= 100_000 * 8
@@ -0,0 +1,95 @@
+# (замеры запросов к БД)
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from trajectory_report import query_metrics
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "metrics.db"}',
+                           poolclass=query_metrics.TimedQueuePool,
+                           pool_size=1, max_overflow=0)
+    query_metrics.reset()
+    query_metrics.install(engine)
+    yield engine
+    query_metrics.uninstall(engine)
+    engine.dispose()
+
+
+def test_queries_and_rows(engine):
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE t (x INTEGER)'))
+        conn.execute(text('INSERT INTO t VALUES (1), (2), (3)'))
+        conn.execute(text('SELECT x FROM t WHERE x > 1')).fetchall()
+    queries = query_metrics.stats()['queries']
+    assert queries['INSERT INTO t VALUES (?), (?), (?)']['rows'] == 3
+    select = queries['SELECT x FROM t WHERE x > ?']
+    assert select['count'] == 1
+    # SQLite для SELECT сообщает rowcount -1: кол-во строк неизвестно,
+    # а не 0
+    assert select['rows_unknown'] == 1
+    assert queries['INSERT INTO t VALUES (?), (?), (?)']['rows_unknown'] == 0
+
+
+def test_select_rows_from_buffered_cursor():
+    """Драйверы с буферизованным результатом (mysqlconnector, MySQLdb)
+    знают кол-во строк SELECT сразу после выполнения"""
+    query_metrics.reset()
+    conn = SimpleNamespace(info={'query_metrics_started': [
+        ('SELECT x FROM t', time.perf_counter())]})
+    cursor = SimpleNamespace(rowcount=2, description=[('x',)])
+    query_metrics._after_cursor_execute(conn, cursor, 'SELECT x FROM t',
+                                        {}, None, False)
+    select = query_metrics.stats()['queries']['SELECT x FROM t']
+    assert select['rows'] == 2 and select['rows_unknown'] == 0
+
+
+def test_failed_query_does_not_leak_start_time(engine):
+    with engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text('SELECT * FROM missing'))
+        assert not conn.info['query_metrics_started']
+
+
+def test_pool_events(engine):
+    with engine.connect() as conn:
+        conn.execute(text('SELECT 1'))
+    engine.dispose()
+    with engine.connect() as conn:
+        conn.execute(text('SELECT 1'))
+    current = query_metrics.stats()
+    assert current['connect']['count'] == 2
+    assert current['pool']['checkouts'] == 2
+    assert 'trajectory_report_db_checkouts_total 2' in \
+        query_metrics.prometheus_text()
+
+
+def test_checkout_wait(engine):
+    """Единственное соединение пула занято: второй запрос его ждет"""
+    taken, release = threading.Event(), threading.Event()
+
+    def hold():
+        with engine.connect():
+            taken.set()
+            release.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    taken.wait()
+    query_metrics.reset()
+    threading.Timer(0.2, release.set).start()
+    with engine.connect() as conn:
+        conn.execute(text('SELECT 1'))
+    holder.join()
+    wait = query_metrics.stats()['checkout_wait']
+    assert wait['count'] == 1
+    assert wait['max_seconds'] >= 0.15
+    assert 'trajectory_report_db_checkout_wait_seconds_count{} 1' in \
+        query_metrics.prometheus_text()
@@ -0,0 +1,55 @@
+# (отчет из кэша redis совпадает с отчетом, построенным по БД)
+import datetime as dt
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from trajectory_report.report.ConstructReport import (cache_window_start,
+                                                      invalidate)
+from trajectory_report.report.Report import (Report,
+                                             ReportWithAdditionalColumns)
+
+TODAY = dt.date.today()
+PERIODS = {
+    # Прошедшие дни внутри окна кэша
+    'window': (cache_window_start(), TODAY - dt.timedelta(days=1)),
+    # Период начинается раньше окна кэша (HybridReportDataGetter)
+    'hybrid': (cache_window_start() - dt.timedelta(days=5),
+               cache_window_start() + dt.timedelta(days=5)),
+    # Период с текущим днем (кластеры за сегодня из локаций)
+    'today': (TODAY - dt.timedelta(days=3), TODAY),
+}
+
+
+def assert_reports_equal(cached: Report, uncached: Report):
+    pd.testing.assert_frame_equal(
+        cached.horizontal_report.reset_index(drop=True),
+        uncached.horizontal_report.reset_index(drop=True),
+        check_dtype=False)
+    assert cached.as_json_dict == uncached.as_json_dict
+
+
+@pytest.mark.parametrize('report_class',
+                         [Report, ReportWithAdditionalColumns])
+@pytest.mark.parametrize('period', list(PERIODS))
+def test_cached_report_equals_database_report(db, redis_conn, report_class,
+                                              period):
+    date_from, date_to = PERIODS[period]
+    uncached = report_class(date_from, date_to, use_cache=False)
+    # Первый запрос заполняет кэш из БД, второй читает только из кэша
+    report_class(date_from, date_to)
+    cached = report_class(date_from, date_to)
+    assert_reports_equal(cached, uncached)
+
+
+def test_invalidate_journal(db, redis_conn):
+    date_from, date_to = PERIODS['window']
+    Report(date_from, date_to)
+    # Сотрудник 1 сменил устройство: записи журнала заменены в БД
+    with db.begin() as conn:
+        conn.execute(text('UPDATE journal_site SET "subscriberID" = 0 '
+                          'WHERE name_id = 1'))
+    invalidate('journal', [1])
+    assert_reports_equal(Report(date_from, date_to),
+                         Report(date_from, date_to, use_cache=False))
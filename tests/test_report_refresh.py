@@ -0,0 +1,48 @@
+# (обновление отчета за текущий день)
+import datetime as dt
+
+from sqlalchemy import text
+
+from trajectory_report.report.ConstructReport import report_data_factory
+from trajectory_report.report.Report import ReportWithAdditionalColumns
+from tests.test_report_cache import assert_reports_equal
+
+TODAY = dt.date.today()
+DATE_FROM = TODAY - dt.timedelta(days=3)
+
+
+class Source:
+    """Источник таблиц (ReportDataSource), считает обращения"""
+    def __init__(self):
+        self.calls = 0
+
+    def get_data(self, *args, **kwargs):
+        self.calls += 1
+        return report_data_factory(*args, use_cache=False, **kwargs)
+
+
+class SpyReport(ReportWithAdditionalColumns):
+    sources = []
+
+    def __init__(self, *args, **kwargs):
+        SpyReport.sources.append(kwargs.get('source'))
+        super().__init__(*args, **kwargs)
+
+
+def test_refresh(db, redis_conn):
+    source = Source()
+    SpyReport.sources = []
+    report = SpyReport(DATE_FROM, TODAY, source=source)
+
+    with db.begin() as conn:
+        conn.execute(text('DELETE FROM statements_site '
+                          'WHERE name_id = 1 AND date = :date'),
+                     {'date': str(TODAY)})
+    changed = report.refresh()
+
+    assert len(changed) and (changed['name_id'] == 1).all()
+    # Сегодняшние строки - тем же классом и не из source
+    assert SpyReport.sources == [source, None]
+    assert source.calls == 1
+    assert_reports_equal(report, ReportWithAdditionalColumns(
+        DATE_FROM, TODAY, use_cache=False))
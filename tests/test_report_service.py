@@ -0,0 +1,70 @@
+# (объединение одинаковых запросов отчетов через redis)
+import pickle
+import threading
+
+import pytest
+
+from trajectory_report.report.CacheNamespace import key as cache_key
+from trajectory_report.report.ReportService import ReportService
+from tests.test_report_cache import PERIODS
+
+KEY = 'report:test'
+LOCK_KEY = cache_key(f'result_lock:{KEY}')
+
+
+@pytest.fixture
+def service(redis_conn):
+    return ReportService()
+
+
+def test_lock_of_another_process_is_kept(service, redis_conn,
+                                         monkeypatch):
+    def build(kind, fmt, params):
+        # Блокировка истекла, пока строился отчет, и её взял другой процесс
+        redis_conn.set(LOCK_KEY, 'other')
+        return pickle.dumps('result')
+
+    monkeypatch.setattr(service, '_build', build)
+    assert service._shared(KEY, 'report', 'json', {}) == \
+        pickle.dumps('result')
+    assert redis_conn.get(LOCK_KEY) == b'other'
+
+
+def test_waiters_take_expired_lock(service, redis_conn, monkeypatch):
+    # Процесс, который строил отчет, завис: его блокировка истекает
+    redis_conn.set(LOCK_KEY, 'hung', px=300)
+    builds = []
+
+    def build(kind, fmt, params):
+        builds.append(redis_conn.get(LOCK_KEY))
+        return pickle.dumps('result')
+
+    monkeypatch.setattr(service, '_build', build)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        service._shared(KEY, 'report', 'json', {}))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [pickle.dumps('result')] * 4
+    # Отчет построен один раз и под своей блокировкой
+    assert len(builds) == 1 and builds[0] not in (None, b'hung')
+    assert redis_conn.get(LOCK_KEY) is None
+
+
+def test_collector_started_by_service(db, redis_conn, monkeypatch):
+    from trajectory_report.report import CacheNamespace
+    from trajectory_report.report import ReportService as module
+    from trajectory_report.report.Report import Report
+
+    started = []
+    monkeypatch.setattr(module, 'start_collector',
+                        lambda: started.append(True))
+    monkeypatch.setattr(module, '_service', None)
+    # Построение отчета поток не запускает
+    Report(*PERIODS['window'])
+    assert CacheNamespace._collector is None
+    assert module.get_service() is module.get_service()
+    assert started == [True]
@@ -0,0 +1,84 @@
+# (проверка служебных записок по кластерам сотрудников)
+import datetime as dt
+import math
+
+import pandas as pd
+from sqlalchemy import text
+
+from trajectory_report.config import REPORT_BASE
+from trajectory_report.report.ConstructReport import report_data_factory
+from trajectory_report.report.ServesVerifier import (
+    VERDICT_CONFIRMED, VERDICT_NO_DATA, VERDICT_NOT_FOUND,
+    verify_serves, write_verdicts)
+from tests.test_report_cache import PERIODS
+
+
+def _add_pending_serves(db, date_from, date_to):
+    """Записки на проверке и по дням с выходами (часть объектов посещена)"""
+    with db.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO serves_site (name_id, object_id, date, comment, "
+            "address, approval) SELECT name_id, object_id, date, '', '', 3 "
+            "FROM statements_site WHERE object_id != 1 "
+            "AND date BETWEEN :date_from AND :date_to LIMIT 40"),
+            {'date_from': date_from, 'date_to': date_to})
+
+
+def _nearest_cluster(journal, clusters, name_id, date, lat, lng):
+    """Расстояние до ближайшего кластера сотрудника за день (перебором)"""
+    distances = []
+    for j in journal[journal.name_id == name_id].itertuples():
+        period_end = j.period_end if pd.notna(j.period_end) \
+            else dt.date.today()
+        if not j.period_init <= date <= period_end:
+            continue
+        for c in clusters[(clusters.subscriberID == j.subscriberID)
+                          & (clusters.date == date)].itertuples():
+            p = math.pi / 180
+            a = 0.5 - math.cos((c.latitude - lat) * p) / 2 \
+                + math.cos(lat * p) * math.cos(c.latitude * p) \
+                * (1 - math.cos((c.longitude - lng) * p)) / 2
+            distances.append(12742000 * math.asin(math.sqrt(a)))
+    return min(distances) if distances else None
+
+
+def test_verdicts_match_brute_force(db, redis_conn):
+    date_from, date_to = PERIODS['window']
+    _add_pending_serves(db, date_from, date_to)
+    verdicts = verify_serves(date_from, date_to)
+    with db.connect() as conn:
+        pending = pd.read_sql(text(
+            'SELECT s.id, o.latitude, o.longitude FROM serves_site s '
+            'JOIN objects_site o ON o.object_id = s.object_id '
+            'WHERE s.approval = 3 AND s.date BETWEEN :date_from AND :date_to'),
+            conn, params={'date_from': date_from, 'date_to': date_to})
+    assert sorted(verdicts.id) == sorted(pending.id)
+    assert set(verdicts.verdict) >= {VERDICT_CONFIRMED, VERDICT_NOT_FOUND}
+
+    data = report_data_factory(date_from, date_to, use_cache=False,
+                               tables={'clusters'})
+    journal, clusters = data['_journal'], data['_clusters']
+    objects = pending.set_index('id')
+    for row in verdicts.itertuples():
+        expected = _nearest_cluster(journal, clusters, row.name_id, row.date,
+                                    float(objects.latitude[row.id]),
+                                    float(objects.longitude[row.id]))
+        if expected is None:
+            assert row.verdict == VERDICT_NO_DATA
+            continue
+        assert abs(row.distance - expected) <= 1
+        assert (row.verdict == VERDICT_CONFIRMED) == \
+            (expected <= REPORT_BASE['RADIUS'])
+
+
+def test_write_verdicts_replaces_previous(db, redis_conn):
+    _add_pending_serves(db, *PERIODS['window'])
+    verdicts = verify_serves(*PERIODS['window'])
+    assert write_verdicts(verdicts) == len(verdicts)
+    assert write_verdicts(verdicts) == len(verdicts)
+    with db.connect() as conn:
+        saved = pd.read_sql(text('SELECT serve_id, verdict '
+                                 'FROM serves_verdict'), conn)
+    assert sorted(saved.serve_id) == sorted(verdicts.id)
+    assert dict(zip(saved.serve_id, saved.verdict)) == \
+        dict(zip(verdicts.id, verdicts.verdict))
@@ -0,0 +1,54 @@
+# (общее хранилище таблиц: поколения и отчет из хранилища)
+import os
+
+import pandas as pd
+import pytest
+
+from trajectory_report.config import SHARED_STORE
+from trajectory_report.report import SharedStore
+from trajectory_report.report.Report import Report
+from tests.test_report_cache import PERIODS, assert_reports_equal
+
+pytest.importorskip('pyarrow')
+
+
+def employees(name: str) -> dict:
+    return {'employees': pd.DataFrame({'name_id': [1], 'name': [name]})}
+
+
+def generations(path) -> list:
+    root = SharedStore._root(str(path))
+    return sorted(i for i in os.listdir(root) if i.isdigit())
+
+
+def test_snapshot_keeps_generation(tmp_path):
+    SharedStore.publish(employees('first'), path=str(tmp_path))
+    reader = SharedStore.SharedStoreReader(str(tmp_path))
+    snapshot = reader.snapshot()
+    SharedStore.publish(employees('second'), path=str(tmp_path))
+    SharedStore.publish(employees('third'), path=str(tmp_path))
+    # Поколение, полученное до переключения, читается целиком
+    assert snapshot.read('employees').name.tolist() == ['first']
+    assert reader.snapshot().read('employees').name.tolist() == ['third']
+
+
+def test_replaced_generations_removed_after_grace(tmp_path, monkeypatch):
+    monkeypatch.setitem(SHARED_STORE, 'KEEP_GENERATIONS', 1)
+    for name in ('first', 'second', 'third'):
+        SharedStore.publish(employees(name), path=str(tmp_path))
+    assert len(generations(tmp_path)) == 3
+
+    monkeypatch.setitem(SHARED_STORE, 'GRACE_SECONDS', 0)
+    last = SharedStore.publish(employees('fourth'), path=str(tmp_path))
+    assert generations(tmp_path) == [last]
+
+
+def test_report_from_shared_store(db, redis_conn, tmp_path, monkeypatch):
+    monkeypatch.setitem(SHARED_STORE, 'ENABLED', True)
+    monkeypatch.setitem(SHARED_STORE, 'PATH', str(tmp_path))
+    monkeypatch.setattr(SharedStore, '_reader', None)
+    SharedStore.load()
+    assert 'clusters' in SharedStore.attach().snapshot().available()
+    date_from, date_to = PERIODS['window']
+    assert_reports_equal(Report(date_from, date_to),
+                         Report(date_from, date_to, use_cache=False))
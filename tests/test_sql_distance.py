@@ -0,0 +1,34 @@
+# (расстояние до объектов в БД (REPORT_BASE['SQL_DISTANCE']) и в pandas)
+import datetime as dt
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from trajectory_report.config import REPORT_BASE
+from trajectory_report.models import Serves
+from trajectory_report.report.Report import (Report,
+                                             ReportWithAdditionalColumns)
+from tests.test_report_cache import assert_reports_equal
+
+TODAY = dt.date.today()
+PERIOD = (TODAY - dt.timedelta(days=14), TODAY - dt.timedelta(days=1))
+
+
+@pytest.mark.parametrize('report_class',
+                         [Report, ReportWithAdditionalColumns])
+def test_sql_distance_equals_pandas(synthetic, make_db, monkeypatch,
+                                    report_class):
+    make_db(synthetic, spatial=True)
+    pandas_report = report_class(*PERIOD, use_cache=False)
+    monkeypatch.setitem(REPORT_BASE, 'SQL_DISTANCE', True)
+    sql_report = report_class(*PERIOD, use_cache=False)
+    assert_reports_equal(sql_report, pandas_report)
+
+
+def test_models_without_spatial_migration(db):
+    """Столбцы location не входят в модели: ORM-запросы работают в БД
+    без миграции"""
+    with Session(db) as session:
+        serve = session.scalars(select(Serves).limit(1)).one()
+        assert serve.object.object_id == serve.object_id
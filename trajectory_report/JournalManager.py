@@ -18,7 +18,7 @@
 
 
 from trajectory_report.api.mts import get_subscribers
-from trajectory_report.database import DB_ENGINE
+from trajectory_report import database
 import datetime as dt
 from trajectory_report.models import Employees, Statements, Journal, Division
 from sqlalchemy import select, update
@@ -31,7 +31,7 @@ from numpy import nan
 class JournalManager:
 
     def __init__(self):
-        self.session = Session(DB_ENGINE)
+        self.session = Session(database.DB_ENGINE)
         # Работающие на текущий момент сотрудники
         self.emps = self.get_employees_actual()
         # Список сотрудников из МТС
@@ -144,9 +144,11 @@ class JournalManager:
                 trackable_dict[i['name']] = dict(
                     subs_id=i['subscriberID'],
                     name_id=i['name_id'])
+        changed = []
         for name in self.trackable:
             # отслеживаемые сотрудники
             if trackable_dict[name]['subs_id'] != self.mts[name]:
+                changed.append(trackable_dict[name]['name_id'])
                 # если не совпадают subscriberID
                 if trackable_dict[name]['subs_id'] is None:
                     # если нет текущего отслеживаемого устройства,
@@ -160,6 +162,9 @@ class JournalManager:
                     self.journal_usage_open(self.mts.get(name),
                                             trackable_dict[name]['name_id'])
         self.session.commit()
+        # обновить в кэше записи журнала только по изменившимся сотрудникам
+        from trajectory_report.report.ConstructReport import invalidate
+        invalidate('journal', changed)
 
     def get_divisions_dict(self):
         """Словарь с учреждениями по name_id,
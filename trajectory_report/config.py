@@ -54,6 +54,13 @@ REPORT_BASE['RADIUS'] = 700
 # длительности посещения.
 REPORT_BASE['MINS_BETWEEN_ATTENDS'] = 40
 
+# Считать расстояние между объектами и кластерами в БД (MySQL), а не в
+# pandas. Применяется при запросе отчета из БД (не из кэша): из БД
+# передаются только посещения в пределах RADIUS, а не все кластеры.
+# Требует миграции migrations.spatial_location.
+# Стандарт: False
+REPORT_BASE['SQL_DISTANCE'] = False
+
 
 # Параметры, определяющие, есть ли у сотрудника проблемы с локациями.
 # Эти параметры применяются при формировании анализа локаций сотрудника
@@ -67,3 +74,129 @@ REPORT_BASE['MINS_BETWEEN_ATTENDS'] = 40
 STATS_CHECKOUT = dict()
 STATS_CHECKOUT['MINUTES'] = 60
 STATS_CHECKOUT['COUNT'] = 4
+
+
+# Параметры кэширования таблиц отчета в redis (ConstructReport.py)
+CACHE_CONFIG = dict()
+# Сколько секунд считать результат проверки доступности redis (PING)
+# актуальным, чтобы не проверять его при каждом запросе отчета.
+# Стандарт: 10
+CACHE_CONFIG['HEALTH_CHECK_SECONDS'] = 10
+# Кол-во потоков для распаковки таблиц, полученных из redis.
+# bz2 освобождает GIL при распаковке, поэтому она идет параллельно.
+# Стандарт: 4
+CACHE_CONFIG['DECODE_WORKERS'] = 4
+# Через сколько дней удалить кэш кластеров по дням, если в него ничего
+# не добавлялось (обычно gather/clusters добавляет новый день каждые сутки,
+# а дни старше начала прошлого месяца удаляются при добавлении).
+# Стандарт: 7
+CACHE_CONFIG['CLUSTERS_EXPIRE_DAYS'] = 7
+# Ключи кэша хранятся в пространстве имен, которое зависит от параметров
+# отчета и схемы (report/CacheNamespace.py). Через сколько часов без
+# обращений удалять старое пространство имен (после выката изменений).
+# Стандарт: 24
+CACHE_CONFIG['NAMESPACE_IDLE_HOURS'] = 24
+# Как часто (в минутах) искать и удалять старые пространства имен.
+# Стандарт: 60
+CACHE_CONFIG['NAMESPACE_GC_MINUTES'] = 60
+
+
+# Общее для процессов хранилище таблиц отчета (report/SharedStore.py):
+# employees, objects, journal, schedules и кластеры за прошедшие дни
+# хранятся в файлах Arrow на локальном диске и читаются всеми процессами
+# через memory map вместо распаковки собственной копии из redis.
+SHARED_STORE = dict()
+# Стандарт: выключено (включается переменной окружения SHARED_STORE=1)
+SHARED_STORE['ENABLED'] = os.getenv('SHARED_STORE') == '1'
+# Каталог хранилища. Лучше использовать tmpfs.
+# Стандарт: /dev/shm/trajectory_report
+SHARED_STORE['PATH'] = os.getenv('SHARED_STORE_PATH',
+                                 '/dev/shm/trajectory_report')
+# Сколько последних выгрузок (поколений) хранить. Процессы, которые ещё
+# читают предыдущее поколение, продолжают работать с ним.
+# Стандарт: 2
+SHARED_STORE['KEEP_GENERATIONS'] = 2
+# Сколько секунд хранить замененное поколение сверх KEEP_GENERATIONS:
+# запрос отчета, начатый до переключения, дочитывает его файлы.
+# Стандарт: 600
+SHARED_STORE['GRACE_SECONDS'] = 600
+
+
+# Объединение одинаковых запросов отчетов (report/ReportService.py)
+REPORT_SERVICE = dict()
+# Сколько секунд хранить готовый результат отчета (в памяти процесса и
+# в redis). Отчеты за текущий день меняются, поэтому срок небольшой.
+# Стандарт: 120
+REPORT_SERVICE['TTL_SECONDS'] = 120
+# Объем результатов, хранимых в памяти процесса, байт.
+# Стандарт: 256 МБ
+REPORT_SERVICE['CACHE_BYTES'] = 256 * 1024 * 1024
+# Максимальное время построения отчета другим процессом, сек. Дольше
+# блокировка в redis не держится: её берет один из ожидающих процессов
+# и строит отчет сам.
+# Стандарт: 300
+REPORT_SERVICE['LOCK_SECONDS'] = 300
+
+
+# Кэш карт передвижений за прошедшие дни (map/movements.py,
+# MapMovements.cached_json)
+MAP_CACHE = dict()
+# Сколько дней хранить карту в redis
+# Стандарт: 7
+MAP_CACHE['TTL_DAYS'] = 7
+# Сколько секунд хранить слои карты привязок (MapBindings.cached_layer).
+# Стандарт: 3600
+MAP_CACHE['BINDINGS_TTL_SECONDS'] = 3600
+
+
+# Тепловая карта пребывания сотрудников (map/heatmap.py)
+HEATMAP_CONFIG = dict()
+# Размер шестиугольной ячейки: расстояние от центра до вершины, в метрах
+# Стандарт: 300
+HEATMAP_CONFIG['HEX_SIZE_M'] = 300
+
+
+# Параметры запросов к БД при формировании отчета (ConstructReport.py)
+DATABASE_CONFIG = dict()
+# Кол-во параллельных запросов к БД. Каждый запрос использует отдельное
+# соединение из пула DB_ENGINE, поэтому значение не должно превышать
+# размер пула (по умолчанию у sqlalchemy - 5).
+# Стандарт: 5
+DATABASE_CONFIG['QUERY_WORKERS'] = 5
+
+
+# Замеры этапов формирования отчета (profiling.py)
+PROFILING = dict()
+# Включить замеры времени и кол-ва строк по этапам.
+# Стандарт: выключено (включается переменной окружения PROFILING=1)
+PROFILING['ENABLED'] = os.getenv('PROFILING') == '1'
+# Замерять пиковый прирост памяти (tracemalloc, заметно замедляет отчет).
+# Пик памяти у tracemalloc общий для процесса, поэтому память замеряется
+# только у этапов в главном потоке и верна, пока другие потоки не
+# формируют отчеты (скрипты benchmarks, профилирование одного отчета).
+# Стандарт: False
+PROFILING['MEMORY'] = os.getenv('PROFILING_MEMORY') == '1'
+# Писать каждый замер в лог (logger trajectory_report.profiling)
+# Стандарт: True
+PROFILING['LOG'] = True
+# Файл для textfile collector node_exporter
+PROFILING['PROMETHEUS_TEXTFILE'] = os.getenv(
+    'PROFILING_TEXTFILE', 'trajectory_report.prom')
+
+
+# Замеры запросов к БД (query_metrics.py)
+QUERY_METRICS = dict()
+# Подключить замеры к DB_ENGINE при импорте database.py.
+# Стандарт: выключено (включается переменной окружения QUERY_METRICS=1)
+QUERY_METRICS['ENABLED'] = os.getenv('QUERY_METRICS') == '1'
+# Запросы дольше этого значения (сек.) попадают в лог медленных
+# запросов (logger trajectory_report.slow_query). Значения параметров
+# в лог не пишутся, только их типы.
+# Стандарт: 1.0
+QUERY_METRICS['SLOW_SECONDS'] = float(os.getenv('SLOW_QUERY_SECONDS', 1.0))
+# Границы корзин гистограммы времени запросов, сек.
+QUERY_METRICS['BUCKETS'] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                            1.0, 2.5, 5.0, 10.0)
+# Максимальная длина текста запроса в метке (label) prometheus
+# Стандарт: 300
+QUERY_METRICS['SHAPE_LENGTH'] = 300
@@ -1,6 +1,47 @@
-from trajectory_report.config import DB, REDIS
+# (соединения с БД и redis)
+# DB_ENGINE и REDIS_CONN создаются при первом обращении, а не при импорте:
+# импорт модулей (cron-скрипты gather, воркеры веб-сервера) не загружает
+# драйвер БД и клиент redis, пока они действительно не понадобятся.
+# Обращаться к ним можно как раньше:
+#     from trajectory_report.database import DB_ENGINE
+# (создает engine в момент импорта) или, чтобы отложить создание до
+# использования, через модуль:
+#     from trajectory_report import database
+#     database.DB_ENGINE.connect()
+from trajectory_report.config import DB, REDIS, QUERY_METRICS
 from sqlalchemy import create_engine
-import redis
+from sqlalchemy.engine import Engine
 
-DB_ENGINE = create_engine(DB, pool_recycle=300, pool_pre_ping=True)
-REDIS_CONN = redis.Redis(REDIS)
+
+def get_engine() -> Engine:
+    engine = globals().get('DB_ENGINE')
+    if engine is None:
+        if QUERY_METRICS['ENABLED']:
+            from trajectory_report import query_metrics
+            engine = create_engine(DB, pool_recycle=300, pool_pre_ping=True,
+                                   poolclass=query_metrics.TimedQueuePool)
+            query_metrics.install(engine)
+        else:
+            engine = create_engine(DB, pool_recycle=300, pool_pre_ping=True)
+        globals()['DB_ENGINE'] = engine
+    return engine
+
+
+def get_redis():
+    conn = globals().get('REDIS_CONN')
+    if conn is None:
+        import redis
+        conn = redis.Redis(REDIS)
+        globals()['REDIS_CONN'] = conn
+    return conn
+
+
+def __getattr__(name: str):
+    # Вызывается, только если атрибута ещё нет в модуле. После создания
+    # DB_ENGINE и REDIS_CONN становятся обычными атрибутами модуля, их
+    # можно подменить (например, на fakeredis в benchmarks).
+    if name == 'DB_ENGINE':
+        return get_engine()
+    if name == 'REDIS_CONN':
+        return get_redis()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
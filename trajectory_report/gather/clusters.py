@@ -1,16 +1,17 @@
 from trajectory_report.models import Clusters, Coordinates
 from sqlalchemy import select, func
-from trajectory_report.database import DB_ENGINE
+from trajectory_report import database
 import datetime as dt
 from typing import List
 import pandas as pd
 from trajectory_report.report.ClusterGenerator import prepare_clusters
+from trajectory_report.report.ConstructReport import append_clusters
 
 
 def get_dates_range() -> List[dt.date]:
     """Получить список дат, по которым нужно произвести кластеры.
     Если кластеров нет вообще - выдаст список из дат за последние 2 месяца."""
-    with DB_ENGINE.connect() as conn:
+    with database.DB_ENGINE.connect() as conn:
         # Дата последних произведенных кластеров
         date = conn.execute(func.max(Clusters.date)).scalar()
         if not date:
@@ -31,7 +32,7 @@ def get_coordinates(date: dt.date) -> pd.DataFrame:
         .where(Coordinates.requestDate > date) \
         .where(Coordinates.requestDate < date + dt.timedelta(days=1)) \
         .where(Coordinates.locationDate is not None)
-    return pd.read_sql(sel, DB_ENGINE)
+    return pd.read_sql(sel, database.DB_ENGINE)
 
 
 def main():
@@ -45,9 +46,12 @@ def main():
         clusters = prepare_clusters(coords)
         # Сохранить кластеры в БД
         clusters.to_sql(Clusters.__tablename__,
-                        DB_ENGINE,
+                        database.DB_ENGINE,
                         if_exists='append',
                         index=False)
+        # Добавить день в кэш кластеров, чтобы отчеты не перезагружали
+        # из БД все кластеры за два месяца
+        append_clusters(date, clusters)
         print(f'Clusters for {date} have been uploaded.')
 
 
@@ -4,7 +4,7 @@ import aiohttp
 from trajectory_report.api.mts import get_subs_by_token, apiHttp, apiGetLocs
 import datetime as dt
 from trajectory_report.models import Coordinates
-from trajectory_report.database import DB_ENGINE
+from trajectory_report import database
 from sqlalchemy import func, insert, select
 from sqlalchemy.orm import sessionmaker, Session
 from collections import defaultdict
@@ -39,7 +39,7 @@ from collections import defaultdict
 def subscribers_last_location():
     """Берет из таблицы LastRequest даты последних запрошенных локаций
         по каждому из сотрудников."""
-    with DB_ENGINE.connect() as conn:
+    with database.DB_ENGINE.connect() as conn:
         sel = select(
             Coordinates.subscriberID,
             func.max(Coordinates.requestDate).label('requestDate')
@@ -62,7 +62,7 @@ def ret_str(x):
 
 
 def append_coordinates(data):
-    with Session(DB_ENGINE) as session:
+    with Session(database.DB_ENGINE) as session:
         with session.begin():
             for data_list in data:
                 for dic in data_list:
@@ -96,7 +96,7 @@ def append_coordinates_directly(data):
 
             list_to_append.append(x)
 
-    with DB_ENGINE.connect() as conn:
+    with database.DB_ENGINE.connect() as conn:
         conn.execute(
                 insert(Coordinates.__table__),
                 [dic for dic in list_to_append]
@@ -1 +1,12 @@
-from trajectory_report.map.movements import MapMovements, MapBindings
+# Классы карт загружаются при первом обращении (folium и branca)
+_LAZY = {'MapMovements': 'trajectory_report.map.movements',
+         'MapBindings': 'trajectory_report.map.movements',
+         'StatementsBindings': 'trajectory_report.map.movements',
+         'MapHeatmap': 'trajectory_report.map.heatmap'}
+
+
+def __getattr__(name: str):
+    if name in _LAZY:
+        import importlib
+        return getattr(importlib.import_module(_LAZY[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
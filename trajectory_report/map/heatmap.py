@@ -0,0 +1,219 @@
+# (тепловая карта пребывания сотрудников подразделения)
+# Кластеры (места остановок) сотрудников за период собираются в
+# шестиугольные ячейки, в каждой ячейке суммируется время пребывания
+# (leaving_datetime - datetime). Ячейки считаются на сервере векторно
+# (numpy) и выводятся на карту одним слоем GeoJSON, поэтому размер
+# страницы зависит от кол-ва ячеек, а не от кол-ва кластеров.
+#
+#     heatmap = MapHeatmap('2023-08-01', '2023-08-31', 'ПВТ1')
+#     heatmap.map.save('/tmp/heatmap.html')
+import datetime as dt
+from typing import List, Optional, Union
+
+import folium
+import numpy as np
+import pandas as pd
+from branca.colormap import LinearColormap
+from branca.element import MacroElement
+from jinja2 import Template
+
+from trajectory_report.config import HEATMAP_CONFIG
+from trajectory_report.profiling import span
+from trajectory_report.report.ConstructReport import (ReportDataSource,
+                                                      report_data_factory)
+from trajectory_report.report.JournalIndex import JournalIndex
+
+# Метров в градусе широты
+METERS_PER_DEGREE = 111320
+SQRT3 = np.sqrt(3)
+
+
+def hex_bin(lat: np.ndarray, lng: np.ndarray, size_m: float,
+            lat0: float, lng0: float) -> tuple:
+    """
+    Номера шестиугольных ячеек (осевые координаты q, r) для точек.
+    Шестиугольники с вершиной вверх, size_m - расстояние от центра до
+    вершины. Координаты переводятся в метры на плоскости, касающейся
+    Земли в точке (lat0, lng0) (для города искажение незначительно).
+    """
+    x = (lng - lng0) * METERS_PER_DEGREE * np.cos(np.radians(lat0))
+    y = (lat - lat0) * METERS_PER_DEGREE
+    q = (SQRT3 / 3 * x - y / 3) / size_m
+    r = (2 / 3 * y) / size_m
+    # Округление в кубических координатах (q + r + s = 0): исправляется
+    # координата с наибольшей ошибкой округления
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return rq.astype(np.int64), rr.astype(np.int64)
+
+
+def hex_corners(q: np.ndarray, r: np.ndarray, size_m: float,
+                lat0: float, lng0: float) -> tuple:
+    """Координаты вершин ячеек (q, r): массивы lat, lng размером
+    (кол-во ячеек, 7), последняя вершина замыкает контур"""
+    cx = size_m * SQRT3 * (q + r / 2)
+    cy = size_m * 1.5 * r
+    angles = np.radians(30 + 60 * np.arange(7))
+    x = cx[:, None] + size_m * np.cos(angles)
+    y = cy[:, None] + size_m * np.sin(angles)
+    lat = lat0 + y / METERS_PER_DEGREE
+    lng = lng0 + x / (METERS_PER_DEGREE * np.cos(np.radians(lat0)))
+    return lat, lng
+
+
+class HexLayer(MacroElement):
+    """
+    Ячейки тепловой карты одним слоем GeoJSON. Цвет ячейки (c) и
+    подпись (t) посчитаны на сервере, стиль задается одной функцией.
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = L.geoJson({{ this.data|tojson }}, {
+            style: function (feature) {
+                return {color: feature.properties.c, weight: 0,
+                        fillColor: feature.properties.c,
+                        fillOpacity: 0.6};
+            },
+            onEachFeature: function (feature, layer) {
+                layer.bindTooltip(feature.properties.t);
+            }
+        }).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+    """)
+
+    def __init__(self, data: dict):
+        super().__init__()
+        self._name = 'HexLayer'
+        self.data = data
+
+
+class MapHeatmap:
+    """
+    Тепловая карта: где сотрудники подразделения проводят время.
+    Берутся кластеры сотрудников за дни, на которые у них есть заявленные
+    выходы (кроме Больн./Отпуск/Увол.), subscriberID на дату определяется
+    по журналу. Время пребывания кластеров суммируется по шестиугольным
+    ячейкам размером hex_size_m (по умолчанию HEATMAP_CONFIG['HEX_SIZE_M']).
+    cells - таблица ячеек: q, r, hours (часы пребывания), visits
+    (кол-во кластеров), employees (кол-во сотрудников).
+    """
+    REQUIRED_TABLES = frozenset({'clusters'})
+
+    def __init__(self,
+                 date_from: Union[dt.date, str],
+                 date_to: Union[dt.date, str],
+                 division: Optional[Union[int, str]] = None,
+                 name_ids: Optional[List[int]] = None,
+                 hex_size_m: Optional[float] = None,
+                 use_cache: bool = True,
+                 source: Optional[ReportDataSource] = None
+                 ):
+        with span('report.fetch'):
+            if source is not None:
+                data = source.get_data(date_from, date_to, division,
+                                       name_ids,
+                                       tables=self.REQUIRED_TABLES)
+            else:
+                data = report_data_factory(date_from, date_to, division,
+                                           name_ids, use_cache=use_cache,
+                                           tables=self.REQUIRED_TABLES)
+        self._date_from = dt.date.fromisoformat(str(date_from))
+        self._date_to = dt.date.fromisoformat(str(date_to))
+        self._stmts = data['_stmts']
+        self._journal = data['_journal']
+        self._clusters = data['_clusters']
+        self._hex_size_m = hex_size_m or HEATMAP_CONFIG['HEX_SIZE_M']
+
+        self._stays = self._employee_stays()
+        if len(self._stays):
+            self._lat0 = float(self._stays.latitude.mean())
+            self._lng0 = float(self._stays.longitude.mean())
+        else:
+            self._lat0, self._lng0 = 55.50703, 37.58213
+        self.cells = self._bin_cells()
+
+        self.map = folium.Map(location=[self._lat0, self._lng0],
+                              zoom_start=11, tiles='cartodbpositron')
+        self._create_map()
+
+    def _employee_stays(self) -> pd.DataFrame:
+        """Кластеры сотрудников за их рабочие дни: name_id, latitude,
+        longitude, hours"""
+        with span('heatmap.stays', rows_in=len(self._clusters)) as s:
+            days = self._stmts.loc[self._stmts.object_id != 1,
+                                   ['name_id', 'date']].drop_duplicates()
+            days = JournalIndex(self._journal).attach(days)
+            days = days[days['j_exist']]
+            days = days.assign(
+                subscriberID=days['subscriberID'].astype(np.int64),
+                date=pd.to_datetime(days['date']))
+
+            clusters = self._clusters[['subscriberID', 'date', 'datetime',
+                                       'leaving_datetime', 'latitude',
+                                       'longitude']].dropna()
+            clusters = clusters.assign(
+                subscriberID=clusters['subscriberID'].astype(np.int64),
+                date=pd.to_datetime(clusters['date']))
+            stays = pd.merge(clusters, days[['name_id', 'subscriberID',
+                                             'date']],
+                             on=['subscriberID', 'date'])
+            hours = (pd.to_datetime(stays['leaving_datetime'])
+                     - pd.to_datetime(stays['datetime'])) \
+                .dt.total_seconds().clip(lower=0) / 3600
+            stays = pd.DataFrame({
+                'name_id': stays['name_id'].to_numpy(),
+                'latitude': stays['latitude'].astype(float).to_numpy(),
+                'longitude': stays['longitude'].astype(float).to_numpy(),
+                'hours': hours.to_numpy()})
+            s.rows_out = len(stays)
+        return stays
+
+    def _bin_cells(self) -> pd.DataFrame:
+        with span('heatmap.bin', rows_in=len(self._stays)) as s:
+            q, r = hex_bin(self._stays.latitude.to_numpy(),
+                           self._stays.longitude.to_numpy(),
+                           self._hex_size_m, self._lat0, self._lng0)
+            cells = self._stays.assign(q=q, r=r) \
+                .groupby(['q', 'r'], as_index=False) \
+                .agg(hours=('hours', 'sum'),
+                     visits=('hours', 'size'),
+                     employees=('name_id', 'nunique'))
+            s.rows_out = len(cells)
+        return cells
+
+    def as_geojson(self) -> dict:
+        """Ячейки в виде GeoJSON: свойства c - цвет, t - подпись"""
+        cells = self.cells
+        if not len(cells):
+            return {'type': 'FeatureCollection', 'features': []}
+        lat, lng = hex_corners(cells.q.to_numpy(), cells.r.to_numpy(),
+                               self._hex_size_m, self._lat0, self._lng0)
+        lat, lng = np.round(lat, 6), np.round(lng, 6)
+        colormap = self.colormap()
+        colors = [colormap.rgb_hex_str(i) for i in cells.hours]
+        return {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature',
+             'geometry': {'type': 'Polygon',
+                          'coordinates': [list(zip(lng[i].tolist(),
+                                                   lat[i].tolist()))]},
+             'properties': {'c': colors[i],
+                            't': f'Часов: {hours:.1f}<br>'
+                                 f'Остановок: {visits}<br>'
+                                 f'Сотрудников: {employees}'}}
+            for i, (hours, visits, employees) in enumerate(zip(
+                cells.hours, cells.visits, cells.employees))]}
+
+    def colormap(self) -> LinearColormap:
+        vmax = float(self.cells.hours.max()) if len(self.cells) else 1
+        return LinearColormap(['#ffffb2', '#fd8d3c', '#bd0026'],
+                              vmin=0, vmax=max(vmax, 1),
+                              caption='Часов пребывания')
+
+    def _create_map(self):
+        HexLayer(self.as_geojson()).add_to(self.map)
+        self.colormap().add_to(self.map)
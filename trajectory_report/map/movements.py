@@ -1,12 +1,20 @@
 import folium
-from folium.plugins import AntPath
-from branca.element import Figure
-import math
-import skmob
-from skmob.preprocessing import clustering
+from folium.elements import JSCSSMixin
+from folium.plugins import MarkerCluster
+from branca.element import Figure, MacroElement
+from jinja2 import Template
+import bz2
+import hashlib
+import html
+import json
+import pickle
+import numpy as np
 from numpy import median
 import pandas as pd
 from trajectory_report.report.Report import OneEmployeeReport, Report
+from trajectory_report.report.ConstructReport import ReportDataSource
+from trajectory_report.profiling import span, profiled
+from trajectory_report.config import MAP_CACHE
 from typing import Union, Optional, List
 import datetime as dt
 
@@ -19,70 +27,198 @@ import datetime as dt
 """
 
 
+class PointsLayer(JSCSSMixin, MacroElement):
+    """
+    Все точки карты и маршрут между остановками одним элементом.
+    Точки передаются столбцами (а не объектами GeoJSON или отдельными
+    Marker), вид маркера задается номером kind (см. icons), подписи
+    собираются в браузере:
+      остановка - подсказка "время", при нажатии "Время: ... Длительность:"
+      объект - подсказка "название", при нажатии "название, адрес".
+    points - DataFrame со столбцами lat, lng, kind, text, detail:
+      остановки - text - время начала (минут с начала дня), detail -
+      длительность (секунд); объекты - название и адрес.
+    Координаты передаются в единицах 1e-5 градуса (~1 м) разностью с
+    предыдущей точкой. Маршрут (AntPath) проходит через остановки в
+    порядке points, отдельно координаты не передаются.
+    Кириллица в JSON не заменяется \\u-последовательностями (в отличие от
+    tojson), экранируются только <, > и &.
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function () {
+            var data = {{ this.json }};
+            var kinds = {{ this.kinds|tojson }};
+            var icons = {{ this.icons|tojson }};
+            function pad(n) { return (n < 10 ? '0' : '') + n; }
+            function hm(m) {
+                return pad(Math.floor(m / 60)) + ':' + pad(m % 60);
+            }
+            var lat = 0, lng = 0, path = [];
+            for (var i = 0; i < data.k.length; i++) {
+                lat += data.lat[i];
+                lng += data.lng[i];
+                var latlng = [lat / 1e5, lng / 1e5];
+                var kind = kinds[data.k[i]];
+                var marker = L.marker(latlng, {
+                    icon: L.AwesomeMarkers.icon(icons[kind])});
+                if (kind === 'object') {
+                    marker.bindTooltip(data.t[i]);
+                    marker.bindPopup(data.t[i] + '<br>' + data.d[i]);
+                } else {
+                    var s = data.d[i];
+                    marker.bindTooltip(hm(data.t[i]));
+                    marker.bindPopup('Время:<br>' + hm(data.t[i])
+                        + '<br>Длительность:<br>'
+                        + hm(Math.floor(s / 60)) + ':' + pad(s % 60));
+                    path.push(latlng);
+                }
+                marker.addTo({{ this._parent.get_name() }});
+            }
+            L.polyline.antPath(path, {{ this.path_options|tojson }})
+                .addTo({{ this._parent.get_name() }});
+        })();
+        {% endmacro %}
+    """)
+
+    default_js = [
+        ('antpath', 'https://cdn.jsdelivr.net/npm/leaflet-ant-path@1.1.2/'
+                    'dist/leaflet-ant-path.min.js'),
+    ]
+
+    def __init__(self, points: pd.DataFrame, icons: dict,
+                 path_options: dict):
+        super().__init__()
+        self._name = 'PointsLayer'
+        self.kinds = list(icons)
+        self.icons = icons
+        self.path_options = path_options
+        points = points.dropna(subset=['lat', 'lng'])
+        lat = np.round(points.lat.to_numpy(dtype=float) * 1e5) \
+            .astype(np.int64)
+        lng = np.round(points.lng.to_numpy(dtype=float) * 1e5) \
+            .astype(np.int64)
+        self.json = self._json({
+            'lat': np.diff(lat, prepend=0).tolist(),
+            'lng': np.diff(lng, prepend=0).tolist(),
+            'k': [self.kinds.index(i) for i in points.kind],
+            't': points.text.tolist(),
+            'd': points.detail.tolist()})
+
+    @staticmethod
+    def _json(data: dict) -> str:
+        """JSON для вставки в <script>: кириллица как есть, <, > и &
+        экранируются (как в tojson)"""
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'),
+                          default=int) \
+            .replace('<', '\\u003c').replace('>', '\\u003e') \
+            .replace('&', '\\u0026')
+
+
 class MapsBase:
     """
-    Базовый класс для формирования карты. Метод _tie_clusters позволяет
+    Базовый класс для формирования карты. Метод _concatenate_points позволяет
     раскинуть точки на карте, которые могут перекрывать друг друга.
     Это происходит при помощи определения всех точек в кластеры (в пределах
     очень небольшого радиуса), а затем - группировке точек по кластерам.
     Потом в пределах кластера точкам задаются новые координаты.
     """
+    # Точки ближе этого расстояния (в метрах) считаются перекрывающимися
+    OVERLAP_RADIUS_M = 5
+    # Расстояние от центра до раздвинутой точки, в градусах
+    LEG_LENGTH = 0.00016
 
     @staticmethod
-    def _spiderfy_shape_positions(count: int, center_pt: tuple) -> list:
+    def _overlap_clusters(lat: np.ndarray, lng: np.ndarray,
+                          radius_m: float) -> np.ndarray:
+        """
+        Номера кластеров перекрывающихся точек: точки, между которыми
+        (напрямую или через цепочку других точек) не больше radius_m метров,
+        попадают в один кластер (как DBSCAN с min_samples=1). Номер
+        кластера - позиция его первой точки.
+        Координаты раскладываются по ячейкам сетки размером radius_m,
+        расстояния считаются только между точками соседних ячеек (3x3),
+        затем кластеры объединяются по найденным парам.
+        Точки без координат - каждая в своем кластере.
+        """
+        n = len(lat)
+        labels = np.arange(n)
+        valid = ~(np.isnan(lat) | np.isnan(lng))
+        if valid.sum() < 2:
+            return labels
+        # Ячейки сетки: radius_m в градусах широты и долготы
+        cos_lat = np.cos(np.radians(np.nanmean(lat)))
+        cell_lat = radius_m / 111320
+        cell_lng = cell_lat / cos_lat
+        idx = np.flatnonzero(valid)
+        cells = pd.DataFrame({
+            'i': idx,
+            'x': np.floor(lng[idx] / cell_lng).astype(np.int64),
+            'y': np.floor(lat[idx] / cell_lat).astype(np.int64),
+        })
+        # Соседние ячейки: каждая точка сопоставляется с точками 3x3 ячеек
+        shifted = pd.concat([cells.assign(x=cells.x + dx, y=cells.y + dy)
+                             for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+        pairs = pd.merge(shifted, cells, on=['x', 'y'],
+                         suffixes=('', '_other'))
+        pairs = pairs[pairs.i < pairs.i_other]
+        first, second = pairs.i.to_numpy(), pairs.i_other.to_numpy()
+        # Расстояние в метрах (на 5 м проекция на плоскость точна)
+        d_north = (lat[first] - lat[second]) * 111320
+        d_east = (lng[first] - lng[second]) * 111320 * cos_lat
+        close = np.hypot(d_north, d_east) <= radius_m
+        first, second = first[close], second[close]
+        # Объединение: каждой точке - минимальный номер среди связанных
+        changed = len(first) > 0
+        while changed:
+            before = labels.copy()
+            low = np.minimum(labels[first], labels[second])
+            np.minimum.at(labels, first, low)
+            np.minimum.at(labels, second, low)
+            labels = labels[labels]
+            changed = not np.array_equal(before, labels)
+        return labels
+
+    @classmethod
+    def _spiderfy(cls, lat: np.ndarray, lng: np.ndarray,
+                  clusters: np.ndarray) -> tuple:
         """
         Если координаты объектов на карте совпали или могут перекрывать друг
         друга, то их нужно раздвинуть немного в сторону.
-        Эта функция принимает одну координату и количество точек. Затем выдает
-        список из координат, находящихся на небольшой отдаленности друг от
-        друга, так чтобы не перекрыть друг друга.
+        Точки кластера (больше одной) раскладываются по кругу вокруг
+        первой точки кластера, радиус растет с кол-вом точек.
+        clusters - результат _overlap_clusters (позиция первой точки).
+        Возвращает новые (lat, lng).
         """
-        angle_step = math.pi * 2 / count
-        circle_start_angle = 85
-        leg_length = 0.00016
-        if 4 < count <= 8:
-            leg_length = leg_length * 1.8
-        elif 8 < count <= 12:
-            leg_length = leg_length * 2.2
-        elif count > 12:
-            leg_length = leg_length * 2.5
-
-        res = []
-
-        for i in range(count):
-            angle = circle_start_angle + i * angle_step
-            res.append(
-                (
-                    # latitude
-                    center_pt[0] + leg_length * math.sin(angle),
-                    # longitude
-                    center_pt[1] + leg_length * math.cos(angle),
-                )
-            )
-
-        return res
-
-    def _tie_clusters(self, x):
-        length = len(x)
-        if length == 1:
-            return x
-        coord = (x.lat.iloc[0], x.lng.iloc[0])
-        new_coords = self._spiderfy_shape_positions(length, coord)
-        new_coords = list(zip(*new_coords))
-        x.lat = new_coords[0]
-        x.lng = new_coords[1]
-        return x
-
+        groups = pd.Series(clusters).groupby(clusters)
+        count = groups.transform('size').to_numpy()
+        rank = groups.cumcount().to_numpy()
+        first = clusters
+        leg_length = cls.LEG_LENGTH * np.select(
+            [count <= 4, count <= 8, count <= 12], [1, 1.8, 2.2], 2.5)
+        angle = 85 + rank * (np.pi * 2 / count)
+        spread = count > 1
+        new_lat = np.where(spread,
+                           lat[first] + leg_length * np.sin(angle), lat)
+        new_lng = np.where(spread,
+                           lng[first] + leg_length * np.cos(angle), lng)
+        return new_lat, new_lng
+
+    @profiled('map.concatenate_points')
     def _concatenate_points(self, df) -> pd.DataFrame:
-        df = skmob.TrajDataFrame(df,
-                                 latitude='latitude',
-                                 longitude='longitude')
-        df = clustering.cluster(df, cluster_radius_km=0.005)
-        df = df.groupby(by='cluster', group_keys=False)\
-            .apply(lambda x: self._tie_clusters(x))
-        return pd.DataFrame(df)
+        """Раздвигает перекрывающиеся точки df (столбцы latitude, longitude).
+        Возвращает df со столбцами lat, lng (новые координаты) и cluster."""
+        df = df.rename(columns={'latitude': 'lat', 'longitude': 'lng'}) \
+            .reset_index(drop=True)
+        lat = df['lat'].to_numpy(dtype=float)
+        lng = df['lng'].to_numpy(dtype=float)
+        clusters = self._overlap_clusters(lat, lng, self.OVERLAP_RADIUS_M)
+        df['lat'], df['lng'] = self._spiderfy(lat, lng, clusters)
+        df['cluster'] = clusters
+        return df
 
     @property
+    @profiled('map.html')
     def map_html(self):
         return self.map._repr_html_()
 
@@ -95,12 +231,32 @@ class MapMovements(OneEmployeeReport, MapsBase):
     _clusters_points - кластеры
     map - объект Folium
     map_html - код html для отображения карты
+    Для прошедших дней as_json_dict можно получить из кэша, не формируя
+    карту заново: MapMovements.cached_json(name_id, date, division).
     """
+    # Вид маркеров по kind точки (параметры L.AwesomeMarkers.icon)
+    ICONS = {
+        'object': {'icon': 'user', 'prefix': 'fa', 'markerColor': 'black'},
+        'start': {'icon': 'play', 'prefix': 'fa', 'markerColor': 'green'},
+        'pause': {'icon': 'pause', 'prefix': 'fa', 'markerColor': 'orange'},
+        'stop': {'icon': 'stop', 'prefix': 'fa', 'markerColor': 'red'},
+    }
+    # Параметры маршрута (L.polyline.antPath)
+    PATH_OPTIONS = {'delay': 1000, 'weight': 6, 'dashArray': [9, 100],
+                    'color': '#000000', 'pulseColor': '#FFFFFF',
+                    'hardwareAcceleration': True, 'opacity': 0.6}
+    # Библиотеки folium.Map, которые подключаются на страницу
+    MAP_JS = ('leaflet', 'awesome_markers')
+    MAP_CSS = ('leaflet_css', 'awesome_markers_font_css',
+               'awesome_markers_css')
+
     def __init__(self,
                  name_id: int,
                  date: Union[dt.date, str],
-                 division: Union[int, str]):
-        super().__init__(name_id, date, division)
+                 division: Union[int, str],
+                 inputs: Optional[tuple] = None):
+        with span('map.movements.report'):
+            super().__init__(name_id, date, division, inputs)
         self._objects = self._stmts\
             .drop_duplicates('object_id')\
             .loc[:, ['object', 'longitude', 'latitude', 'address']]
@@ -109,91 +265,58 @@ class MapMovements(OneEmployeeReport, MapsBase):
                                     median(self.clusters.longitude)]
 
         points = pd.concat([self._clusters_points, self._objects_points])
-        # Для формирования TDF колонка datetime должна быть заполнена.
-        # В _objects_points не может быть datetime.
-        # Но в данном случае не имеет значения, каким временем, поэтому
-        # просто заполним случайным оразом
-        points['datetime'] = points['datetime'].ffill()
         self._points = self._concatenate_points(points)
 
         self.map = self._create_map()
 
     @property
     def _objects_points(self) -> pd.DataFrame:
-        # Объекты
+        # Объекты: название (подсказка) и адрес (при нажатии на точку)
         objects = self._objects
-        objects['icon'] = [folium.features.Icon(icon='user',
-                                                prefix='fa',
-                                                color='black') for _ in
-                           range(len(objects))]
-        objects['tooltip'] = objects['object']
-        objects['popup'] = objects['object'] + '\n' + objects['address']
-        return objects
+        objects['kind'] = 'object'
+        objects['text'] = objects['object'].astype(str).map(html.escape)
+        objects['detail'] = objects['address'].astype(str).map(html.escape)
+        return objects[['latitude', 'longitude', 'kind', 'text', 'detail']]
 
     @property
     def _clusters_points(self) -> pd.DataFrame:
-        clusters = self.clusters
-        clusters['popup'] = clusters['leaving_datetime'] - clusters['datetime']
-
-        clusters = clusters.sort_values(by='datetime')
+        clusters = self.clusters.sort_values(by='datetime')
 
         # Первая и последняя иконка - это начало и конец пути. Остальные -
         # "пауза".
-        icons = [
-            folium.features.Icon(icon='pause', prefix='fa', color='orange')
-            for _ in range(len(clusters))
-        ]
-        icons[0] = folium.features.Icon(
-            icon='play', prefix='fa', color='green'
-        )
-        icons[-1] = folium.features.Icon(
-            icon='stop', prefix='fa', color='red'
-        )
-        # Добавление иконок к кластерам
-        clusters['icon'] = icons
-        # Информация о времени (при наведении курсора)
-        clusters['tooltip'] = clusters['datetime'] \
-            .apply(lambda x: x.strftime('%H:%M'))
-        # Подробная информация (при нажатии на точку)
-        clusters['popup'] = clusters.apply(lambda x: (
-            "Время:\n"
-            f"{x['tooltip']}\n"
-            "Длительность:\n"
-            f"{str(x['popup'])[-8:]}"), axis=1)
-        clusters = clusters[
-            ['datetime', 'latitude', 'longitude', 'icon', 'popup', 'tooltip']
-        ]
-        return clusters
-
+        kinds = ['pause'] * len(clusters)
+        kinds[0] = 'start'
+        kinds[-1] = 'stop'
+        clusters['kind'] = kinds
+        # Время начала (при наведении курсора), минут с начала дня, и
+        # длительность (при нажатии на точку), секунд. Подписи
+        # формируются в браузере (PointsLayer).
+        start = pd.to_datetime(clusters['datetime'])
+        clusters['text'] = start.dt.hour * 60 + start.dt.minute
+        clusters['detail'] = (pd.to_datetime(clusters['leaving_datetime'])
+                              - start).dt.total_seconds().astype(int)
+        return clusters[['latitude', 'longitude', 'kind', 'text', 'detail']]
+
+    @profiled('map.movements.create_map')
     def _create_map(self):
         # СОЗДАНИЕ КАРТЫ
         map = folium.Map(self._median_coordinates, zoom_start=12)
+        # Из библиотек folium по умолчанию нужны только leaflet и
+        # awesome-markers (jquery и bootstrap карта не использует)
+        map.default_js = [i for i in map.default_js
+                          if i[0] in self.MAP_JS]
+        map.default_css = [i for i in map.default_css
+                           if i[0] in self.MAP_CSS]
         e = Figure(height="100%")  # todo: поменять на "100%"
         e.add_child(map)
 
-        # Накидываем на карту все образовавшиеся точки.
-        for row in self._points.itertuples():
-            folium.Marker(
-                (row.lat, row.lng),
-                popup=row.popup,
-                tooltip=row.tooltip,
-                icon=row.icon
-            ).add_to(map)
-
-        # Antpath отображает маршрут через анимацию ползающих "муравьев"
-        path = self.clusters.sort_values(by='datetime')
-        AntPath([i for i in zip(path.latitude,
-                                path.longitude)],
-                delay=1000,
-                weight=6,
-                dash_array=[9, 100],
-                color='#000000',
-                pulseColor='#FFFFFF',
-                hardwareAcceleration=True,
-                opacity=0.6).add_to(map)
+        # Все точки и маршрут (AntPath отображает маршрут через анимацию
+        # ползающих "муравьев") одним элементом
+        PointsLayer(self._points, self.ICONS, self.PATH_OPTIONS).add_to(map)
         return map
 
     @property
+    @profiled('map.movements.as_json_dict')
     def as_json_dict(self) -> dict:
         report = None
         analytics = None
@@ -223,6 +346,105 @@ class MapMovements(OneEmployeeReport, MapsBase):
             resp['analytics'] = analytics
         return resp
 
+    @classmethod
+    def cached_json(cls,
+                    name_id: int,
+                    date: Union[dt.date, str],
+                    division: Union[int, str]) -> dict:
+        """
+        as_json_dict из кэша redis. Карта за прошедший день формируется
+        один раз и хранится MAP_CACHE['TTL_DAYS'] дней.
+        Ключ включает версию исходных данных: хэш заявленных выходов и
+        журнала сотрудника (несколько строк) и кол-во и последний
+        locationID локаций за день (сами локации не запрашиваются). Если
+        выходы, журнал или набор локаций изменились (в т.ч. не через
+        invalidate), карта формируется заново. Текущий день не кэшируется.
+        """
+        from trajectory_report import database
+        from trajectory_report.report import construct_select as cs
+        from trajectory_report.report.CacheNamespace import key as cache_key
+        from trajectory_report.report.ConstructReport import redis_available
+
+        date = dt.date.fromisoformat(str(date))
+        if date >= dt.date.today() or not redis_available():
+            return cls(name_id, date, division).as_json_dict
+        r_conn = database.REDIS_CONN
+        with database.DB_ENGINE.connect() as conn:
+            stmts, journal, subscriber_id = cls._query_employee(
+                conn, name_id, division, date)
+            count, last_id = conn.execute(
+                cs.locations_version_one_emp(date, subscriber_id)).one()
+        key = cache_key(f'map_movements:{int(name_id)}:{date}:{division}:'
+                        f'{cls._inputs_hash((stmts, journal))}:'
+                        f'{count}:{last_id}')
+        fetched = r_conn.get(key)
+        if fetched:
+            return pickle.loads(bz2.decompress(fetched))
+        with database.DB_ENGINE.connect() as conn:
+            locations = pd.read_sql(cs.locations_one_emp(date, subscriber_id),
+                                    conn)
+        resp = cls(name_id, date, division,
+                   (stmts, journal, locations)).as_json_dict
+        r_conn.set(key, bz2.compress(pickle.dumps(resp)),
+                   ex=dt.timedelta(days=MAP_CACHE['TTL_DAYS']))
+        return resp
+
+    @staticmethod
+    def _inputs_hash(inputs: tuple) -> str:
+        """Хэш исходных таблиц (заявленные выходы и журнал сотрудника,
+        несколько строк)"""
+        digest = hashlib.sha1()
+        for df in inputs:
+            digest.update(repr((list(df.columns),
+                                df.to_numpy().tolist())).encode())
+        return digest.hexdigest()[:16]
+
+
+class LazyLayers(MacroElement):
+    """
+    Слои сотрудников, которые загружаются при включении в списке слоев.
+    На странице только названия слоев, точки каждого слоя (GeoJSON)
+    запрашиваются по адресу url_template (вместо {name_id} - id сотрудника)
+    при первом включении слоя.
+    layers - {name_id: название слоя}
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }}_overlays = {};
+        var {{ this.get_name() }}_ids = new Map();
+        {% for name_id, name in this.layers.items() %}
+        (function () {
+            var group = L.layerGroup();
+            {{ this.get_name() }}_overlays[{{ name|tojson }}] = group;
+            {{ this.get_name() }}_ids.set(group, {{ name_id|tojson }});
+        })();
+        {% endfor %}
+        L.control.layers({}, {{ this.get_name() }}_overlays)
+            .addTo({{ this._parent.get_name() }});
+        {{ this._parent.get_name() }}.on('overlayadd', function (e) {
+            var group = e.layer;
+            if (group._loaded) { return; }
+            group._loaded = true;
+            var url = {{ this.url_template|tojson }}.replace(
+                '{name_id}', {{ this.get_name() }}_ids.get(group));
+            fetch(url).then(function (r) { return r.json(); })
+                .then(function (data) {
+                    L.geoJson(data, {
+                        onEachFeature: function (feature, layer) {
+                            layer.bindPopup(feature.properties.p);
+                        }
+                    }).addTo(group);
+                });
+        });
+        {% endmacro %}
+    """)
+
+    def __init__(self, layers: dict, url_template: str):
+        super().__init__()
+        self._name = 'LazyLayers'
+        self.layers = layers
+        self.url_template = url_template
+
 
 class MapBindings(Report, MapsBase):
     """
@@ -230,6 +452,13 @@ class MapBindings(Report, MapsBase):
     Каждый сотрудник - это слой на карте (по умолчанию отключен), который
     отображает на карте подопечных.
     Помогает увидеть, в каком районе у сотрудника находятся подопечные.
+    Вместе с картой строится отчет (Report). Если нужна только карта -
+    StatementsBindings.
+    layers_url - адрес слоя сотрудника с {name_id}, например
+        '/api/bindings/2023-08-01/2023-08-31/1/{name_id}'. Если задан,
+        на карте только список слоев, а точки загружаются при включении
+        слоя (см. layer_geojson, cached_layer). Иначе все слои
+        встраиваются в страницу.
     """
     def __init__(self,
                  date_from: Union[dt.date, str],
@@ -237,8 +466,13 @@ class MapBindings(Report, MapsBase):
                  division: Optional[Union[int, str]] = None,
                  name_ids: Optional[List[int]] = None,
                  object_ids: Optional[List[int]] = None,
+                 layers_url: Optional[str] = None,
+                 use_cache: bool = True,
+                 source: Optional[ReportDataSource] = None,
+                 counts: bool = False
                  ):
-        super().__init__(date_from, date_to, division, name_ids, object_ids)
+        super().__init__(date_from, date_to, division, name_ids, object_ids,
+                         counts=counts, use_cache=use_cache, source=source)
 
         self.points = self._points_from_stmts()
 
@@ -246,18 +480,79 @@ class MapBindings(Report, MapsBase):
             location=[55.50703, 37.58213],
             zoom_start=12, tiles='cartodbpositron',
         )
-        self._create_map()
+        if layers_url:
+            layers = self.points.drop_duplicates('name_id') \
+                .sort_values('name')
+            LazyLayers(dict(zip(layers.name_id.tolist(), layers.name)),
+                       layers_url).add_to(self.map)
+        else:
+            self._create_map()
 
     def save_map(self):
         self.map.save('/home/user/Desktop/map.html')
 
+    def layer_geojson(self, name_id: int) -> dict:
+        """Подопечные сотрудника name_id (слой карты) в виде GeoJSON"""
+        points = self.points.loc[self.points.name_id == int(name_id)]
+        return {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature',
+             'geometry': {'type': 'Point',
+                          'coordinates': [round(lng, 6), round(lat, 6)]},
+             'properties': {'p': html.escape(str(name))}}
+            for lat, lng, name in zip(points.lat, points.lng, points.object)]}
+
+    @classmethod
+    def cached_layer(cls,
+                     date_from: Union[dt.date, str],
+                     date_to: Union[dt.date, str],
+                     division: Union[int, str],
+                     name_id: int) -> dict:
+        """
+        layer_geojson из кэша redis. При первом запросе слоя за период
+        формируются и сохраняются слои всех сотрудников подразделения
+        (на MAP_CACHE['BINDINGS_TTL_SECONDS']), остальные слои берутся
+        из кэша. Ключ включает версию данных кэша (cache_version).
+        Даты, подразделение и name_id приводятся к одному виду, чтобы
+        '2023-08-01' и date(2023, 8, 1), '1' и 1 давали один ключ.
+        """
+        from trajectory_report import database
+        from trajectory_report.report.CacheNamespace import key as cache_key
+        from trajectory_report.report.ConstructReport import (
+            cache_version, redis_available)
+
+        date_from = dt.date.fromisoformat(str(date_from))
+        date_to = dt.date.fromisoformat(str(date_to))
+        if str(division).isdigit():
+            division = int(division)
+        name_id = int(name_id)
+        # Для слоев отчет не нужен
+        if not redis_available():
+            return StatementsBindings(date_from, date_to, division) \
+                .layer_geojson(name_id)
+        r_conn = database.REDIS_CONN
+        key = cache_key(f'map_bindings:{date_from}:{date_to}:{division}:'
+                        f'{cache_version(r_conn)}')
+        fetched = r_conn.hget(key, name_id)
+        if fetched is None and not r_conn.exists(key):
+            bindings = StatementsBindings(date_from, date_to, division)
+            layers = {i: json.dumps(bindings.layer_geojson(i))
+                      for i in bindings.points.name_id.unique().tolist()}
+            pipe = r_conn.pipeline()
+            pipe.hset(key, mapping=layers)
+            pipe.expire(key, MAP_CACHE['BINDINGS_TTL_SECONDS'])
+            pipe.execute()
+            fetched = layers.get(name_id)
+        if fetched is None:
+            return {'type': 'FeatureCollection', 'features': []}
+        return json.loads(fetched)
+
     def _create_map(self):
         self.points.groupby('name').apply(lambda x: self._make_layer(x))
         self.map.add_child(folium.map.LayerControl())
 
     def _make_layer(self, x):
         self.map.add_child(
-            folium.plugins.MarkerCluster(
+            MarkerCluster(
                 disableClusteringAtZoom=True,
                 show=False,
                 name=x.name,
@@ -278,12 +573,6 @@ class MapBindings(Report, MapsBase):
             .loc[self._stmts.object_id != 1] \
             .drop_duplicates(['name', 'object'])
 
-        # Для кластеризации необходим столбец со временем, сгенерируем его
-        # сами, т.к. подопечные имеют только координаты.
-        points['datetime'] = points.date.apply(
-            lambda x: dt.datetime.fromisoformat(str(x))
-        )
-
         # ПРОБЛЕМА: при раскидывании близлежащих точек один объект может
         # оказаться с несколькими разными координатами.
         # Решением будет изъять все уникальные объекты, раскинуть их координаты
@@ -296,3 +585,16 @@ class MapBindings(Report, MapsBase):
         points = pd.merge(points, objects, left_index=True, right_index=True)
 
         return points.reset_index()
+
+
+class StatementsBindings(MapBindings):
+    """
+    Карта привязок без отчета: запрашиваются только заявленные выходы с
+    координатами подопечных (REQUIRED_TABLES), кластеры, журнал и
+    посещения не запрашиваются. Атрибуты отчета (report,
+    horizontal_report и т.д.) не заполняются.
+    """
+    REQUIRED_TABLES = frozenset({'stmts'})
+
+    def _build(self):
+        pass
@@ -0,0 +1,20 @@
+# (миграция: таблица serves_verdict с предлагаемыми решениями по
+# служебным запискам, см. report/ServesVerifier.py)
+# Запуск: python -m trajectory_report.migrations.serves_verdict
+from trajectory_report import database
+from trajectory_report.models import ServesVerdict
+
+
+def upgrade():
+    with database.DB_ENGINE.begin() as conn:
+        ServesVerdict.__table__.create(conn, checkfirst=True)
+    print(f'{ServesVerdict.__tablename__} is ready.')
+
+
+def downgrade():
+    with database.DB_ENGINE.begin() as conn:
+        ServesVerdict.__table__.drop(conn, checkfirst=True)
+
+
+if __name__ == "__main__":
+    upgrade()
@@ -0,0 +1,39 @@
+# (миграция: столбцы location с SPATIAL индексом для clusters_site
+# и objects_site, см. models.Point)
+# Столбцы вычисляемые (STORED), поэтому код, который добавляет кластеры
+# и объекты, менять не нужно: MySQL заполняет location сам.
+# Запуск: python -m trajectory_report.migrations.spatial_location
+from sqlalchemy import text, inspect
+from trajectory_report import database
+from trajectory_report.models import LOCATION_EXPRESSION, SPATIAL_TABLES
+
+
+TABLES = SPATIAL_TABLES
+
+
+def upgrade():
+    with database.DB_ENGINE.begin() as conn:
+        inspector = inspect(conn)
+        for table, index in TABLES.items():
+            columns = [i['name'] for i in inspector.get_columns(table)]
+            if 'location' not in columns:
+                conn.execute(text(
+                    f"ALTER TABLE {table} ADD COLUMN location POINT "
+                    f"GENERATED ALWAYS AS ({LOCATION_EXPRESSION}) "
+                    f"STORED SRID 0 NOT NULL"))
+            indexes = [i['name'] for i in inspector.get_indexes(table)]
+            if index not in indexes:
+                conn.execute(text(
+                    f"ALTER TABLE {table} ADD SPATIAL INDEX {index} (location)"))
+            print(f'{table}: location column and {index} are ready.')
+
+
+def downgrade():
+    with database.DB_ENGINE.begin() as conn:
+        for table, index in TABLES.items():
+            conn.execute(text(f"ALTER TABLE {table} DROP INDEX {index}"))
+            conn.execute(text(f"ALTER TABLE {table} DROP COLUMN location"))
+
+
+if __name__ == "__main__":
+    upgrade()
@@ -1,7 +1,11 @@
 # (модели базы данных)
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import ForeignKey, String, Index, CHAR, UniqueConstraint, REAL
+from sqlalchemy import (ForeignKey, String, Index, CHAR, UniqueConstraint, REAL,
+                        Computed, Column, literal_column)
+from sqlalchemy.types import UserDefinedType
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.ext.compiler import compiles
 import datetime as dt
 
 """
@@ -16,6 +20,56 @@ class Base(DeclarativeBase):
     pass
 
 
+class Point(UserDefinedType):
+    """Тип MySQL POINT. Столбцы этого типа вычисляются из longitude и
+    latitude (Computed), чтобы по ним можно было построить SPATIAL индекс
+    и фильтровать расстояние в БД через ST_Distance_Sphere (см. location)."""
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return 'POINT'
+
+
+@compiles(CreateColumn, 'mysql')
+def _point_srid(element, compiler, **kw):
+    """Оптимизатор MySQL использует SPATIAL индекс, только если у столбца
+    задан SRID. Для вычисляемого столбца атрибут SRID указывается
+    после STORED, поэтому он добавляется здесь, а не в get_col_spec."""
+    text = compiler.visit_create_column(element, **kw)
+    if isinstance(element.element.type, Point):
+        text = text.replace(' STORED', ' STORED SRID 0', 1)
+    return text
+
+
+# Выражение для столбца location: POINT(longitude, latitude).
+# Объекты без координат получают точку (0, 0), так как столбец с SPATIAL
+# индексом не может быть NULL.
+LOCATION_EXPRESSION = 'point(coalesce(longitude, 0), coalesce(latitude, 0))'
+
+# Таблицы со столбцом location и их SPATIAL индексы.
+# Столбцы создаются миграцией migrations.spatial_location и в модели не
+# входят: ORM-запросы к этим таблицам (в т.ч. через Serves.object) должны
+# работать и в БД без миграции. Столбец нужен только запросу
+# construct_select.attends_in_radius (REPORT_BASE['SQL_DISTANCE']).
+SPATIAL_TABLES = {
+    'clusters_site': 'clusters_location',
+    'objects_site': 'objects_location'
+}
+
+
+def location_column() -> Column:
+    """Описание столбца location для создания таблицы"""
+    return Column('location', Point,
+                  Computed(LOCATION_EXPRESSION, persisted=True),
+                  nullable=False)
+
+
+def location(model):
+    """Столбец location таблицы модели (Clusters или ObjectsSite) для
+    использования в запросах"""
+    return literal_column(f'{model.__tablename__}.location', Point)
+
+
 class Serves(Base):
     __tablename__ = 'serves_site'
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -37,6 +91,22 @@ class Serves(Base):
                 f"Date: {self.date} Approval: {self.approval}")
 
 
+class ServesVerdict(Base):
+    """Предлагаемое решение по служебной записке на проверке
+    (report/ServesVerifier.py). Создается миграцией
+    migrations.serves_verdict."""
+    __tablename__ = 'serves_verdict'
+    serve_id: Mapped[int] = mapped_column(ForeignKey('serves_site.id'),
+                                          primary_key=True)
+    verdict: Mapped[str] = mapped_column(String(20))
+    # Расстояние до ближайшего кластера сотрудника за день, в метрах
+    distance: Mapped[int] = mapped_column(nullable=True)
+    checked_at: Mapped[dt.datetime]
+
+    def __repr__(self):
+        return f"Serve: {self.serve_id} Verdict: {self.verdict}"
+
+
 class Statements(Base):
     __tablename__ = "statements_site"
     id: Mapped[int] = mapped_column(primary_key=True)
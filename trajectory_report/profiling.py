@@ -0,0 +1,195 @@
+# (замеры времени, кол-ва строк и памяти по этапам формирования отчета)
+# Этапы оборачиваются в контекстный менеджер span:
+#
+#     with span('report.distance', rows_in=len(df)) as s:
+#         df = self._calculate_distance_vectorized(df)
+#         s.rows_out = len(df)
+#
+# Пока PROFILING['ENABLED'] выключен, span возвращает один и тот же
+# пустой объект, поэтому замеры почти ничего не стоят.
+# Результаты доступны списком (recent_spans), в виде логов (log_spans)
+# и в формате textfile для node_exporter (write_prometheus_textfile).
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from typing import Optional, List
+
+from trajectory_report.config import PROFILING
+
+
+logger = logging.getLogger('trajectory_report.profiling')
+
+
+class Span:
+    """Замер одного этапа. rows_out заполняется внутри блока with."""
+    __slots__ = ('name', 'rows_in', 'rows_out', 'seconds', 'memory_peak',
+                 '_started', '_memory_start', '_memory_peak_abs')
+
+    def __init__(self, name: str, rows_in: Optional[int] = None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out: Optional[int] = None
+        self.seconds: Optional[float] = None
+        # Пиковый прирост памяти за время этапа, байт (PROFILING['MEMORY'])
+        self.memory_peak: Optional[int] = None
+        self._started = 0.0
+        self._memory_start = 0
+        self._memory_peak_abs = 0
+
+    def as_dict(self) -> dict:
+        return {'stage': self.name, 'seconds': self.seconds,
+                'rows_in': self.rows_in, 'rows_out': self.rows_out,
+                'memory_peak': self.memory_peak}
+
+
+class _NullSpan:
+    """Заглушка, когда замеры выключены: принимает любые атрибуты"""
+    __slots__ = ()
+
+    def __setattr__(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+_lock = threading.Lock()
+_local = threading.local()
+# Последние замеры и накопленные значения по этапам (для prometheus)
+_recent: deque = deque(maxlen=1000)
+_totals: dict = defaultdict(lambda: {'seconds': 0.0, 'count': 0,
+                                     'rows_out': 0, 'memory_peak': 0})
+
+
+def _stack() -> List[Span]:
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def span(name: str, rows_in: Optional[int] = None):
+    """Замер этапа name. Если замеры выключены - пустой контекст."""
+    if not PROFILING['ENABLED']:
+        return _NULL_SPAN
+    return _span(name, rows_in)
+
+
+def profiled(name: str):
+    """Декоратор: замер всего метода или функции как этапа name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def _span(name: str, rows_in: Optional[int] = None):
+    s = Span(name, rows_in)
+    stack = _stack()
+    # tracemalloc.reset_peak сбрасывает пик всего процесса: этапы других
+    # потоков сбивали бы замеры друг друга, поэтому память замеряется
+    # только в главном потоке (см. PROFILING['MEMORY'])
+    memory = PROFILING['MEMORY'] \
+        and threading.current_thread() is threading.main_thread()
+    if memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        current, peak = tracemalloc.get_traced_memory()
+        # Пик внешнего этапа до сброса, чтобы он не потерялся
+        if stack:
+            stack[-1]._memory_peak_abs = max(stack[-1]._memory_peak_abs, peak)
+        tracemalloc.reset_peak()
+        s._memory_start = current
+    stack.append(s)
+    s._started = time.perf_counter()
+    try:
+        yield s
+    finally:
+        s.seconds = time.perf_counter() - s._started
+        stack.pop()
+        if memory and tracemalloc.is_tracing():
+            _, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, s._memory_peak_abs)
+            s.memory_peak = peak - s._memory_start
+            if stack:
+                stack[-1]._memory_peak_abs = max(
+                    stack[-1]._memory_peak_abs, peak)
+        _record(s)
+
+
+def _record(s: Span) -> None:
+    with _lock:
+        _recent.append(s)
+        total = _totals[s.name]
+        total['seconds'] += s.seconds
+        total['count'] += 1
+        total['rows_out'] += s.rows_out or 0
+        total['memory_peak'] = max(total['memory_peak'], s.memory_peak or 0)
+    if PROFILING['LOG']:
+        logger.info(json.dumps(s.as_dict(), ensure_ascii=False))
+
+
+def recent_spans() -> List[dict]:
+    """Последние замеры (не более 1000), от старых к новым"""
+    with _lock:
+        return [s.as_dict() for s in _recent]
+
+
+def reset() -> None:
+    with _lock:
+        _recent.clear()
+        _totals.clear()
+
+
+def log_spans(level: int = logging.INFO) -> None:
+    """Записать последние замеры в лог, по одной json-строке на этап"""
+    for s in recent_spans():
+        logger.log(level, json.dumps(s, ensure_ascii=False))
+
+
+def prometheus_text() -> str:
+    """Накопленные замеры в текстовом формате prometheus"""
+    metrics = [
+        ('trajectory_report_stage_seconds_total', 'counter',
+         'Total wall time spent in a report stage', 'seconds'),
+        ('trajectory_report_stage_calls_total', 'counter',
+         'Number of times a report stage ran', 'count'),
+        ('trajectory_report_stage_rows_out_total', 'counter',
+         'Total rows produced by a report stage', 'rows_out'),
+        ('trajectory_report_stage_memory_peak_bytes', 'gauge',
+         'Largest peak memory growth observed in a report stage',
+         'memory_peak'),
+    ]
+    with _lock:
+        totals = {k: dict(v) for k, v in _totals.items()}
+    lines = []
+    for metric, kind, help_text, key in metrics:
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+        for stage, total in sorted(totals.items()):
+            lines.append(f'{metric}{{stage="{stage}"}} {total[key]}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus_textfile(path: Optional[str] = None) -> None:
+    """Запись для textfile collector node_exporter. Файл пишется во
+    временный и переименовывается, чтобы не отдать его наполовину."""
+    path = path or PROFILING['PROMETHEUS_TEXTFILE']
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
@@ -0,0 +1,319 @@
+# (замеры запросов к БД: время по видам запросов, кол-во строк,
+# ожидание соединений из пула и лог медленных запросов)
+# Замеры подключаются к событиям engine и пула sqlalchemy:
+#
+#     from trajectory_report.database import DB_ENGINE
+#     from trajectory_report import query_metrics
+#     query_metrics.install(DB_ENGINE)
+#     ...
+#     print(query_metrics.top(10))
+#
+# При QUERY_METRICS['ENABLED'] подключение выполняется в database.py.
+# Запросы группируются по "виду" (shape): тексту запроса, в котором
+# литералы и списки IN (?, ?, ...) заменены на ?. Так запросы отчета за
+# разные даты и подразделения попадают в одну группу.
+# Строки берутся из cursor.rowcount сразу после выполнения запроса, для
+# любых запросов: у mysqlconnector (buffered=True по умолчанию) и MySQLdb
+# результат SELECT к этому моменту уже получен, и rowcount равен кол-ву
+# строк. Если драйвер rowcount не знает (-1, например SQLite для SELECT),
+# запрос учитывается в rows_unknown, а не как 0 строк.
+# Время ожидания соединения из пула замеряется пулом TimedQueuePool: при
+# QUERY_METRICS['ENABLED'] database.py создает engine с ним, для своего
+# engine - create_engine(..., poolclass=query_metrics.TimedQueuePool).
+# Кроме того, замеряется открытие новых соединений и занятость пула при
+# каждом получении соединения (сколько выдано, сколько раз сверх
+# pool_size).
+import bisect
+import json
+import logging
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+from trajectory_report.config import QUERY_METRICS
+
+
+slow_logger = logging.getLogger('trajectory_report.slow_query')
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])')
+_PARAM = re.compile(r'%\(\w+\)s|%s|:\w+|\?')
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACES = re.compile(r'\s+')
+
+
+def statement_shape(statement: str) -> str:
+    """Текст запроса без литералов и значений параметров"""
+    shape = _STRING.sub('?', statement)
+    shape = _NUMBER.sub('?', shape)
+    shape = _PARAM.sub('?', shape)
+    shape = _LIST.sub('(?, ...)', shape)
+    return _SPACES.sub(' ', shape).strip()
+
+
+def redact(parameters: Any) -> Any:
+    """Параметры запроса с типами вместо значений"""
+    if isinstance(parameters, dict):
+        return {k: redact(v) for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if len(parameters) > 10:
+            return f'<{len(parameters)} values>'
+        return [redact(i) for i in parameters]
+    if parameters is None:
+        return None
+    return f'<{type(parameters).__name__}>'
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'count', 'total', 'max', 'rows', 'rows_unknown')
+
+    def __init__(self):
+        self.buckets = [0] * (len(QUERY_METRICS['BUCKETS']) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        # Запросы, для которых драйвер не сообщил кол-во строк
+        self.rows_unknown = 0
+
+    def observe(self, seconds: float, rows: Optional[int] = 0) -> None:
+        self.buckets[bisect.bisect_left(QUERY_METRICS['BUCKETS'],
+                                        seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if rows is None:
+            self.rows_unknown += 1
+        else:
+            self.rows += rows
+
+    def as_dict(self) -> dict:
+        return {'count': self.count, 'seconds': self.total,
+                'max_seconds': self.max, 'rows': self.rows,
+                'rows_unknown': self.rows_unknown,
+                'buckets': dict(zip(QUERY_METRICS['BUCKETS'] + ('+Inf',),
+                                    self.buckets))}
+
+
+_lock = threading.Lock()
+_queries: Dict[str, _Histogram] = dict()
+# Открытие новых соединений с БД
+_connect = _Histogram()
+# Ожидание соединения из пула (TimedQueuePool)
+_checkout_wait = _Histogram()
+# Получение соединений из пула
+_pool = {'checkouts': 0, 'overflow': 0, 'max_checked_out': 0}
+# Подключенные engine -> события
+_installed: Dict[Engine, List[tuple]] = dict()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters,
+                           context, executemany):
+    conn.info.setdefault('query_metrics_started', []) \
+        .append((statement, time.perf_counter()))
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters,
+                          context, executemany):
+    _, started = conn.info['query_metrics_started'].pop()
+    seconds = time.perf_counter() - started
+    # -1 (или отсутствие rowcount) - драйвер кол-во строк не знает
+    rows = getattr(cursor, 'rowcount', -1)
+    if rows is None or rows < 0:
+        rows = None
+    shape = statement_shape(statement)
+    with _lock:
+        _queries.setdefault(shape, _Histogram()).observe(seconds, rows)
+    if seconds >= QUERY_METRICS['SLOW_SECONDS']:
+        slow_logger.warning(json.dumps({
+            'seconds': round(seconds, 4),
+            'rows': rows,
+            'executemany': executemany,
+            'statement': shape,
+            'parameters': redact(parameters),
+        }, ensure_ascii=False, default=str))
+
+
+def _handle_error(exception_context):
+    # После ошибки запроса after_cursor_execute не вызывается: время
+    # начала снимается здесь, иначе оно останется в соединении из пула.
+    # Ошибка могла произойти и до before_cursor_execute, поэтому
+    # снимается только время этого же запроса.
+    conn = exception_context.connection
+    started = conn.info.get('query_metrics_started') if conn else None
+    if started and started[-1][0] == exception_context.statement:
+        started.pop()
+
+
+def _do_connect(dialect, conn_rec, cargs, cparams):
+    conn_rec.info['query_metrics_connect_started'] = time.perf_counter()
+
+
+def _on_connect(dbapi_connection, connection_record):
+    started = connection_record.info.pop('query_metrics_connect_started',
+                                         None)
+    if started is not None:
+        with _lock:
+            _connect.observe(time.perf_counter() - started)
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool, замеряющий время получения соединения: ожидание
+    освобождения соединения, когда заняты pool_size + max_overflow, и
+    открытие нового соединения, если пул его создает (отдельно оно видно
+    в замерах connect). Учитываются и неудачные попытки (TimeoutError
+    после pool_timeout).
+    engine.dispose() создает пул того же класса, замеры продолжаются.
+    """
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            seconds = time.perf_counter() - started
+            with _lock:
+                _checkout_wait.observe(seconds)
+
+
+def _checkout_listener(engine: Engine):
+    """Событие checkout пула engine. Пул берется из engine при каждом
+    вызове: после engine.dispose() он создается заново."""
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool = engine.pool
+        # Занятость есть только у QueuePool (у SQLite в памяти и
+        # NullPool её нет)
+        checked_out = pool.checkedout() \
+            if hasattr(pool, 'checkedout') else 0
+        overflow = hasattr(pool, 'overflow') and pool.overflow() > 0
+        with _lock:
+            _pool['checkouts'] += 1
+            _pool['max_checked_out'] = max(_pool['max_checked_out'],
+                                           checked_out)
+            _pool['overflow'] += overflow
+    return on_checkout
+
+
+def install(engine: Engine) -> None:
+    """Подключить замеры к engine. Повторный вызов ничего не делает.
+    События пула подключаются к engine и сохраняются после
+    engine.dispose(). Время ожидания соединения замеряется, только если
+    engine создан с poolclass=TimedQueuePool."""
+    if engine in _installed:
+        return
+    listeners = [(engine, 'before_cursor_execute', _before_cursor_execute),
+                 (engine, 'after_cursor_execute', _after_cursor_execute),
+                 (engine, 'handle_error', _handle_error),
+                 (engine, 'do_connect', _do_connect),
+                 (engine, 'connect', _on_connect),
+                 (engine, 'checkout', _checkout_listener(engine))]
+    for target, name, fn in listeners:
+        event.listen(target, name, fn)
+    _installed[engine] = listeners
+
+
+def uninstall(engine: Engine) -> None:
+    for target, name, fn in _installed.pop(engine, []):
+        event.remove(target, name, fn)
+
+
+def reset() -> None:
+    global _connect, _checkout_wait
+    with _lock:
+        _queries.clear()
+        _connect = _Histogram()
+        _checkout_wait = _Histogram()
+        _pool.update(checkouts=0, overflow=0, max_checked_out=0)
+
+
+def stats() -> dict:
+    """Накопленные замеры: по видам запросов, открытие соединений,
+    ожидание и получение соединений из пула"""
+    with _lock:
+        return {'queries': {k: v.as_dict() for k, v in _queries.items()},
+                'connect': _connect.as_dict(),
+                'checkout_wait': _checkout_wait.as_dict(),
+                'pool': dict(_pool)}
+
+
+def top(n: int = 10, by: str = 'seconds') -> List[dict]:
+    """Виды запросов с наибольшим суммарным временем (by='seconds'),
+    максимальным временем ('max_seconds'), кол-вом вызовов ('count')
+    или кол-вом строк ('rows')"""
+    queries = stats()['queries']
+    res = [{'statement': k, **{i: v[i] for i in
+                               ('count', 'seconds', 'max_seconds', 'rows')}}
+           for k, v in queries.items()]
+    return sorted(res, key=lambda x: x[by], reverse=True)[:n]
+
+
+def _label(value: str) -> str:
+    value = value[:QUERY_METRICS['SHAPE_LENGTH']]
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _histogram_lines(metric: str, h: dict, labels: str = '') -> List[str]:
+    sep = ',' if labels else ''
+    lines, cumulative = [], 0
+    for le, count in h['buckets'].items():
+        cumulative += count
+        lines.append(
+            f'{metric}_bucket{{{labels}{sep}le="{le}"}} {cumulative}')
+    lines.append(f'{metric}_sum{{{labels}}} {h["seconds"]}')
+    lines.append(f'{metric}_count{{{labels}}} {h["count"]}')
+    return lines
+
+
+def prometheus_text(statement: bool = True) -> str:
+    """Замеры в текстовом формате prometheus. statement=False - без
+    метки с текстом запроса (только соединения)"""
+    current = stats()
+    lines = ['# HELP trajectory_report_db_connect_seconds '
+             'Time spent opening a new DB connection',
+             '# TYPE trajectory_report_db_connect_seconds histogram']
+    lines += _histogram_lines('trajectory_report_db_connect_seconds',
+                              current['connect'])
+    lines += ['# HELP trajectory_report_db_checkout_wait_seconds '
+              'Time spent waiting for a pooled DB connection',
+              '# TYPE trajectory_report_db_checkout_wait_seconds histogram']
+    lines += _histogram_lines('trajectory_report_db_checkout_wait_seconds',
+                              current['checkout_wait'])
+    lines += ['# HELP trajectory_report_db_checkouts_total '
+              'Connections checked out from the pool',
+              '# TYPE trajectory_report_db_checkouts_total counter',
+              f'trajectory_report_db_checkouts_total '
+              f'{current["pool"]["checkouts"]}',
+              '# HELP trajectory_report_db_checkouts_overflow_total '
+              'Checkouts made while all pool_size connections were busy',
+              '# TYPE trajectory_report_db_checkouts_overflow_total '
+              'counter',
+              f'trajectory_report_db_checkouts_overflow_total '
+              f'{current["pool"]["overflow"]}']
+    if statement:
+        lines += ['# HELP trajectory_report_db_query_seconds '
+                  'DB query latency by statement shape',
+                  '# TYPE trajectory_report_db_query_seconds histogram']
+        for shape, h in sorted(current['queries'].items()):
+            lines += _histogram_lines('trajectory_report_db_query_seconds',
+                                      h, f'statement="{_label(shape)}"')
+        lines += ['# HELP trajectory_report_db_query_rows_total '
+                  'Rows returned or changed by statement shape',
+                  '# TYPE trajectory_report_db_query_rows_total counter']
+        for shape, h in sorted(current['queries'].items()):
+            lines.append(f'trajectory_report_db_query_rows_total'
+                         f'{{statement="{_label(shape)}"}} {h["rows"]}')
+        lines += ['# HELP trajectory_report_db_query_rows_unknown_total '
+                  'Queries whose driver did not report a row count',
+                  '# TYPE trajectory_report_db_query_rows_unknown_total '
+                  'counter']
+        for shape, h in sorted(current['queries'].items()):
+            lines.append(f'trajectory_report_db_query_rows_unknown_total'
+                         f'{{statement="{_label(shape)}"}} '
+                         f'{h["rows_unknown"]}')
+    return '\n'.join(lines) + '\n'
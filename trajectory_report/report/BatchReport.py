@@ -0,0 +1,92 @@
+# (отчеты по нескольким подразделениям за один запрос данных)
+# Вместо отдельного Report(...) на каждое подразделение таблицы
+# (выходы, журнал, кластеры, служебные записки и т.д.) запрашиваются один
+# раз за все подразделения, а затем каждый отчет строится по своей части:
+#
+#     reports = build_reports('all', '2023-08-01', '2023-08-31')
+#     write_xlsx(reports, '/tmp/reports')
+import datetime as dt
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Type, Union
+
+import pandas as pd
+
+from trajectory_report import database
+from trajectory_report.exceptions import ReportException
+from trajectory_report.profiling import span
+from trajectory_report.report import construct_select as cs
+from trajectory_report.report.ConstructReport import (
+    report_data_factory, PreloadedReportDataGetter)
+from trajectory_report.report.Report import Report
+
+
+def divisions() -> Dict[str, int]:
+    """{название подразделения: id}"""
+    with database.DB_ENGINE.connect() as conn:
+        df = pd.read_sql(cs.divisions(), conn)
+    return dict(zip(df.division_name, df.division))
+
+
+def build_reports(division_list: Union[str, List[Union[int, str]]],
+                  date_from: Union[dt.date, str],
+                  date_to: Union[dt.date, str],
+                  report_class: Type[Report] = Report,
+                  workers: int = 1,
+                  use_cache: bool = True,
+                  **kwargs) -> Dict[Union[int, str], Report]:
+    """
+    Отчеты report_class по подразделениям division_list (названия или id,
+    'all' - все подразделения) за период.
+    Таблицы запрашиваются один раз (report_data_factory без фильтра
+    по подразделению), отчеты строятся из них через
+    PreloadedReportDataGetter.
+    workers > 1 - строить отчеты параллельно в потоках.
+    kwargs передаются в report_class (например, counts=True).
+    Подразделения без заявленных выходов в результат не попадают.
+    """
+    names = divisions()
+    if division_list == 'all':
+        division_list = list(names)
+
+    with span('batch.fetch'):
+        data = report_data_factory(date_from, date_to, use_cache=use_cache,
+                                   tables=report_class.REQUIRED_TABLES)
+    source = PreloadedReportDataGetter(data, names)
+
+    def build(division) -> Optional[Report]:
+        try:
+            return report_class(date_from, date_to, division,
+                                source=source, **kwargs)
+        except ReportException as e:
+            print(f'{division}: {e}')
+            return None
+
+    with span('batch.build', rows_in=len(division_list)) as s:
+        if workers > 1:
+            with ThreadPoolExecutor(workers) as executor:
+                built = list(executor.map(build, division_list))
+        else:
+            built = [build(i) for i in division_list]
+        reports = {division: report
+                   for division, report in zip(division_list, built)
+                   if report is not None}
+        s.rows_out = len(reports)
+    return reports
+
+
+def write_xlsx(reports: Dict[Union[int, str], Report],
+               directory: str,
+               list_no_payments: Optional[list] = None) -> List[str]:
+    """Сохраняет отчеты в xlsx файлы
+    directory/{подразделение}_{date_from}_{date_to}.xlsx.
+    Возвращает список путей."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for division, report in reports.items():
+        path = os.path.join(directory, f'{division}_{report._date_from}_'
+                                       f'{report._date_to}.xlsx')
+        with open(path, 'wb') as f:
+            f.write(report.xlsx(list_no_payments).getbuffer())
+        paths.append(path)
+    return paths
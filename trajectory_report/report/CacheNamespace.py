@@ -0,0 +1,127 @@
+# (пространство имен ключей кэша в redis)
+# Закэшированные таблицы зависят от параметров отчета (REPORT_BASE,
+# STAY_LOCATIONS_CONFIG, CLUSTERS_CONFIG), от набора столбцов запросов
+# construct_select и от версии pandas (формат pickle). Все ключи кэша
+# начинаются с отпечатка этих значений:
+#     key('statements') -> 'tr:1a2b3c4d5e:statements'
+# После выката изменений новый код работает в новом пространстве имен и
+# не читает старые данные, а старые пространства имен, к которым давно не
+# обращались, удаляются в фоновом потоке (start_collector).
+# Поток запускается точкой входа долгоживущего процесса: веб-сервер
+# получает его вместе с ReportService (get_service), другие процессы
+# вызывают start_collector при запуске. Из cron сборку можно выполнить
+# один раз:
+#     python -m trajectory_report.report.CacheNamespace
+import datetime as dt
+import hashlib
+import json
+import os
+import threading
+import time
+from functools import lru_cache
+from typing import Optional
+
+import pandas as pd
+
+from trajectory_report import database
+from trajectory_report.config import (CACHE_CONFIG, CLUSTERS_CONFIG,
+                                      REPORT_BASE, STAY_LOCATIONS_CONFIG)
+from trajectory_report.report import construct_select as cs
+
+# Пространства имен и время последнего обращения к ним (sorted set)
+NAMESPACES_KEY = 'cache:namespaces'
+# Блокировка, чтобы сборку мусора выполнял один процесс за интервал
+COLLECTOR_LOCK_KEY = 'cache:collector'
+
+_collector: Optional[threading.Thread] = None
+_collector_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def fingerprint() -> str:
+    """Отпечаток параметров и схемы, от которых зависят данные в кэше"""
+    with open(cs.__file__, 'rb') as f:
+        selects = hashlib.sha1(f.read()).hexdigest()
+    state = {
+        'REPORT_BASE': REPORT_BASE,
+        'STAY_LOCATIONS_CONFIG': STAY_LOCATIONS_CONFIG,
+        'CLUSTERS_CONFIG': CLUSTERS_CONFIG,
+        'construct_select': selects,
+        'pandas': pd.__version__,
+    }
+    dumped = json.dumps(state, sort_keys=True, default=str).encode()
+    return hashlib.sha1(dumped).hexdigest()[:10]
+
+
+def namespace() -> str:
+    return f'tr:{fingerprint()}'
+
+
+def key(name: str) -> str:
+    """Ключ redis в текущем пространстве имен"""
+    return f'{namespace()}:{name}'
+
+
+def touch(r_conn) -> None:
+    """Отметить обращение к текущему пространству имен. Можно передать
+    pipeline, чтобы не делать отдельный запрос."""
+    r_conn.zadd(NAMESPACES_KEY, {namespace(): time.time()})
+
+
+def collect(r_conn=None) -> int:
+    """
+    Удаляет ключи пространств имен, к которым не обращались дольше
+    CACHE_CONFIG['NAMESPACE_IDLE_HOURS'] (кроме текущего).
+    Возвращает кол-во удаленных ключей.
+    """
+    r_conn = r_conn or database.REDIS_CONN
+    idle = dt.timedelta(hours=CACHE_CONFIG['NAMESPACE_IDLE_HOURS'])
+    stale = r_conn.zrangebyscore(NAMESPACES_KEY, '-inf',
+                                 time.time() - idle.total_seconds())
+    removed = 0
+    for ns in stale:
+        ns = ns.decode()
+        if ns == namespace():
+            continue
+        batch = []
+        for name in r_conn.scan_iter(match=f'{ns}:*', count=1000):
+            batch.append(name)
+            if len(batch) >= 1000:
+                removed += r_conn.unlink(*batch)
+                batch = []
+        if batch:
+            removed += r_conn.unlink(*batch)
+        r_conn.zrem(NAMESPACES_KEY, ns)
+    return removed
+
+
+def _collect_forever() -> None:
+    interval = CACHE_CONFIG['NAMESPACE_GC_MINUTES'] * 60
+    while True:
+        try:
+            r_conn = database.REDIS_CONN
+            if r_conn.set(COLLECTOR_LOCK_KEY, os.getpid(), nx=True,
+                          ex=interval):
+                removed = collect(r_conn)
+                if removed:
+                    print(f'cache: removed {removed} keys of old namespaces')
+        except Exception as e:
+            print(f'cache: namespace collector failed: {e}')
+        time.sleep(interval)
+
+
+def start_collector() -> None:
+    """Запуск фонового потока сборки старых пространств имен (один на
+    процесс). Между процессами сборка разделяется блокировкой в redis."""
+    global _collector
+    with _collector_lock:
+        if _collector is not None and _collector.is_alive():
+            return
+        _collector = threading.Thread(target=_collect_forever,
+                                      name='cache-namespace-collector',
+                                      daemon=True)
+        _collector.start()
+
+
+if __name__ == "__main__":
+    print(f'cache: removed {collect()} keys of old namespaces')
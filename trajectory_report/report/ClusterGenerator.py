@@ -1,7 +1,5 @@
 # (для формирования кластеров)
 import pandas as pd
-from skmob import TrajDataFrame
-from skmob.preprocessing import detection, clustering
 from trajectory_report.config import STAY_LOCATIONS_CONFIG, CLUSTERS_CONFIG
 
 
@@ -9,6 +7,11 @@ def prepare_clusters(coordinates: pd.DataFrame) -> pd.DataFrame:
     """
     Формирование остановок из DataFrame с координатами.
     """
+    # skmob загружает sklearn, scipy, geopandas и folium (несколько
+    # секунд), поэтому импортируется только при формировании кластеров
+    from skmob import TrajDataFrame
+    from skmob.preprocessing import detection, clustering
+
 
     tdf = TrajDataFrame(coordinates,
                         latitude='latitude',
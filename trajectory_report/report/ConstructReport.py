@@ -1,21 +1,102 @@
 # (основной запрос отчетов)
 import pandas as pd
 from trajectory_report.report import construct_select as cs
-from trajectory_report.database import DB_ENGINE, REDIS_CONN
+from trajectory_report import database
 import datetime as dt
 from trajectory_report.report.ClusterGenerator import prepare_clusters
-from typing import Optional, List, Union, Any
+from trajectory_report.report.StopDetector import IncrementalStopDetector
+from trajectory_report.report.JournalIndex import JournalIndex
+from trajectory_report.report.CacheNamespace import (
+    key as cache_key, touch as touch_namespace)
+from trajectory_report.report.SharedStore import attach as attach_store
+from trajectory_report.profiling import span
+from typing import (Optional, List, Union, Any, Iterable, Dict, Callable,
+                    Protocol, runtime_checkable)
 from trajectory_report.exceptions import ReportException
 from dateutil.relativedelta import relativedelta
-from sqlalchemy import select
-from trajectory_report.models import Statements, Division
-import redis
+from sqlalchemy import select, Select, func
+from trajectory_report.models import Statements, Division, Clusters
+from trajectory_report.config import (CACHE_CONFIG, DATABASE_CONFIG,
+                                      REPORT_BASE)
+from concurrent.futures import ThreadPoolExecutor, Future
 import pickle
 import bz2
 import json
+import time
+
+
+# Ключи ниже (как и ключи таблиц) хранятся в пространстве имен
+# CacheNamespace: cache_key('statements') -> 'tr:<отпечаток>:statements'.
+# Кластеры за прошедшие дни хранятся в redis в хэше по дням
+# (поле - дата в ISO формате, значение - сжатый DataFrame за день).
+# Новый день добавляется gather/clusters.main (append_clusters), дни
+# старше начала прошлого месяца удаляются.
+CLUSTERS_KEY = 'clusters:days'
+CLUSTERS_COLUMNS = [i.name for i in
+                    cs.clusters(dt.date.today()).selected_columns]
+# Версия данных в кэше (см. cache_version, invalidate)
+CACHE_VERSION_KEY = 'cache:version'
+# Время последнего изменения таблиц через invalidate: таблицы общего
+# хранилища (SharedStore), изменившиеся после его выгрузки, читаются из redis
+INVALIDATED_KEY = 'cache:invalidated'
+# Ключи кэша, строки которых можно обновить по name_ids, не загружая
+# таблицу целиком (запросы construct_select принимают name_ids)
+ROW_PATCHABLE_KEYS = ('journal', 'serves')
+
+# Таблицы, которые может вернуть getter. Каждый класс отчета объявляет,
+# какие из них ему нужны (REQUIRED_TABLES), остальные не запрашиваются.
+REPORT_TABLES = frozenset({'stmts', 'journal', 'schedules', 'serves',
+                           'clusters', 'comment', 'frequency'})
+
+
+def resolve_tables(tables: Optional[Iterable[str]] = None) -> frozenset:
+    """Проверка набора таблиц и добавление зависимостей.
+    stmts нужны всегда (из них берутся name_ids), а для clusters нужен
+    journal, чтобы определить subscriberID. None - все таблицы."""
+    if tables is None:
+        return REPORT_TABLES
+    tables = frozenset(tables)
+    unknown = tables - REPORT_TABLES
+    if unknown:
+        raise ReportException(f'Неизвестные таблицы: {sorted(unknown)}')
+    tables |= {'stmts'}
+    if 'clusters' in tables:
+        tables |= {'journal'}
+    return tables
+
+
+@runtime_checkable
+class ReportDataSource(Protocol):
+    """
+    Источник таблиц для отчета. Его реализуют CachedReportDataGetter,
+    DatabaseReportDataGetter, HybridReportDataGetter и
+    ParquetReportDataGetter (снимок в parquet, ParquetSnapshot.py).
+    get_data возвращает словарь {'_stmts': DataFrame, ...} с таблицами
+    из tables (см. resolve_tables) и бросает ReportException, если
+    заявленных выходов нет.
+    """
+    def get_data(self,
+                 date_from: Union[dt.date, str],
+                 date_to: Union[dt.date, str],
+                 division: Optional[Union[int, str]] = None,
+                 name_ids: Optional[List[int]] = None,
+                 object_ids: Optional[List[int]] = None,
+                 tables: Optional[Iterable[str]] = None
+                 ) -> dict:
+        ...
 
 
 class CachedReportDataGetter:
+    # Ключи redis, которые нужно прочитать для каждой таблицы отчета
+    TABLE_KEYS = {
+        'stmts': ['objects', 'employees'],
+        'journal': ['journal'],
+        'schedules': ['schedules'],
+        'serves': ['serves'],
+        'clusters': [],
+        'comment': ['comment'],
+        'frequency': ['frequency']
+    }
     CACHED_SELECTS = {
         'statements': cs.statements_only,
         'employees': cs.employees,
@@ -25,14 +106,21 @@ class CachedReportDataGetter:
         'serves': cs.serves,
         'clusters': cs.clusters,
         'divisions': cs.divisions,
-        'current_locations': cs.current_locations,
         'comment': cs.comment,
         'frequency': cs.frequency
     }
 
     def __init__(self):
         self.__current_db_connection = None
-        self._r_conn = REDIS_CONN
+        self._r_conn = database.REDIS_CONN
+        # Таблицы, полученные из redis одним запросом (см. __prefetch)
+        self.__prefetched: dict = dict()
+        # Общее для процессов хранилище таблиц (если включено) и таблицы,
+        # которые читаются из него, а не из redis
+        self.__store = attach_store()
+        # Поколение хранилища текущего get_data (SharedStore.Generation)
+        self.__generation = None
+        self.__store_keys: set = set()
 
         # statements expire date
         one_month = relativedelta(months=1, day=1, hour=0, minute=0, second=0)
@@ -42,7 +130,9 @@ class CachedReportDataGetter:
         self.__eight_hours: int = int(
             (dt.datetime.now()+dt.timedelta(hours=8)).timestamp()
         )
-        self.__prev_month: dt.date = dt.date.today() - one_month
+        # Начало окна кэша. Именно date: с datetime (relativedelta с hour)
+        # сравнение с датой в SQLite отбрасывает первый день окна
+        self.__prev_month: dt.date = cache_window_start()
         self.__current_month = ((dt.date.today() + one_month)
                                 - dt.timedelta(days=1))
         self.__current_day = int((dt.datetime.now()+one_day).timestamp())
@@ -52,9 +142,7 @@ class CachedReportDataGetter:
             'objects': self.__eight_hours,
             'journal': self.__current_day,
             'serves': self.__eight_hours,
-            'clusters': self.__current_day,
             'divisions': self.__eight_hours,
-            'current_locations': dt.datetime.now()+dt.timedelta(seconds=200),
             'statements': self.__next_month_midnight,
             'comment': self.__current_day,
             'frequency': self.__current_day
@@ -63,7 +151,7 @@ class CachedReportDataGetter:
     @property
     def _connection(self):
         if not self.__current_db_connection:
-            self._current_db_connection = DB_ENGINE.connect()
+            self._current_db_connection = database.DB_ENGINE.connect()
             return self._current_db_connection
         if not self.__current_db_connection.connection.connection.is_connected():
             self.__current_db_connection.connection.connection.reconnect()
@@ -79,69 +167,167 @@ class CachedReportDataGetter:
                  date_to: Union[dt.date, str],
                  division: Optional[Union[int, str]] = None,
                  name_ids: Optional[List[int]] = None,
-                 object_ids: Optional[List[int]] = None
+                 object_ids: Optional[List[int]] = None,
+                 tables: Optional[Iterable[str]] = None
                  ) -> dict:
+        """tables - набор необходимых таблиц (см. REPORT_TABLES),
+        по умолчанию запрашиваются все."""
         self._date_from = dt.date.fromisoformat(str(date_from))
         self._date_to = dt.date.fromisoformat(str(date_to))
+        tables = resolve_tables(tables)
 
         includes_current_date: bool = dt.date.today() <= self._date_to
 
+        # Ссылка на поколение хранилища читается один раз на отчет
+        self.__generation = self.__store.snapshot() if self.__store \
+            else None
+        self.__store_keys = set()
+        store_keys = self.__generation.available() if self.__generation \
+            else set()
+        keys = [key for table in sorted(tables)
+                for key in self.TABLE_KEYS[table] if key not in store_keys]
+        clusters_days = self.__clusters_days() if 'clusters' in tables \
+            else []
+        if 'clusters' in store_keys:
+            clusters_days = [i for i in clusters_days
+                             if i > self.__generation.clusters_to]
+        self.__prefetch(keys, clusters_days, bool(store_keys))
+        if store_keys:
+            # Таблицы, измененные после выгрузки хранилища, берутся из redis
+            self.__store_keys = self.__generation.available(
+                self.__prefetched.pop('invalidated'))
+
         divisions: dict = self.__get_divisions()
         if isinstance(division, str):
             division = divisions.get(division)
 
+        data = dict()
         stmts = self.__get_statements(division, name_ids, object_ids)
         name_ids = stmts.name_id.unique().tolist()
+        data['_stmts'] = stmts
 
-        journal = self.__get_journal(name_ids)
-        subs_ids = journal.subscriberID.unique().tolist()
-
-        schedules = self.__get_schedules(name_ids)
-
-        serves = self.__get_serves(name_ids)
-
-        clusters = self.__get_clusters(subs_ids, includes_current_date)
-
-        comment = self.__get_comment(name_ids)
-        frequency = self.__get_frequency(name_ids)
+        if 'journal' in tables:
+            journal = self.__get_journal(name_ids)
+            data['_journal'] = journal
+        if 'schedules' in tables:
+            data['_schedules'] = self.__get_schedules(name_ids)
+        if 'serves' in tables:
+            data['_serves'] = self.__get_serves(name_ids)
+        if 'clusters' in tables:
+            subs_ids = journal.subscriberID.unique().tolist()
+            data['_clusters'] = self.__get_clusters(subs_ids,
+                                                    includes_current_date)
+        if 'comment' in tables:
+            data['_comment'] = self.__get_comment(name_ids)
+        if 'frequency' in tables:
+            data['_frequency'] = self.__get_frequency(name_ids)
 
         self._connection_close()
-
-        data = dict()
-        data['_stmts'] = stmts
-        data['_journal'] = journal
-        data['_schedules'] = schedules
-        data['_serves'] = serves
-        data['_clusters'] = clusters
-        data['_comment'] = comment
-        data['_frequency'] = frequency
         return data
 
+    def __prefetch(self, keys: List[str],
+                   clusters_days: List[dt.date],
+                   invalidated: bool = False) -> None:
+        """Получение всех необходимых ключей из redis за один запрос
+        (pipeline) вместо отдельного GET на каждую таблицу.
+        Кластеры читаются по дням clusters_days из хэша CLUSTERS_KEY.
+        invalidated - получить время изменения таблиц (INVALIDATED_KEY).
+        Распаковка таблиц выполняется параллельно в пуле потоков.
+        Ключи, которых нет в redis, будут получены из БД позже,
+        в __get_cached_or_updated и __get_clusters."""
+        with span('fetch.redis.pipeline') as s:
+            pipe = self._r_conn.pipeline(transaction=False)
+            pipe.get(cache_key('divisions'))
+            pipe.hgetall(cache_key('statements'))
+            touch_namespace(pipe)
+            for key in keys:
+                pipe.get(cache_key(key))
+            if clusters_days:
+                pipe.hmget(cache_key(CLUSTERS_KEY),
+                           [i.isoformat() for i in clusters_days])
+            if invalidated:
+                pipe.hgetall(cache_key(INVALIDATED_KEY))
+            divisions, statements, _, *fetched = pipe.execute()
+            s.rows_out = len(statements or {})
+
+        if invalidated:
+            self.__prefetched['invalidated'] = {
+                k.decode(): v for k, v in fetched.pop().items()}
+        days_fetched = fetched.pop() if clusters_days else []
+        self.__prefetched['divisions'] = divisions
+        self.__prefetched['statements'] = statements
+        with span('fetch.redis.decode'), \
+                ThreadPoolExecutor(CACHE_CONFIG['DECODE_WORKERS']) as executor:
+            decoded = executor.map(self.__decode, fetched)
+            for key, obj in zip(keys, decoded):
+                if obj is not None:
+                    self.__prefetched[key] = obj
+            self.__prefetched['clusters'] = dict(zip(
+                clusters_days, executor.map(self.__decode, days_fetched)))
+
     def __get_divisions(self) -> dict:
-        fetched = self._r_conn.get('divisions')
+        fetched = self.__prefetched.pop('divisions', None) \
+            or self._r_conn.get(cache_key('divisions'))
         if not fetched:
             res = self._connection.execute(select(Division.id, Division.division)).all()
             fetched = json.dumps({i.division: i.id for i in res})
-            self._r_conn.set('divisions', fetched)
-            self._r_conn.expireat('divisions', self.__current_day)
+            self._r_conn.set(cache_key('divisions'), fetched)
+            self._r_conn.expireat(cache_key('divisions'),
+                                  self.__current_day)
         return json.loads(fetched)
 
+    def __clusters_days(self) -> List[dt.date]:
+        """Прошедшие дни периода отчета, кластеры за которые хранятся
+        в кэше (не раньше начала прошлого месяца)"""
+        date_from = max(self._date_from, cache_window_start())
+        date_to = min(self._date_to, dt.date.today() - dt.timedelta(days=1))
+        return [date_from + dt.timedelta(days=i)
+                for i in range((date_to - date_from).days + 1)]
+
     def __get_clusters(self, subs_ids, includes_current_date) -> pd.DataFrame:
-        clusters = self.__get_cached_or_updated('clusters')
+        frames = []
+        needed = self.__clusters_days()
+        if 'clusters' in self.__store_keys:
+            clusters_to = self.__generation.clusters_to
+            frames.append(self.__generation.read(
+                'clusters', subs_ids, self._date_from,
+                min(self._date_to, clusters_to)))
+            needed = [i for i in needed if i > clusters_to]
+        days = self.__prefetched.pop('clusters', dict())
+        not_fetched = [i for i in needed if i not in days]
+        if not_fetched:
+            fetched = self._r_conn.hmget(cache_key(CLUSTERS_KEY),
+                                         [i.isoformat() for i in not_fetched])
+            days.update(zip(not_fetched, map(self.__decode, fetched)))
+        days = {day: days[day] for day in needed}
+        missing = [day for day, df in days.items() if df is None]
+        if missing:
+            # Дни, которых нет в кэше, запрашиваются из БД одним запросом
+            # и добавляются в кэш
+            with span('fetch.cache_miss.clusters') as s:
+                loaded = pd.read_sql(cs.clusters(min(missing), max(missing)),
+                                     self._connection)
+                last_day = self._connection.execute(
+                    select(func.max(Clusters.date))).scalar()
+                loaded = split_by_day(loaded, missing)
+                store_clusters(loaded, self._r_conn, last_day)
+                days.update(loaded)
+                s.rows_out = sum(len(i) for i in loaded.values())
+        frames.extend(days.values())
+        clusters = pd.concat(frames) if frames \
+            else pd.DataFrame(columns=CLUSTERS_COLUMNS)
         clusters = clusters[clusters['subscriberID'].isin(subs_ids)]
         clusters = clusters[clusters['date'] >= self._date_from]
         clusters = clusters[clusters['date'] <= self._date_to]
 
         if includes_current_date:
-            curr_locs = self.__get_cached_or_updated('current_locations')
-            curr_locs = curr_locs[curr_locs['subscriberID'].isin(subs_ids)]
-            curr_locs['date'] = (curr_locs['locationDate']
-                                 .apply(lambda x: x.date()))
-            try:
-                clusters = pd.concat([clusters, prepare_clusters(curr_locs)])
-            except (TypeError, AttributeError):
-                print("Кластеры по текущим локациям не были сформированы. "
-                      "Возможно, из-за недостатка кол-ва локаций.")
+            # Кластеры за текущий день формируются инкрементально,
+            # обрабатываются только локации, появившиеся с прошлого запроса
+            with span('fetch.current_clusters') as s:
+                current_clusters = IncrementalStopDetector(self._r_conn) \
+                    .clusters(subs_ids)
+                s.rows_out = len(current_clusters)
+            clusters = pd.concat([clusters, current_clusters])
         return clusters
 
     def __get_serves(self, name_ids) -> pd.DataFrame:
@@ -152,14 +338,14 @@ class CachedReportDataGetter:
         return serves
 
     def __get_schedules(self, name_ids) -> pd.DataFrame:
-        schedules = self.__get_cached_or_updated('schedules')
+        schedules = self.__get_cached_or_updated('schedules', name_ids)
         schedules = schedules[schedules['name_id'].isin(name_ids)]
         return schedules
 
     def __get_journal(self, name_ids) -> pd.DataFrame:
-        journal = self.__get_cached_or_updated('journal')
+        journal = self.__get_cached_or_updated('journal', name_ids)
         journal = journal[journal['name_id'].isin(name_ids)]
-        journal.loc['period_end'] = journal['period_end'].fillna(
+        journal['period_end'] = journal['period_end'].fillna(
             dt.date.today())
         return journal
 
@@ -168,7 +354,8 @@ class CachedReportDataGetter:
                          name_ids: Optional[List[int]] = None,
                          object_ids: Optional[List[int]] = None
                          ) -> pd.DataFrame:
-        cached = self._r_conn.hgetall('statements')
+        cached = self.__prefetched.pop('statements', None) \
+            or self._r_conn.hgetall(cache_key('statements'))
         if not cached:
             db_res = self._connection.execute(select(
                 Statements.division,
@@ -184,8 +371,8 @@ class CachedReportDataGetter:
                 val = i.statement.encode()
                 res[key] = val
 
-            self._r_conn.hmset('statements', res)
-            self._r_conn.expireat('statements',
+            self._r_conn.hmset(cache_key('statements'), res)
+            self._r_conn.expireat(cache_key('statements'),
                                   self.expire_time_dict['statements'])
             cached = res
         cached = {
@@ -237,32 +424,205 @@ class CachedReportDataGetter:
         frequency = frequency[frequency['name_id'].isin(name_ids)]
         return frequency
 
-    def __get_cached_or_updated(self, key):
-        res = self.__get_from_redis(key)
+    def __get_cached_or_updated(self, key, name_ids=None):
+        """name_ids - отфильтровать таблицу при чтении из общего
+        хранилища (SharedStore.FILTER_COLUMNS)"""
+        if key in self.__store_keys:
+            return self.__generation.read(key, name_ids)
+        res = self.__prefetched.pop(key, None)
+        if res is None:
+            res = self.__get_from_redis(key)
         if res is None:
-            res = pd.read_sql(
-                CachedReportDataGetter.CACHED_SELECTS[key](
-                    date_from=self.__prev_month),
-                self._connection
-                )
-            self.__send_to_redis(key, res)
+            with span(f'fetch.cache_miss.{key}') as s:
+                res = pd.read_sql(
+                    CachedReportDataGetter.CACHED_SELECTS[key](
+                        date_from=self.__prev_month),
+                    self._connection
+                    )
+                self.__send_to_redis(key, res)
+                s.rows_out = len(res)
         return res
 
     def __get_from_redis(self, key: str) -> Any:
         """"Fetch from redis by key, decompress and unpickle"""
-        fetched = self._r_conn.get(key)
+        return self.__decode(self._r_conn.get(cache_key(key)))
+
+    @staticmethod
+    def __decode(fetched: Optional[bytes]) -> Any:
+        """Decompress and unpickle fetched value"""
         if not fetched:
             return None
         return pickle.loads(bz2.decompress(fetched))
 
     def __send_to_redis(self, key: str, obj: Any) -> bool:
         """Compress, pickle and set as a key"""
-        self._r_conn.set(key, bz2.compress(pickle.dumps(obj)))
-        self._r_conn.expireat(key, self.expire_time_dict.get(key))
+        self._r_conn.set(cache_key(key), bz2.compress(pickle.dumps(obj)))
+        self._r_conn.expireat(cache_key(key), self.expire_time_dict.get(key))
         return True
 
 
+def cache_window_start() -> dt.date:
+    """Первый день, данные за который хранятся в кэше (statements, serves,
+    clusters): начало прошлого месяца"""
+    return dt.date.today() - relativedelta(months=1, day=1)
+
+
+def split_by_day(clusters: pd.DataFrame,
+                 days: Iterable[dt.date]) -> Dict[dt.date, pd.DataFrame]:
+    """Кластеры по дням days. Для дней без кластеров - пустой DataFrame
+    (см. store_clusters)."""
+    groups = dict(tuple(clusters.groupby('date')))
+    return {day: groups.get(day, clusters.iloc[:0]) for day in days}
+
+
+def store_clusters(days: Dict[dt.date, pd.DataFrame],
+                   r_conn=None,
+                   last_day: Optional[Union[dt.date, str]] = None) -> None:
+    """
+    Сохраняет кластеры по дням в хэш CLUSTERS_KEY (поле - дата) и
+    удаляет дни, вышедшие за окно кэша (cache_window_start).
+    Пустой день сохраняется (как уже загруженный), только если он раньше
+    last_day - последнего дня с кластерами в БД (по умолчанию - последний
+    непустой день из days). Кластеры за более поздние дни (например, за
+    вчера до запуска gather/clusters) ещё не сформированы: такие дни
+    удаляются из хэша и запрашиваются из БД, пока за них нет кластеров.
+    """
+    r_conn = r_conn or database.REDIS_CONN
+    window_start = cache_window_start()
+    known = [day for day, df in days.items() if len(df)]
+    if last_day:
+        known.append(dt.date.fromisoformat(str(last_day)))
+    last_day = max(known, default=None)
+    mapping, unsettled = dict(), []
+    for day, df in days.items():
+        if day < window_start:
+            continue
+        if len(df) or (last_day and day < last_day):
+            mapping[day.isoformat()] = bz2.compress(pickle.dumps(df))
+        else:
+            unsettled.append(day.isoformat())
+    pipe = r_conn.pipeline(transaction=False)
+    if mapping:
+        pipe.hset(cache_key(CLUSTERS_KEY), mapping=mapping)
+    if unsettled:
+        pipe.hdel(cache_key(CLUSTERS_KEY), *unsettled)
+    pipe.hkeys(cache_key(CLUSTERS_KEY))
+    *_, stored = pipe.execute()
+    expired = [i for i in stored
+               if dt.date.fromisoformat(i.decode()) < window_start]
+    pipe = r_conn.pipeline(transaction=False)
+    if expired:
+        pipe.hdel(cache_key(CLUSTERS_KEY), *expired)
+    pipe.expire(cache_key(CLUSTERS_KEY),
+                dt.timedelta(days=CACHE_CONFIG['CLUSTERS_EXPIRE_DAYS']))
+    pipe.execute()
+
+
+def append_clusters(date: dt.date, clusters: pd.DataFrame) -> None:
+    """
+    Добавляет в кэш кластеры за день date, сформированные
+    gather/clusters.main (после записи в БД), вместо перезагрузки всех
+    кластеров из БД.
+    Запись не зависит от последней проверки redis_available: она могла
+    устареть. Если записать не удалось, дня нет в кэше (пустые дни после
+    последнего дня с кластерами не кэшируются, см. store_clusters), и он
+    будет загружен из БД при первом запросе.
+    """
+    import redis
+    # Координаты - как при чтении из БД (REAL), а не Decimal из координат
+    clusters = clusters.astype({'longitude': float, 'latitude': float})
+    try:
+        store_clusters(split_by_day(clusters, [date]))
+    except redis.RedisError as e:
+        print(f'clusters: {date} has not been added to the cache: {e}')
+
+
+def cache_version(r_conn=None) -> int:
+    """Версия данных в кэше. Увеличивается при каждом изменении кэша через
+    invalidate, по ней можно проверить, что результат, построенный из
+    кэша, ещё актуален."""
+    r_conn = r_conn or database.REDIS_CONN
+    return int(r_conn.get(cache_key(CACHE_VERSION_KEY)) or 0)
+
+
+def invalidate(key: str,
+               name_ids: Optional[List[int]] = None,
+               dates: Optional[List[dt.date]] = None) -> None:
+    """
+    Обновление кэша после изменения таблицы в БД.
+    key - ключ кэша (см. CachedReportDataGetter.CACHED_SELECTS):
+    - ROW_PATCHABLE_KEYS (journal, serves) с name_ids: строки этих
+      сотрудников заново запрашиваются из БД и заменяются в кэше,
+      остальные строки остаются;
+    - clusters с dates: из кэша удаляются только эти дни;
+    - в остальных случаях ключ удаляется и будет загружен из БД при
+      следующем запросе отчета.
+    """
+    if not redis_available():
+        return
+    if name_ids is not None and not len(name_ids):
+        return
+    r_conn = database.REDIS_CONN
+    if key == 'clusters':
+        if dates:
+            r_conn.hdel(cache_key(CLUSTERS_KEY), *[str(i) for i in dates])
+        else:
+            r_conn.delete(cache_key(CLUSTERS_KEY))
+    elif key in ROW_PATCHABLE_KEYS and name_ids:
+        _patch_rows(r_conn, key, list(name_ids))
+    else:
+        r_conn.delete(cache_key(key))
+    r_conn.hset(cache_key(INVALIDATED_KEY), key, time.time())
+    r_conn.incr(cache_key(CACHE_VERSION_KEY))
+
+
+def _patch_rows(r_conn, key: str, name_ids: List[int]) -> None:
+    """Замена строк сотрудников name_ids в закэшированной таблице key
+    на актуальные из БД. Срок хранения ключа не меняется."""
+    select_ = CachedReportDataGetter.CACHED_SELECTS[key]
+    with database.DB_ENGINE.connect() as conn:
+        fresh = pd.read_sql(select_(date_from=cache_window_start(),
+                                    name_ids=name_ids), conn)
+    redis_key = cache_key(key)
+
+    def patch(pipe):
+        fetched = pipe.get(redis_key)
+        if not fetched:
+            return
+        cached = pickle.loads(bz2.decompress(fetched))
+        cached = pd.concat([cached[~cached['name_id'].isin(name_ids)],
+                            fresh], ignore_index=True)
+        pipe.multi()
+        pipe.set(redis_key, bz2.compress(pickle.dumps(cached)), keepttl=True)
+
+    r_conn.transaction(patch, redis_key)
+
+
+def _name_ids(results: dict) -> List[int]:
+    return results['stmts'].name_id.unique().tolist()
+
+
+def _subscriber_ids(results: dict) -> List[int]:
+    return results['journal'].subscriberID.unique().tolist()
+
+
 class DatabaseReportDataGetter:
+    # Граф зависимостей запросов: таблица -> таблицы, из результатов которых
+    # формируется ее select (name_ids берутся из stmts, subscriberID -
+    # из journal). Запросы, не зависящие друг от друга, выполняются
+    # параллельно, каждый на своем соединении из пула DB_ENGINE.
+    # Порядок ключей - топологический, в нем запросы отправляются в пул.
+    QUERY_DEPENDENCIES = {
+        'stmts': (),
+        'journal': ('stmts',),
+        'schedules': ('stmts',),
+        'serves': ('stmts',),
+        'comment': ('stmts',),
+        'frequency': ('stmts',),
+        'clusters': ('journal',),
+        'current_locations': ('journal',),
+        'attends': ()
+    }
 
     @staticmethod
     def get_data(
@@ -270,64 +630,129 @@ class DatabaseReportDataGetter:
             date_to: Union[dt.date, str],
             division: Optional[Union[int, str]] = None,
             name_ids: Optional[List[int]] = None,
-            object_ids: Optional[List[int]] = None
+            object_ids: Optional[List[int]] = None,
+            tables: Optional[Iterable[str]] = None
     ) -> dict:
-        """Формирует select и запрашивает их из БД"""
+        """Формирует select и запрашивает их из БД.
+        tables - набор необходимых таблиц (см. REPORT_TABLES),
+        по умолчанию запрашиваются все.
+        Если REPORT_BASE['SQL_DISTANCE'], то вместо кластеров за период
+        возвращаются посещения (_attends), отобранные по расстоянию в БД,
+        а _clusters содержит только кластеры за текущий день."""
         date_from = dt.date.fromisoformat(str(date_from))
         date_to = dt.date.fromisoformat(str(date_to))
+        tables = resolve_tables(tables)
         includes_current_date: bool = dt.date.today() <= date_to
+        sql_distance = 'clusters' in tables and REPORT_BASE['SQL_DISTANCE']
+        clusters_from = max(date_from, dt.date.today()) if sql_distance \
+            else date_from
 
-        """ПОЛУЧЕНИЕ НЕОБХОДИМЫХ ТАБЛИЦ ИЗ БД"""
-        with DB_ENGINE.connect() as conn:
-            stmts = pd.read_sql(cs.statements(
+        def check_stmts(stmts: pd.DataFrame) -> pd.DataFrame:
+            # Без заявленных выходов зависимые запросы выполнять нельзя:
+            # с пустым списком name_ids они вернут таблицы целиком.
+            if not len(stmts):
+                raise ReportException(f'Не найдено заявленных выходов в '
+                                      f'период с {date_from} до {date_to}')
+            return stmts
+
+        def fill_period_end(journal: pd.DataFrame) -> pd.DataFrame:
+            journal['period_end'] = journal['period_end'].fillna(
+                dt.date.today())
+            return journal
+
+        def set_date(current_locations: pd.DataFrame) -> pd.DataFrame:
+            current_locations['date'] = current_locations['locationDate'] \
+                .apply(lambda x: x.date())
+            return current_locations
+
+        # select по каждой таблице, строится из результатов зависимостей
+        selects = {
+            'stmts': lambda res: cs.statements(
                 date_from=date_from,
                 date_to=date_to,
                 division=division,
                 name_ids=name_ids,
                 object_ids=object_ids
-            ), conn)
-            if not len(stmts):
-                raise ReportException(f'Не найдено заявленных выходов в период '
-                                      f'с {date_from} до {date_to}')
-            name_ids = stmts.name_id.unique().tolist()
-
-            journal = pd.read_sql(cs.journal(name_ids), conn)
-            journal['period_end'] = journal['period_end'].fillna(
-                dt.date.today())
-            subs_ids = journal.subscriberID.unique().tolist()
+            ),
+            'journal': lambda res: cs.journal(_name_ids(res)),
+            'schedules': lambda res: cs.employee_schedules(_name_ids(res)),
+            'serves': lambda res: cs.serves(date_from, date_to,
+                                            _name_ids(res)),
+            'comment': lambda res: cs.comment(division, _name_ids(res)),
+            'frequency': lambda res: cs.frequency(division, _name_ids(res)),
+            'clusters': lambda res: cs.clusters(clusters_from, date_to,
+                                                _subscriber_ids(res)),
+            'current_locations': lambda res: cs.current_locations(
+                _subscriber_ids(res)),
+            'attends': lambda res: cs.attends_in_radius(
+                date_from, date_to, REPORT_BASE['RADIUS'],
+                division, name_ids, object_ids)
+        }
+        post_processing = {
+            'stmts': check_stmts,
+            'journal': fill_period_end,
+            'current_locations': set_date
+        }
 
-            schedules = pd.read_sql(cs.employee_schedules(name_ids), conn)
-            serves = pd.read_sql(cs.serves(date_from, date_to, name_ids), conn)
-            clusters = pd.read_sql(cs.clusters(date_from, date_to, subs_ids),
-                                   conn)
-            if includes_current_date:
-                current_locations = pd.read_sql(
-                    cs.current_locations(subs_ids),
-                    conn
-                )
-                current_locations['date'] = current_locations['locationDate'] \
-                    .apply(lambda x: x.date())
-            comment = pd.read_sql(cs.comment(division, name_ids), conn)
-            frequency = pd.read_sql(cs.frequency(division, name_ids), conn)
+        """ПОЛУЧЕНИЕ НЕОБХОДИМЫХ ТАБЛИЦ ИЗ БД"""
+        queries = set(tables)
+        if 'clusters' in tables and includes_current_date:
+            queries.add('current_locations')
+        if sql_distance:
+            queries.add('attends')
+        results = DatabaseReportDataGetter._run_queries(
+            {k: v for k, v in selects.items() if k in queries},
+            post_processing
+        )
 
-        if includes_current_date:
+        clusters = results.pop('clusters', None)
+        current_locations = results.pop('current_locations', None)
+        if current_locations is not None:
             try:
-                clusters_from_locations = prepare_clusters(current_locations)
+                with span('fetch.prepare_clusters',
+                          rows_in=len(current_locations)):
+                    clusters_from_locations = prepare_clusters(
+                        current_locations)
                 clusters = pd.concat([clusters,
                                       clusters_from_locations])
             except (TypeError, AttributeError):
                 print("Кластеры по текущим локациям не были сформированы. "
                       "Возможно, из-за недостатка кол-ва локаций.")
-        data = dict()
-        data['_stmts'] = stmts
-        data['_journal'] = journal
-        data['_schedules'] = schedules
-        data['_serves'] = serves
-        data['_clusters'] = clusters
-        data['_comment'] = comment
-        data['_frequency'] = frequency
+
+        data = {f'_{table}': df for table, df in results.items()}
+        if clusters is not None:
+            data['_clusters'] = clusters
         return data
 
+    @staticmethod
+    def _run_queries(selects: Dict[str, Callable[[dict], Select]],
+                     post_processing: Dict[str, Callable]
+                     ) -> Dict[str, pd.DataFrame]:
+        """Выполнение запросов в пуле потоков согласно QUERY_DEPENDENCIES.
+        Каждый запрос ждет только свои зависимости, поэтому общее время
+        ограничено самой длинной цепочкой запросов, а не их суммой.
+        Запросы отправляются в пул в топологическом порядке, так что
+        зависимость всегда запущена раньше, чем ее ожидают."""
+        def read(table: str, dependencies: Dict[str, Future]):
+            res = {k: future.result() for k, future in dependencies.items()}
+            with span(f'fetch.db.{table}') as s:
+                with database.DB_ENGINE.connect() as conn:
+                    df = pd.read_sql(selects[table](res), conn)
+                s.rows_out = len(df)
+            return post_processing.get(table, lambda x: x)(df)
+
+        futures: Dict[str, Future] = dict()
+        with ThreadPoolExecutor(DATABASE_CONFIG['QUERY_WORKERS']) as executor:
+            for table, deps in \
+                    DatabaseReportDataGetter.QUERY_DEPENDENCIES.items():
+                if table not in selects:
+                    continue
+                futures[table] = executor.submit(
+                    read, table, {k: futures[k] for k in deps})
+            # result() пробрасывает исключение из потока (ReportException)
+            return {table: future.result()
+                    for table, future in futures.items()}
+
 
 class OneEmployeeReportDataGetter:
 
@@ -335,56 +760,225 @@ class OneEmployeeReportDataGetter:
                  name_id: int,
                  date: Union[dt.date, str],
                  division: Union[int, str],
+                 inputs: Optional[tuple] = None
                  ) -> None:
         date = dt.date.fromisoformat(str(date))
         (self._stmts,
          self.clusters,
-         self._locations) = self._query_data(name_id, division, date)
+         self._locations) = self._query_data(name_id, division, date, inputs)
 
     @staticmethod
-    def _query_data(name_id: int, division: Union[int, str], date: dt.date):
-        with DB_ENGINE.connect() as conn:
-            stmts = pd.read_sql(cs.statements_one_emp(date, name_id, division),
-                                conn)
-            journal = pd.read_sql(cs.journal_one_emp(name_id), conn)
-            journal['period_end'] = journal['period_end'].fillna(
-                dt.date.today())
-            journal = journal \
-                .loc[(journal['period_init'] <= date)
-                     & (date <= journal['period_end'])]
-            try:
-                subscriber_id = int(journal.subscriberID.iloc[0])
-            except IndexError:
-                raise ReportException(
-                    f"За сотрудником не закреплено ни одного "
-                    f"устройства в этот день ({date})")
-
+    def _query_employee(conn, name_id: int, division: Union[int, str],
+                        date: dt.date) -> tuple:
+        """Заявленные выходы и журнал сотрудника, subscriberID его
+        устройства на дату"""
+        stmts = pd.read_sql(cs.statements_one_emp(date, name_id, division),
+                            conn)
+        journal = pd.read_sql(cs.journal_one_emp(name_id), conn)
+        subscriber_id = JournalIndex(journal).subscriber_id(name_id, date)
+        if subscriber_id is None:
+            raise ReportException(
+                f"За сотрудником не закреплено ни одного "
+                f"устройства в этот день ({date})")
+        return stmts, journal, subscriber_id
+
+    @classmethod
+    def _query_inputs(cls, name_id: int, division: Union[int, str],
+                      date: dt.date) -> tuple:
+        """Исходные таблицы отчета из БД: заявленные выходы, журнал
+        сотрудника и локации его устройства за день"""
+        date = dt.date.fromisoformat(str(date))
+        with database.DB_ENGINE.connect() as conn:
+            stmts, journal, subscriber_id = cls._query_employee(
+                conn, name_id, division, date)
             locations = pd.read_sql(cs.locations_one_emp(date, subscriber_id),
                                     conn)
-            valid_locations = locations[pd.notna(locations['locationDate'])]
-            if not len(locations) or not len(valid_locations):
-                raise ReportException(f"По данному сотруднику не обнаружено "
-                                      f"локаций за {date}.")
-            clusters = prepare_clusters(valid_locations)
-            return stmts, clusters, locations
+            return stmts, journal, locations
+
+    @classmethod
+    def _query_data(cls, name_id: int, division: Union[int, str],
+                    date: dt.date, inputs: Optional[tuple] = None):
+        """inputs - уже запрошенный результат _query_inputs"""
+        stmts, _, locations = inputs or cls._query_inputs(name_id, division,
+                                                          date)
+        valid_locations = locations[pd.notna(locations['locationDate'])]
+        if not len(locations) or not len(valid_locations):
+            raise ReportException(f"По данному сотруднику не обнаружено "
+                                  f"локаций за {date}.")
+        clusters = prepare_clusters(valid_locations)
+        return stmts, clusters, locations
+
+
+# Последний результат проверки доступности redis и время проверки
+_redis_health = {'available': False, 'checked_at': None}
+
+
+def redis_available() -> bool:
+    """Доступность redis. Результат PING запоминается на
+    CACHE_CONFIG['HEALTH_CHECK_SECONDS'], чтобы не проверять соединение
+    при каждом запросе отчета."""
+    now = time.monotonic()
+    checked_at = _redis_health['checked_at']
+    if checked_at is not None and \
+            now - checked_at < CACHE_CONFIG['HEALTH_CHECK_SECONDS']:
+        return _redis_health['available']
+    r_conn = database.REDIS_CONN
+    # redis загружается вместе с REDIS_CONN (см. database.py)
+    import redis
+    try:
+        available = r_conn.ping()
+    except redis.ConnectionError:
+        available = False
+    _redis_health['available'] = available
+    _redis_health['checked_at'] = now
+    return available
+
+
+class HybridReportDataGetter:
+    """
+    Период, который начинается раньше окна кэша, но захватывает его.
+    Часть периода внутри окна берется из CachedReportDataGetter, из БД
+    запрашивается только более ранняя часть. Затем таблицы объединяются:
+    таблицы с датами (stmts, serves, clusters) не пересекаются и просто
+    склеиваются, остальные (journal, schedules, comment, frequency)
+    отфильтрованы по name_ids своей части, поэтому дубликаты удаляются.
+    """
+    UNDATED_TABLES = ('_journal', '_schedules', '_comment', '_frequency')
+
+    def __init__(self, cache_date_from: dt.date):
+        self._cache_date_from = cache_date_from
+
+    def get_data(self,
+                 date_from: Union[dt.date, str],
+                 date_to: Union[dt.date, str],
+                 *args, **kwargs) -> dict:
+        date_from = dt.date.fromisoformat(str(date_from))
+        date_to = dt.date.fromisoformat(str(date_to))
+        parts = []
+        try:
+            parts.append(CachedReportDataGetter().get_data(
+                self._cache_date_from, date_to, *args, **kwargs))
+        except ReportException:
+            pass
+        try:
+            parts.append(DatabaseReportDataGetter().get_data(
+                date_from, self._cache_date_from - dt.timedelta(days=1),
+                *args, **kwargs))
+        except ReportException:
+            pass
+        if not parts:
+            raise ReportException(f'Не найдено заявленных выходов в период '
+                                  f'с {date_from} до {date_to}')
+
+        data = dict()
+        for table in {table for part in parts for table in part}:
+            df = self._stitch([part[table] for part in parts
+                               if table in part])
+            if table in self.UNDATED_TABLES:
+                df = df.drop_duplicates(ignore_index=True)
+            data[table] = df
+        return data
 
+    @staticmethod
+    def _stitch(frames: List[pd.DataFrame]) -> pd.DataFrame:
+        """Объединение частей таблицы. Столбцы и их типы берутся из первой
+        части (кэш), чтобы итоговая таблица не зависела от того, откуда
+        пришли строки (например, int из кэша и float из БД с пропусками)."""
+        first = frames[0]
+        df = pd.concat(frames, ignore_index=True)
+        df = df[[c for c in first.columns] +
+                [c for c in df.columns if c not in first.columns]]
+        for column, dtype in first.dtypes.items():
+            if df[column].dtype != dtype:
+                try:
+                    df[column] = df[column].astype(dtype)
+                except (TypeError, ValueError):
+                    pass
+        return df
+
+
+class PreloadedReportDataGetter:
+    """
+    Данные для нескольких отчетов из таблиц, полученных один раз
+    (например, за все подразделения сразу, см. BatchReport.py).
+    get_data отбирает из них строки нужного подразделения, сотрудников,
+    объектов и периода так же, как это делают остальные getter.
+    Возвращаются копии, поэтому отчеты могут изменять свои таблицы и
+    строиться параллельно.
+    divisions - {название подразделения: id}, если division передается
+    строкой.
+    """
+    DATED_TABLES = ('_serves', '_clusters', '_attends')
+
+    def __init__(self, data: dict, divisions: Optional[dict] = None):
+        self._data = data
+        self._divisions = divisions or dict()
 
-def report_data_factory(date_from: Union[dt.date, str], *args, use_cache=True,
+    def get_data(self,
+                 date_from: Union[dt.date, str],
+                 date_to: Union[dt.date, str],
+                 division: Optional[Union[int, str]] = None,
+                 name_ids: Optional[List[int]] = None,
+                 object_ids: Optional[List[int]] = None,
+                 tables: Optional[Iterable[str]] = None
+                 ) -> dict:
+        date_from = dt.date.fromisoformat(str(date_from))
+        date_to = dt.date.fromisoformat(str(date_to))
+        tables = resolve_tables(tables)
+        if isinstance(division, str):
+            division = self._divisions.get(division)
+
+        stmts = self._data['_stmts']
+        mask = (stmts['date'] >= date_from) & (stmts['date'] <= date_to)
+        if division:
+            mask &= stmts['division'] == division
+        if name_ids:
+            mask &= stmts['name_id'].isin(name_ids)
+        if object_ids:
+            mask &= stmts['object_id'].isin(object_ids)
+        stmts = stmts.loc[mask]
+        if not len(stmts):
+            raise ReportException(f'Не найдено заявленных выходов в период '
+                                  f'с {date_from} до {date_to}')
+        name_ids = stmts.name_id.unique()
+
+        data = {'_stmts': stmts}
+        # _clusters отбираются по subscriberID из уже отобранного _journal
+        for table in sorted(set(self._data) - {'_stmts'},
+                            key=lambda x: x == '_clusters'):
+            if table[1:] not in tables and table != '_attends':
+                continue
+            df = self._data[table]
+            if table == '_clusters':
+                subs_ids = data['_journal'].subscriberID.unique()
+                mask = df['subscriberID'].isin(subs_ids)
+            else:
+                mask = df['name_id'].isin(name_ids)
+            if table == '_attends' and object_ids:
+                mask &= df['object_id'].isin(object_ids)
+            if table in self.DATED_TABLES:
+                mask &= (df['date'] >= date_from) & (df['date'] <= date_to)
+            data[table] = df.loc[mask]
+        return data
+
+
+def report_data_factory(date_from: Union[dt.date, str],
+                        date_to: Union[dt.date, str],
+                        *args, use_cache=True,
                         **kwargs
                         ) -> dict:
-    try:
-        redis_available = REDIS_CONN.ping()
-    except redis.ConnectionError:
-        redis_available = False
-
     date_from = dt.date.fromisoformat(str(date_from))
+    date_to = dt.date.fromisoformat(str(date_to))
     cache_date_from = \
        ((dt.date.today().replace(day=1)) - dt.timedelta(days=1)).replace(day=1)
-    if date_from >= cache_date_from and redis_available and use_cache:
-        data = CachedReportDataGetter().get_data(date_from, *args, **kwargs)
+    if date_to < cache_date_from or not use_cache or not redis_available():
+        data = DatabaseReportDataGetter().get_data(date_from, date_to,
+                                                   *args, **kwargs)
+    elif date_from >= cache_date_from:
+        data = CachedReportDataGetter().get_data(date_from, date_to,
+                                                 *args, **kwargs)
     else:
-        data = DatabaseReportDataGetter().get_data(date_from, *args, **kwargs)
+        # Период начинается раньше окна кэша, но захватывает его
+        data = HybridReportDataGetter(cache_date_from).get_data(
+            date_from, date_to, *args, **kwargs)
     return data
-
-
-
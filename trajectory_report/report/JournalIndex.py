@@ -0,0 +1,96 @@
+# (определение subscriberID сотрудника на дату по журналу)
+import datetime as dt
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+
+class JournalIndex:
+    """
+    Индекс журнала для поиска subscriberID по паре (name_id, дата).
+    Периоды владения устройством сотрудника заранее разбиваются на
+    отрезки, внутри которых набор действующих периодов не меняется
+    (границы - period_init и следующий день после period_end). Каждому
+    отрезку назначается действующий период, начавшийся позже всех.
+    Поиск выполняется через pd.merge_asof: для даты берется последний
+    начавшийся отрезок и проверяется, что его период ещё не закончился.
+    В отличие от объединения statements со всем журналом сотрудника,
+    кол-во строк не растет от кол-ва смен устройств.
+    Если периоды одного сотрудника пересекаются, берется начавшийся позже,
+    а после его окончания - снова ещё действующий более ранний.
+    """
+
+    def __init__(self, journal: pd.DataFrame):
+        journal = journal.dropna(subset=['name_id', 'subscriberID',
+                                         'period_init'])
+        journal = journal[['name_id', 'subscriberID',
+                           'period_init', 'period_end']].copy()
+        journal['period_end'] = journal['period_end'].fillna(dt.date.today())
+        journal['period_init'] = pd.to_datetime(journal['period_init'])
+        journal['period_end'] = pd.to_datetime(journal['period_end'])
+        journal['name_id'] = journal['name_id'].astype(int)
+        self._periods = journal
+        # Отрезки строятся при первом attach (для одной даты subscriber_id
+        # обходится без них)
+        self._journal = None
+
+    @staticmethod
+    def _segments(journal: pd.DataFrame) -> pd.DataFrame:
+        """Отрезки (name_id, start) с действующим на них периодом
+        (subscriberID, period_end), отсортированные по start"""
+        starts = pd.concat([
+            journal[['name_id', 'period_init']]
+            .rename(columns={'period_init': 'start'}),
+            journal[['name_id']].assign(
+                start=journal['period_end'] + pd.Timedelta(days=1))
+        ]).drop_duplicates()
+        # Каждый отрезок с каждым периодом сотрудника (периодов у одного
+        # сотрудника немного), остаются действующие на начало отрезка
+        segments = pd.merge(starts, journal, on='name_id')
+        segments = segments[(segments['period_init'] <= segments['start'])
+                            & (segments['start'] <= segments['period_end'])]
+        segments = segments.sort_values('period_init') \
+            .drop_duplicates(['name_id', 'start'], keep='last')
+        return segments[['name_id', 'start', 'subscriberID',
+                         'period_end']].sort_values('start')
+
+    def attach(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Добавляет к df (нужны столбцы name_id и date) столбцы
+        subscriberID и j_exist. Если на дату за сотрудником не закреплено
+        устройство - j_exist False, subscriberID пустой.
+        Порядок и индекс строк df сохраняются."""
+        left = pd.DataFrame({
+            'name_id': df['name_id'].astype(int).to_numpy(),
+            'date': pd.to_datetime(df['date']).to_numpy(),
+            'position': np.arange(len(df))
+        }).sort_values('date')
+        if self._journal is None:
+            self._journal = self._segments(self._periods)
+        found = pd.merge_asof(left, self._journal,
+                              left_on='date', right_on='start',
+                              by='name_id', direction='backward') \
+            .sort_values('position')
+        j_exist = (found['date'] <= found['period_end']).to_numpy()
+
+        df = df.copy()
+        df['subscriberID'] = np.where(j_exist,
+                                      found['subscriberID'].to_numpy(),
+                                      np.nan)
+        df['j_exist'] = j_exist
+        return df
+
+    def subscriber_id(self, name_id: int,
+                      date: Union[dt.date, str]) -> Optional[int]:
+        """subscriberID сотрудника на дату, None - если его нет.
+        Из действующих на дату периодов берется начавшийся позже (как в
+        attach)."""
+        date = pd.Timestamp(str(date))
+        periods = self._periods
+        periods = periods[(periods['name_id'].to_numpy() == int(name_id))
+                          & (periods['period_init'].to_numpy() <= date)
+                          & (date <= periods['period_end'].to_numpy())]
+        if not len(periods):
+            return None
+        return int(periods['subscriberID']
+                   .iloc[periods['period_init'].to_numpy().argmax()])
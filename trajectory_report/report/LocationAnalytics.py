@@ -0,0 +1,136 @@
+# (анализ доступности телефонов всех сотрудников подразделения)
+# То же, что OneEmployeeReport.analytics, stats и recommended_for_checkout,
+# но для всех сотрудников за период: локации запрашиваются из БД одним
+# запросом на день (а не отдельный отчет на каждого сотрудника), периоды
+# доступности/недоступности считаются сразу для всех устройств.
+#
+#     stats = location_stats('2023-08-01', '2023-08-31', 'ПВТ1')
+#     stats[stats.recommended_for_checkout]
+import datetime as dt
+from typing import Iterator, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from trajectory_report import database
+from trajectory_report.config import STATS_CHECKOUT
+from trajectory_report.profiling import span
+from trajectory_report.report import construct_select as cs
+from trajectory_report.report.ConstructReport import report_data_factory
+from trajectory_report.report.JournalIndex import JournalIndex
+
+# Столбцы результата location_stats
+STATS_COLUMNS = ['name_id', 'name', 'subscriberID', 'date',
+                 'available_sum', 'available_count', 'available_mean',
+                 'unavailable_sum', 'unavailable_count', 'unavailable_mean',
+                 'recommended_for_checkout']
+
+
+def location_periods(locations: pd.DataFrame) -> pd.DataFrame:
+    """
+    Периоды доступности/недоступности телефона (как
+    OneEmployeeReport._location_analysis) для всех устройств и дней сразу.
+    locations - запросы локаций: subscriberID, requestDate, locationDate.
+    Новый период начинается, когда меняется доступность, устройство или
+    день (та же группировка через cumsum, что и для одного сотрудника).
+    Возвращает subscriberID, date, available, min, max, duration.
+    """
+    locs = locations.sort_values(['subscriberID', 'requestDate'])
+    subscriber = locs['subscriberID'].to_numpy()
+    request = pd.to_datetime(locs['requestDate']).to_numpy()
+    day = request.astype('datetime64[D]')
+    available = pd.notna(locs['locationDate']).to_numpy()
+
+    changing = np.ones(len(locs), dtype=bool)
+    changing[1:] = (available[1:] != available[:-1]) \
+        | (subscriber[1:] != subscriber[:-1]) | (day[1:] != day[:-1])
+    starts = np.flatnonzero(changing)
+    ends = np.append(starts[1:], len(locs))[:len(starts)] - 1
+
+    periods = pd.DataFrame({
+        'subscriberID': subscriber[starts],
+        'date': pd.to_datetime(day[starts]).date,
+        'available': available[starts],
+        'min': request[starts],
+        'max': request[ends],
+    })
+    periods['duration'] = periods['max'] - periods['min']
+    return periods
+
+
+def periods_stats(periods: pd.DataFrame) -> pd.DataFrame:
+    """
+    stats и recommended_for_checkout (см. OneEmployeeReport) по каждому
+    устройству и дню. Учитываются периоды ненулевой длительности, решение
+    принимается по правилам STATS_CHECKOUT:
+     1. Суммарная доступность меньше недоступности и кол-во периодов
+     доступности больше COUNT.
+     2. Средняя длительность доступности меньше MINUTES.
+    Если за день есть только одно состояние - проверка не нужна (False).
+    """
+    periods = periods[periods['duration'] > dt.timedelta(seconds=0)]
+    stats = periods.groupby(['subscriberID', 'date', 'available'])['duration'] \
+        .agg(['sum', 'count', 'mean']) \
+        .unstack('available')
+    stats = stats.reindex(columns=pd.MultiIndex.from_product(
+        [['sum', 'count', 'mean'], [True, False]]))
+    stats.columns = [f'{"available" if state else "unavailable"}_{agg}'
+                     for agg, state in stats.columns]
+    stats = stats.reset_index()
+    for column in ('available_count', 'unavailable_count'):
+        stats[column] = stats[column].fillna(0).astype(int)
+
+    both = (stats['available_count'] > 0) & (stats['unavailable_count'] > 0)
+    ratio = stats['available_sum'] / stats['unavailable_sum']
+    rare = (ratio < 1) & (stats['available_count'] > STATS_CHECKOUT['COUNT'])
+    short = stats['available_mean'] < dt.timedelta(
+        minutes=STATS_CHECKOUT['MINUTES'])
+    stats['recommended_for_checkout'] = (both & (rare | short)).to_numpy()
+    return stats
+
+
+def iter_location_stats(date_from: Union[dt.date, str],
+                        date_to: Union[dt.date, str],
+                        division: Optional[Union[int, str]] = None,
+                        name_ids: Optional[List[int]] = None,
+                        use_cache: bool = True) -> Iterator[pd.DataFrame]:
+    """
+    Анализ локаций сотрудников подразделения по дням: на каждый день
+    периода - один запрос локаций всех устройств и таблица STATS_COLUMNS.
+    Берутся дни с заявленными выходами (кроме Больн./Отпуск/Увол.),
+    subscriberID на дату определяется по журналу.
+    Сотрудники-дни без локаций в результат не попадают.
+    """
+    data = report_data_factory(date_from, date_to, division, name_ids,
+                               use_cache=use_cache, tables={'journal'})
+    stmts = data['_stmts']
+    days = stmts.loc[stmts.object_id != 1, ['name_id', 'name', 'date']] \
+        .drop_duplicates(['name_id', 'date'])
+    days = JournalIndex(data['_journal']).attach(days)
+    days = days[days['j_exist']]
+    days['subscriberID'] = days['subscriberID'].astype(np.int64)
+
+    for date, employees in days.groupby('date', sort=True):
+        with span('location_stats.day', rows_in=len(employees)) as s, \
+                database.DB_ENGINE.connect() as conn:
+            locations = pd.read_sql(cs.locations(
+                date, subscriber_ids=employees.subscriberID.tolist()), conn)
+            stats = periods_stats(location_periods(locations))
+            stats = pd.merge(employees[['name_id', 'name', 'subscriberID',
+                                        'date']],
+                             stats, on=['subscriberID', 'date'])
+            s.rows_out = len(stats)
+        yield stats[STATS_COLUMNS]
+
+
+def location_stats(date_from: Union[dt.date, str],
+                   date_to: Union[dt.date, str],
+                   division: Optional[Union[int, str]] = None,
+                   name_ids: Optional[List[int]] = None,
+                   use_cache: bool = True) -> pd.DataFrame:
+    """Анализ локаций (iter_location_stats) за весь период одной таблицей"""
+    frames = list(iter_location_stats(date_from, date_to, division,
+                                      name_ids, use_cache))
+    if not frames:
+        return pd.DataFrame(columns=STATS_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,209 @@
+# (снимок таблиц отчета в parquet и получение данных для отчета из него)
+# Снимок позволяет формировать отчеты за прошлые периоды без доступа к
+# БД и redis:
+#
+#     export_snapshot('/data/snapshot', '2023-01-01', '2023-09-30')
+#     source = ParquetReportDataGetter('/data/snapshot')
+#     Report('2023-03-01', '2023-05-31', 'ПВТ1', source=source)
+#
+# Таблицы с датами (statements, serves, clusters) разбиты на каталоги
+# по месяцам (month=YYYY-MM), остальные хранятся одним файлом.
+# При чтении фильтры по месяцу, дате, подразделению и сотрудникам
+# передаются в pyarrow.dataset: лишние месяцы не открываются, а внутри
+# файла пропускаются row group, не подходящие по статистике.
+import datetime as dt
+import os
+from typing import Optional, List, Union, Iterable
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from sqlalchemy.engine import Engine
+
+from trajectory_report.report import construct_select as cs
+from trajectory_report.report.ConstructReport import resolve_tables
+from trajectory_report.exceptions import ReportException
+
+
+# Таблицы снимка и select, которым они выгружаются из БД
+DATED_TABLES = {
+    'statements': cs.statements_only,
+    'serves': cs.serves,
+    'clusters': cs.clusters,
+}
+UNDATED_TABLES = {
+    'employees': cs.employees,
+    'objects': cs.objects,
+    'divisions': cs.divisions,
+    'schedules': cs.employee_schedules,
+    'journal': cs.journal,
+    'comment': cs.comment,
+    'frequency': cs.frequency,
+}
+DATE_COLUMNS = ['date', 'period_init', 'period_end']
+DATETIME_COLUMNS = ['datetime', 'leaving_datetime']
+
+
+def _normalize(df: pd.DataFrame) -> pd.DataFrame:
+    """Одинаковые типы дат независимо от драйвера БД"""
+    for column in DATE_COLUMNS:
+        if column in df:
+            df[column] = pd.to_datetime(df[column]).dt.date
+    for column in DATETIME_COLUMNS:
+        if column in df:
+            df[column] = pd.to_datetime(df[column])
+    return df
+
+
+def export_snapshot(path: str,
+                    date_from: Union[dt.date, str],
+                    date_to: Optional[Union[dt.date, str]] = None,
+                    engine: Optional[Engine] = None) -> None:
+    """
+    Выгрузка таблиц отчета из БД в каталог path.
+    Месяцы, которые попали в период, перезаписываются целиком, остальные
+    месяцы снимка не меняются, поэтому снимок можно дополнять.
+    Периоды, начинающиеся или заканчивающиеся не на границе месяца,
+    перезапишут месяц только частью данных.
+    """
+    if engine is None:
+        from trajectory_report.database import DB_ENGINE
+        engine = DB_ENGINE
+    date_from = dt.date.fromisoformat(str(date_from))
+    date_to = dt.date.fromisoformat(str(date_to or dt.date.today()))
+    os.makedirs(path, exist_ok=True)
+    with engine.connect() as conn:
+        for table, sel in DATED_TABLES.items():
+            df = _normalize(pd.read_sql(sel(date_from=date_from,
+                                            date_to=date_to), conn))
+            df['month'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m')
+            ds.write_dataset(
+                pa.Table.from_pandas(df, preserve_index=False),
+                os.path.join(path, table), format='parquet',
+                partitioning=['month'], partitioning_flavor='hive',
+                existing_data_behavior='delete_matching')
+        for table, sel in UNDATED_TABLES.items():
+            df = _normalize(pd.read_sql(sel(), conn))
+            df.to_parquet(os.path.join(path, f'{table}.parquet'),
+                          index=False)
+
+
+class ParquetReportDataGetter:
+    """
+    Данные для отчета из снимка export_snapshot. Возвращает те же
+    таблицы, что и CachedReportDataGetter. Кластеры за текущий день
+    не формируются: в снимке есть только то, что было в БД при выгрузке.
+    """
+    def __init__(self, path: str):
+        if not os.path.isdir(path):
+            raise ReportException(f'Снимок не найден: {path}')
+        self._path = path
+
+    def _read(self, table: str,
+              filter_: Optional[ds.Expression] = None,
+              columns: Optional[List[str]] = None) -> pd.DataFrame:
+        if table in DATED_TABLES:
+            directory = os.path.join(self._path, table)
+            # Если при выгрузке строк не было, каталог таблицы не создается.
+            # Как и из БД, возвращается пустая таблица со столбцами select
+            if not os.path.isdir(directory) or not os.listdir(directory):
+                today = dt.date.today()
+                select_ = DATED_TABLES[table](date_from=today, date_to=today)
+                return pd.DataFrame(columns=columns or [
+                    i.name for i in select_.selected_columns])
+            dataset = ds.dataset(directory,
+                                 format='parquet', partitioning='hive')
+        else:
+            dataset = ds.dataset(os.path.join(self._path,
+                                              f'{table}.parquet'),
+                                 format='parquet')
+        return dataset.to_table(columns=columns, filter=filter_) \
+            .to_pandas(date_as_object=True)
+
+    def _period(self) -> ds.Expression:
+        months = [i.strftime('%Y-%m') for i in pd.period_range(
+            self._date_from, self._date_to, freq='M')]
+        return ds.field('month').isin(months) \
+            & (ds.field('date') >= pa.scalar(self._date_from)) \
+            & (ds.field('date') <= pa.scalar(self._date_to))
+
+    def get_data(self,
+                 date_from: Union[dt.date, str],
+                 date_to: Union[dt.date, str],
+                 division: Optional[Union[int, str]] = None,
+                 name_ids: Optional[List[int]] = None,
+                 object_ids: Optional[List[int]] = None,
+                 tables: Optional[Iterable[str]] = None
+                 ) -> dict:
+        """tables - набор необходимых таблиц (см. REPORT_TABLES),
+        по умолчанию запрашиваются все."""
+        self._date_from = dt.date.fromisoformat(str(date_from))
+        self._date_to = dt.date.fromisoformat(str(date_to))
+        tables = resolve_tables(tables)
+
+        if isinstance(division, str):
+            divisions = self._read('divisions')
+            division = divisions.loc[divisions.division_name == division,
+                                     'division']
+            if not len(division):
+                raise ReportException('Подразделение не найдено')
+            division = int(division.iloc[0])
+
+        data = dict()
+        stmts = self._statements(division, name_ids, object_ids)
+        name_ids = stmts.name_id.unique().tolist()
+        by_name_ids = ds.field('name_id').isin(name_ids)
+        data['_stmts'] = stmts
+
+        if 'journal' in tables:
+            journal = self._read('journal', by_name_ids)
+            journal['period_end'] = journal['period_end'].fillna(
+                dt.date.today())
+            data['_journal'] = journal
+        if 'schedules' in tables:
+            data['_schedules'] = self._read('schedules', by_name_ids)
+        if 'serves' in tables:
+            data['_serves'] = self._read(
+                'serves', self._period() & by_name_ids,
+                ['name_id', 'object_id', 'date', 'approval'])
+        if 'clusters' in tables:
+            subs_ids = journal.subscriberID.unique().tolist()
+            data['_clusters'] = self._read(
+                'clusters',
+                self._period() & ds.field('subscriberID').isin(subs_ids),
+                ['subscriberID', 'date', 'datetime', 'longitude',
+                 'latitude', 'leaving_datetime', 'cluster'])
+        if 'comment' in tables:
+            data['_comment'] = self._read('comment', by_name_ids)
+        if 'frequency' in tables:
+            data['_frequency'] = self._read('frequency', by_name_ids)
+        return data
+
+    def _statements(self,
+                    division: Optional[int] = None,
+                    name_ids: Optional[List[int]] = None,
+                    object_ids: Optional[List[int]] = None
+                    ) -> pd.DataFrame:
+        filter_ = self._period()
+        if division:
+            filter_ &= ds.field('division') == division
+        if name_ids:
+            filter_ &= ds.field('name_id').isin(name_ids)
+        if object_ids:
+            filter_ &= ds.field('object_id').isin(object_ids)
+        statements = self._read('statements', filter_,
+                                ['name_id', 'object_id', 'date',
+                                 'statement', 'division'])
+        if not len(statements):
+            raise ReportException(f'Не найдено заявленных выходов в период '
+                                  f'с {self._date_from} до {self._date_to}')
+
+        objects = self._read('objects', ds.field('object_id').isin(
+            statements.object_id.unique().tolist()))
+        employees = self._read('employees', ds.field('name_id').isin(
+            statements.name_id.unique().tolist()))
+        statements = pd.merge(statements, objects, on=['object_id'])
+        statements = pd.merge(statements, employees, on=['name_id'])
+        return statements[['name_id', 'object_id', 'name', 'object',
+                           'longitude', 'latitude', 'date', 'statement',
+                           'division']]
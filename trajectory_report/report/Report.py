@@ -9,7 +9,11 @@ import io
 import xlsxwriter
 from typing import Optional, Union, List
 from trajectory_report.report.ConstructReport import OneEmployeeReportDataGetter
-from trajectory_report.report.ConstructReport import report_data_factory
+from trajectory_report.report.ConstructReport import (report_data_factory,
+                                                      ReportDataSource)
+from trajectory_report.report.JournalIndex import JournalIndex
+from trajectory_report.profiling import span, profiled
+from trajectory_report.exceptions import ReportException
 
 
 class ReportBase:
@@ -175,6 +179,8 @@ class Report(ReportBase):
     clusters - кластеры нахождения в координатах
     date_from, date_to - изначальные даты запроса отчета
     conts - отображение отчета, False - длительность, True - кол-во посещений
+    source - источник таблиц (ReportDataSource), например снимок parquet.
+        По умолчанию - redis и БД (report_data_factory)
 
     Объект формирует отчет при инициализации. Доступные атрибуты:
     report - отчет в вертикальном виде, может понадобиться для сравнения или
@@ -186,7 +192,11 @@ class Report(ReportBase):
         xlsx - файл Bytes.IO, для скачивания отчета в формате xlsx.
 
     Также все изначальные таблицы доступны через "_".
+    REQUIRED_TABLES - таблицы, которые запрашиваются для построения отчета.
     """
+    REQUIRED_TABLES = frozenset({'stmts', 'journal', 'schedules', 'serves',
+                                 'clusters'})
+
     def __init__(self,
                  date_from: Union[dt.date, str],
                  date_to: Union[dt.date, str],
@@ -194,10 +204,19 @@ class Report(ReportBase):
                  name_ids: Optional[List[int]] = None,
                  object_ids: Optional[List[int]] = None,
                  counts: bool = False,
-                 use_cache: bool = True
+                 use_cache: bool = True,
+                 source: Optional[ReportDataSource] = None
                  ):
-        data = report_data_factory(date_from, date_to, division,
-                                   name_ids, object_ids, use_cache=use_cache)
+        with span('report.fetch'):
+            if source is not None:
+                data = source.get_data(date_from, date_to, division,
+                                       name_ids, object_ids,
+                                       tables=self.REQUIRED_TABLES)
+            else:
+                data = report_data_factory(date_from, date_to, division,
+                                           name_ids, object_ids,
+                                           use_cache=use_cache,
+                                           tables=self.REQUIRED_TABLES)
         self._date_from = dt.date.fromisoformat(str(date_from))
         self._date_to = dt.date.fromisoformat(str(date_to))
 
@@ -206,17 +225,27 @@ class Report(ReportBase):
         self._schedules = data.get('_schedules')
         self._serves = data.get('_serves')
         self._clusters = data.get('_clusters')
+        # Посещения, отобранные по расстоянию в БД
+        # (если включен REPORT_BASE['SQL_DISTANCE'])
+        self._attends = data.get('_attends')
         self._comment = data.get('_comment')
         self._frequency = data.get('_frequency')
 
         self._counts = counts
+        # Параметры запроса, для обновления текущего дня (refresh)
+        self._query = dict(division=division, name_ids=name_ids,
+                           object_ids=object_ids, counts=counts,
+                           use_cache=use_cache, source=source)
 
         # Эти параметры заполняются при выполнении метода _build_report
         self.duplicated_attends = None
         self.report = None
+        # Горизонтальный вид, сохраняется при первом обращении
+        self._horizontal = None
 
         # Построение отчета:
-        self._build()
+        with span('report.build'):
+            self._build()
 
     def _build(self):
         """All the way that Report is being built by"""
@@ -224,88 +253,105 @@ class Report(ReportBase):
         # чтобы понять, в каком случае совмещать таблицу с кластерами
         # и создавать отчет, а в каком его нет.
         # А также - какой subscriberID использовать.
-        statements_with_journal = self._create_stmts_with_journal_j_exist_vector()
+        with span('report.journal', rows_in=len(self._stmts)) as s:
+            statements_with_journal = \
+                self._create_stmts_with_journal_j_exist_vector()
+            s.rows_out = len(statements_with_journal)
         # Далее слияние этой таблицы с кластерами
         # (готовые данные о местонахождении сотрудников).
-        stmts_jrnl_clstrs = pd.merge(
-            statements_with_journal.set_index(['subscriberID', 'date']),
-            self._clusters.set_index(['subscriberID', 'date']),
-            left_index=True, right_index=True,
-            suffixes=('_object', '_clusters')
-        )
+        with span('report.merge_clusters',
+                  rows_in=len(self._clusters)) as s:
+            stmts_jrnl_clstrs = pd.merge(
+                statements_with_journal.set_index(['subscriberID', 'date']),
+                self._clusters.set_index(['subscriberID', 'date']),
+                left_index=True, right_index=True,
+                suffixes=('_object', '_clusters')
+            )
+            s.rows_out = len(stmts_jrnl_clstrs)
         # Вычисление дистанции между объектами и кластерами и фильтрация,
         # остаются только те строки, где дистанция в пределах RADIUS.
-        stmts_jrnl_clstrs = self._calculate_distance_vectorized(
-            stmts_jrnl_clstrs
-        )
+        with span('report.distance', rows_in=len(stmts_jrnl_clstrs)) as s:
+            stmts_jrnl_clstrs = self._calculate_distance_vectorized(
+                stmts_jrnl_clstrs
+            )
+            s.rows_out = len(stmts_jrnl_clstrs)
+        # Если расстояние уже посчитано в БД, в _clusters остаются только
+        # кластеры за текущий день, а посещения за прошедшие дни - в _attends
+        if self._attends is not None:
+            stmts_jrnl_clstrs = pd.concat([stmts_jrnl_clstrs, self._attends],
+                                          ignore_index=True)
         # Оставшиеся кластеры нужно объединить в один, если зазор между ними
         # в пределах MINUTES_BETWEEN_CLUSTERS. Это сокращает кол-во строк
         # в отчете, а также показывает количество посещений одного адреса.
-        stmts_jrnl_clstrs = self._consolidate_time_periods_vectorized(
-            stmts_jrnl_clstrs
-        )
+        with span('report.consolidate', rows_in=len(stmts_jrnl_clstrs)) as s:
+            stmts_jrnl_clstrs = self._consolidate_time_periods_vectorized(
+                stmts_jrnl_clstrs
+            )
+            s.rows_out = len(stmts_jrnl_clstrs)
         # Основная задача отчета - показать длительность и кол-во посещений:
-        stmts_jrnl_clstrs = self._set_count_and_duration(stmts_jrnl_clstrs)
+        with span('report.count_duration',
+                  rows_in=len(stmts_jrnl_clstrs)) as s:
+            stmts_jrnl_clstrs = self._set_count_and_duration(stmts_jrnl_clstrs)
+            s.rows_out = len(stmts_jrnl_clstrs)
         # Отчет сопровождается таблицей дубликатов выходов. Это когда к одному
         # подопечному было зафиксировано более одного выхода.
         # Строки с самым большим кол-вом посещений всегда будут в начале.
-        duplicated_attends = stmts_jrnl_clstrs \
-            .groupby(by=['object', 'object_id', 'date']) \
-            .agg({'duration': 'count', 'name': lambda x: ", ".join(list(x))}) \
-            .reset_index() \
-            .query("duration > 1") \
-            .loc[:, ['object', 'date', 'duration', 'name']] \
-            .sort_values(by=['duration', 'object', 'date'],
-                         ascending=[False, True, True])
+        with span('report.duplicates', rows_in=len(stmts_jrnl_clstrs)) as s:
+            duplicated_attends = stmts_jrnl_clstrs \
+                .groupby(by=['object', 'object_id', 'date']) \
+                .agg({'duration': 'count',
+                      'name': lambda x: ", ".join(list(x))}) \
+                .reset_index() \
+                .query("duration > 1") \
+                .loc[:, ['object', 'date', 'duration', 'name']] \
+                .sort_values(by=['duration', 'object', 'date'],
+                             ascending=[False, True, True])
+            s.rows_out = len(duplicated_attends)
 
         # Относительно сформировавшегося отчета фильтруются служебные записки.
         # Здесь же состояние записки (int) расшифровывается ("С"/"ПРОВ")
-        filtered_serves = self._filter_serves(stmts_jrnl_clstrs)
-
-        # Далее нужно совместить statements с готовым отчетом, чтобы стали
-        # доступны выходы, на которые нет сформированного отчета.
-        # Это "Н/Б", служебка или отметка о больничном/отпуске/увол
-        stmts_jrnl_clstrs = pd.merge(
-            self._stmts,
-            stmts_jrnl_clstrs,
-            how='left',
-            left_on=['name_id', 'object_id', 'date', 'name', 'object'],
-            right_on=['name_id', 'object_id', 'date', 'name', 'object']
-        )
-
-        # Совмещение отчета со служебками.
-        stmts_jrnl_clstrs = pd.merge(
-            stmts_jrnl_clstrs,
-            filtered_serves,
-            how='left',
-            left_on=['name_id', 'object_id', 'date'],
-            right_on=['name_id', 'object_id', 'date']
-        )
-        # Готовый отчет в вертикальном виде
-        self.duplicated_attends = duplicated_attends
-        self.report = self._merge_into_one_column(stmts_jrnl_clstrs)
+        with span('report.serves', rows_in=len(self._serves)) as s:
+            filtered_serves = self._filter_serves(stmts_jrnl_clstrs)
+            s.rows_out = len(filtered_serves)
+
+        with span('report.merge_result', rows_in=len(self._stmts)) as s:
+            # Далее нужно совместить statements с готовым отчетом, чтобы
+            # стали доступны выходы, на которые нет сформированного отчета.
+            # Это "Н/Б", служебка или отметка о больничном/отпуске/увол
+            stmts_jrnl_clstrs = pd.merge(
+                self._stmts,
+                stmts_jrnl_clstrs,
+                how='left',
+                left_on=['name_id', 'object_id', 'date', 'name', 'object'],
+                right_on=['name_id', 'object_id', 'date', 'name', 'object']
+            )
+
+            # Совмещение отчета со служебками.
+            stmts_jrnl_clstrs = pd.merge(
+                stmts_jrnl_clstrs,
+                filtered_serves,
+                how='left',
+                left_on=['name_id', 'object_id', 'date'],
+                right_on=['name_id', 'object_id', 'date']
+            )
+            # Готовый отчет в вертикальном виде
+            self.duplicated_attends = duplicated_attends
+            self.report = self._merge_into_one_column(stmts_jrnl_clstrs)
+            s.rows_out = len(self.report)
         return self
 
     def _create_stmts_with_journal_j_exist_vector(self) -> pd.DataFrame:
         """Объединение таблицы заявленных выходов с таблицей журнала,
         чтобы понять, в каком случае есть смысл запрашивать кластеры
         и создавать отчет, а в каком его нет.
-        А также - какой subscriberID использовать."""
-        stmts = pd.merge(self._stmts,
-                         self._journal,
-                         how='left', on='name_id')
-
-        stmts['j_exist'] = ((stmts['date'] >= stmts['period_init']) &
-                            (stmts['date'] <= stmts['period_end']))
+        А также - какой subscriberID использовать.
+        subscriberID на каждую дату определяется через JournalIndex,
+        без объединения каждой строки со всеми записями журнала."""
+        stmts = JournalIndex(self._journal).attach(self._stmts)
         # все Больн./Отпуск/Увол. не нуждаются в отчете, им проставляем False
         stmts.loc[stmts['object_id'] == 1, 'j_exist'] = False
+        stmts.loc[~stmts['j_exist'], 'subscriberID'] = NaN
 
-        # Фильтрация по наличию j_exist. Останутся все, где True,
-        # либо первый (без разницы, какой он там)
-        stmts = stmts[
-            (stmts['j_exist']) |
-            (~stmts.duplicated(subset=['name_id', 'object_id', 'date']))
-        ]
         stmts = stmts.reset_index()[
             ['name_id', 'name', 'object_id', 'object', 'longitude', 'latitude',
              'date', 'statement', 'subscriberID', 'j_exist']
@@ -409,10 +455,93 @@ class Report(ReportBase):
         df.loc[mask_future_or_first_object, 'result'] = df['statement']
         return df[["name", "name_id", "object", "object_id", "date", "result"]]
 
+    def refresh(self) -> pd.DataFrame:
+        """
+        Обновление отчета за текущий день (и последующие дни периода).
+        Прошедшие дни не меняются, поэтому заново запрашиваются и строятся
+        только строки с датой >= сегодня: новые кластеры, выходы и
+        служебные записки. report, duplicated_attends и горизонтальный вид
+        обновляются на месте.
+        Строки запрашиваются через redis и БД (report_data_factory), даже
+        если отчет построен из source: снимок (parquet и т.п.) не содержит
+        изменений за сегодня. Отчет за сегодня строится тем же классом,
+        что и этот отчет.
+        Возвращает изменившиеся ячейки: name, name_id, object, object_id,
+        date, old, new (пустое значение - ячейки не было или она удалена).
+        """
+        today = dt.date.today()
+        columns = ['name', 'name_id', 'object', 'object_id', 'date']
+        if self._date_to < today:
+            return pd.DataFrame(columns=columns + ['old', 'new'])
+        date_from = max(today, self._date_from)
+        with span('report.refresh') as s:
+            try:
+                fresh = type(self)(date_from, self._date_to,
+                                   **dict(self._query, source=None))
+            except ReportException:
+                # С сегодняшнего дня выходов больше нет
+                fresh = None
+
+            is_past = self.report['date'] < date_from
+            old = self.report.loc[~is_past]
+            new = fresh.report if fresh else old.iloc[:0]
+            self.report = pd.concat([self.report.loc[is_past], new],
+                                    ignore_index=True)
+
+            dups = self.duplicated_attends
+            fresh_dups = fresh.duplicated_attends if fresh else dups.iloc[:0]
+            self.duplicated_attends = pd.concat(
+                [dups.loc[dups['date'] < date_from], fresh_dups],
+                ignore_index=True) \
+                .sort_values(by=['duration', 'object', 'date'],
+                             ascending=[False, True, True])
+
+            for table in ('_stmts', '_serves', '_clusters', '_attends'):
+                df = getattr(self, table)
+                fresh_df = getattr(fresh, table) if fresh else None
+                if df is not None:
+                    setattr(self, table, pd.concat(
+                        [df.loc[df['date'] < date_from], fresh_df],
+                        ignore_index=True))
+            # Таблицы без дат (ReportWithAdditionalColumns) - целиком
+            for table in ('_comment', '_frequency'):
+                if fresh and getattr(self, table) is not None:
+                    setattr(self, table, getattr(fresh, table))
+
+            changed = pd.merge(old, new, on=columns, how='outer',
+                               suffixes=('_old', '_new')) \
+                .rename(columns={'result_old': 'old', 'result_new': 'new'})
+            changed = changed.loc[changed['old'].fillna('')
+                                  != changed['new'].fillna('')]
+            self._patch_horizontal(changed)
+            s.rows_out = len(changed)
+        return changed.reset_index(drop=True)
+
+    def _patch_horizontal(self, changed: pd.DataFrame) -> None:
+        """Изменение ячеек сохраненного горизонтального вида.
+        Если изменились строки (новый сотрудник и подопечный, или ячейка
+        удалена), вид будет построен заново при следующем обращении."""
+        if self._horizontal is None or not len(changed):
+            return
+        index = pd.MultiIndex.from_frame(
+            self._horizontal[['name_id', 'object_id']])
+        rows = index.get_indexer(pd.MultiIndex.from_frame(
+            changed[['name_id', 'object_id']].astype(int)))
+        if (rows == -1).any() or changed['new'].isna().any():
+            self._horizontal = None
+            return
+        for row, date, value in zip(rows, changed['date'], changed['new']):
+            self._horizontal.iat[
+                row, self._horizontal.columns.get_loc(str(date))] = value
+
     @property
     def horizontal_report(self) -> pd.DataFrame:
         """Представление отчета в горизонтальном виде"""
+        if self._horizontal is None:
+            self._horizontal = self._build_horizontal()
+        return self._horizontal.copy()
 
+    def _build_horizontal(self) -> pd.DataFrame:
         # Чтобы отображались все дни, независимо от наличия в эти дни
         # каких-либо данных, нужно составить "пустой" DF с этими датами
         # и совместить его с отчетом.
@@ -425,14 +554,17 @@ class Report(ReportBase):
         dates_df = pd.DataFrame(
             {'name_id': NaN, 'object_id': NaN, 'result': NaN,
              'date': all_dates_range})
-        # Объединение:
-        report = pd.concat([self.report, dates_df])
-
-        # Перевод в горизонтальную таблицу:
-        report = report.pivot(columns='date',
-                              values='result',
-                              index=["name", "name_id", "object", "object_id"])
-        report = report.dropna(how='all').fillna('').reset_index()
+        with span('report.horizontal', rows_in=len(self.report)) as s:
+            # Объединение:
+            report = pd.concat([self.report, dates_df])
+
+            # Перевод в горизонтальную таблицу:
+            report = report.pivot(
+                columns='date',
+                values='result',
+                index=["name", "name_id", "object", "object_id"])
+            report = report.dropna(how='all').fillna('').reset_index()
+            s.rows_out = len(report)
 
         # перевод дат в str, name(object)_id - в int
         # т.к. эта таблица предназначена для перевода в json.
@@ -441,6 +573,7 @@ class Report(ReportBase):
         report['object_id'] = report['object_id'].astype(int)
         return report
 
+    @profiled('report.xlsx')
     def xlsx(self, list_no_payments: list | None = None) -> io.BytesIO:
         """Переводит отчет в xlsx файл (объект BytesIO)"""
         document = io.BytesIO()
@@ -620,6 +753,7 @@ class Report(ReportBase):
         return document
 
     @property
+    @profiled('report.as_json_dict')
     def as_json_dict(self) -> dict:
         """Для предоставления отчета через API, нужно перевести DataFrame в
         словарь и предоставить список столбцов."""
@@ -637,6 +771,8 @@ class Report(ReportBase):
 
 
 class ReportWithAdditionalColumns(Report):
+    REQUIRED_TABLES = Report.REQUIRED_TABLES | {'comment', 'frequency'}
+
     def __init__(self,
                  date_from: Union[dt.date, str],
                  date_to: Union[dt.date, str],
@@ -644,10 +780,11 @@ class ReportWithAdditionalColumns(Report):
                  name_ids: Optional[List[int]] = None,
                  object_ids: Optional[List[int]] = None,
                  counts: bool = False,
-                 use_cache: bool = True
+                 use_cache: bool = True,
+                 source: Optional[ReportDataSource] = None
                  ):
         super().__init__(date_from, date_to, division, name_ids,
-                         object_ids, counts, use_cache)
+                         object_ids, counts, use_cache, source)
 
     @property
     def horizontal_report(self) -> pd.DataFrame:
@@ -695,8 +832,9 @@ class OneEmployeeReport(OneEmployeeReportDataGetter, ReportBase):
     def __init__(self,
                  name_id: int,
                  date: Union[dt.date, str],
-                 division: Union[int, str]):
-        super().__init__(name_id, date, division)
+                 division: Union[int, str],
+                 inputs: Optional[tuple] = None):
+        super().__init__(name_id, date, division, inputs)
         self.report = self._build_report()
         self.analytics = self._location_analysis()
 
@@ -0,0 +1,264 @@
+# (объединение одинаковых одновременных запросов отчетов)
+# Несколько пользователей часто одновременно открывают один и тот же
+# отчет. ReportService строит его один раз:
+# - одинаковые запросы (с точностью до нормализации параметров), пришедшие
+#   во время построения, ждут его результата, а не строят отчет заново;
+# - между процессами то же самое делается через redis: один процесс
+#   берет блокировку и строит отчет, остальные ждут результат в redis;
+# - готовый результат хранится REPORT_SERVICE['TTL_SECONDS'] в памяти
+#   процесса (в пределах REPORT_SERVICE['CACHE_BYTES']) и в redis.
+# Ключ результата включает версию данных кэша (cache_version), поэтому
+# после изменения данных через invalidate отчет строится заново.
+#
+#     service = get_service()
+#     service.get('report', 'json', date_from='2023-08-01',
+#                 date_to='2023-08-31', division='ПВТ1')
+#     await service.aget('map_movements', name_id=1, date='2023-08-01',
+#                        division='ПВТ1')
+import asyncio
+import datetime as dt
+import functools
+import hashlib
+import importlib
+import json
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Optional, Tuple
+
+from trajectory_report import database
+from trajectory_report.config import REPORT_SERVICE
+from trajectory_report.profiling import span
+from trajectory_report.report.CacheNamespace import (key as cache_key,
+                                                     start_collector)
+from trajectory_report.report.ConstructReport import (cache_version,
+                                                      redis_available)
+
+# Виды отчетов: модуль, класс и поддерживаемые форматы результата
+KINDS = {
+    'report': ('trajectory_report.report.Report', 'Report',
+               ('json', 'xlsx')),
+    'report_additional': ('trajectory_report.report.Report',
+                          'ReportWithAdditionalColumns', ('json', 'xlsx')),
+    'map_movements': ('trajectory_report.map.movements', 'MapMovements',
+                      ('json',)),
+}
+
+
+# Снятие блокировки, только если она все ещё принадлежит этому процессу:
+# после истечения LOCK_SECONDS её мог взять другой процесс
+_RELEASE_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _ids(ids) -> Optional[Tuple[int, ...]]:
+    return tuple(sorted({int(i) for i in ids})) if ids else None
+
+
+def _date(date) -> str:
+    return dt.date.fromisoformat(str(date)).isoformat()
+
+
+class _ResultCache:
+    """LRU результатов (pickle) с ограничением по объему и сроком жизни"""
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._items: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                self._pop(key)
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self._max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._pop(key)
+            self._items[key] = (time.monotonic() + self._ttl, value)
+            self._bytes += len(value)
+            while self._bytes > self._max_bytes:
+                self._pop(next(iter(self._items)))
+
+    def _pop(self, key: str) -> None:
+        _, value = self._items.pop(key)
+        self._bytes -= len(value)
+
+
+class ReportService:
+    """
+    Построение отчетов с объединением одинаковых запросов.
+    distributed - объединять запросы разных процессов через redis
+    (если redis доступен).
+    """
+
+    def __init__(self, distributed: bool = True):
+        self._distributed = distributed
+        self._cache = _ResultCache(REPORT_SERVICE['CACHE_BYTES'],
+                                   REPORT_SERVICE['TTL_SECONDS'])
+        self._in_flight: dict = dict()
+        self._lock = threading.Lock()
+        self._divisions: dict = dict()
+        self.stats = {'hits': 0, 'coalesced': 0, 'shared_hits': 0,
+                      'builds': 0}
+
+    def get(self, kind: str, fmt: str = 'json', **params) -> Any:
+        """
+        Результат отчета kind (см. KINDS) в формате fmt:
+        'json' - as_json_dict, 'xlsx' - содержимое файла (bytes).
+        params - параметры конструктора класса отчета (для xlsx можно
+        передать list_no_payments).
+        """
+        params = self._normalize(kind, fmt, params)
+        key = self._key(kind, fmt, params)
+
+        cached = self._cache.get(key)
+        if cached is not None:
+            self.stats['hits'] += 1
+            return pickle.loads(cached)
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+        if not owner:
+            self.stats['coalesced'] += 1
+            return pickle.loads(future.result())
+
+        try:
+            result = self._shared(key, kind, fmt, params)
+            self._cache.set(key, result)
+            future.set_result(result)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+        return pickle.loads(result)
+
+    async def aget(self, kind: str, fmt: str = 'json', **params) -> Any:
+        """get для asyncio: отчет строится в пуле потоков, одинаковые
+        запросы объединяются так же, как в get."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(self.get, kind, fmt, **params))
+
+    def _normalize(self, kind: str, fmt: str, params: dict) -> dict:
+        """Параметры запроса в каноническом виде: даты - ISO, подразделение
+        - id, списки id - отсортированные кортежи без повторов."""
+        if kind not in KINDS:
+            raise ValueError(f'Unknown report kind: {kind}')
+        if fmt not in KINDS[kind][2]:
+            raise ValueError(f'Format {fmt} is not supported by {kind}')
+        params = dict(params)
+        for name in ('date_from', 'date_to', 'date'):
+            if name in params:
+                params[name] = _date(params[name])
+        for name in ('name_ids', 'object_ids', 'list_no_payments'):
+            if name in params:
+                params[name] = _ids(params[name])
+        if 'name_id' in params:
+            params['name_id'] = int(params['name_id'])
+        if params.get('division') is not None:
+            params['division'] = self._division_id(params['division'])
+        return params
+
+    def _division_id(self, division) -> int:
+        if isinstance(division, int) or str(division).isdigit():
+            return int(division)
+        if division not in self._divisions:
+            from trajectory_report.report.BatchReport import divisions
+            self._divisions = divisions()
+        return self._divisions.get(division, division)
+
+    @staticmethod
+    def _key(kind: str, fmt: str, params: dict) -> str:
+        version = cache_version() if redis_available() else 0
+        dumped = json.dumps([kind, fmt, params, version], sort_keys=True)
+        return f'{kind}:{hashlib.sha1(dumped.encode()).hexdigest()}'
+
+    def _shared(self, key: str, kind: str, fmt: str, params: dict) -> bytes:
+        """
+        Результат из redis или построенный этим процессом. Пока другой
+        процесс строит тот же отчет (держит блокировку), ждем результат.
+        Если процесс, который строит отчет, завис, его блокировка истекает
+        через LOCK_SECONDS, и её берет один из ожидающих: отчет по-прежнему
+        строит только один процесс. Блокировка хранит уникальный токен и
+        снимается, только если токен совпадает (_RELEASE_LOCK).
+        """
+        if not (self._distributed and redis_available()):
+            return self._build(kind, fmt, params)
+        r_conn = database.REDIS_CONN
+        result_key = cache_key(f'result:{key}')
+        lock_key = cache_key(f'result_lock:{key}')
+        token = uuid.uuid4().hex
+        delay = 0.05
+        while True:
+            result = r_conn.get(result_key)
+            if result is not None:
+                self.stats['shared_hits'] += 1
+                return result
+            if r_conn.set(lock_key, token, nx=True,
+                          ex=REPORT_SERVICE['LOCK_SECONDS']):
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        try:
+            result = self._build(kind, fmt, params)
+            r_conn.set(result_key, result, ex=REPORT_SERVICE['TTL_SECONDS'])
+        finally:
+            r_conn.eval(_RELEASE_LOCK, 1, lock_key, token)
+        return result
+
+    def _build(self, kind: str, fmt: str, params: dict) -> bytes:
+        module, name, _ = KINDS[kind]
+        cls = getattr(importlib.import_module(module), name)
+        params = dict(params)
+        list_no_payments = params.pop('list_no_payments', None)
+        self.stats['builds'] += 1
+        with span(f'service.build.{kind}'):
+            if kind == 'map_movements':
+                # Карты за прошедшие дни хранятся в своем кэше
+                return pickle.dumps(cls.cached_json(**params))
+            report = cls(**params)
+            if fmt == 'xlsx':
+                list_no_payments = list(list_no_payments or []) or None
+                result = report.xlsx(list_no_payments).getvalue()
+            else:
+                result = report.as_json_dict
+            return pickle.dumps(result)
+
+
+_service: Optional[ReportService] = None
+
+
+def get_service() -> ReportService:
+    """Общий для процесса ReportService. При первом вызове запускается
+    удаление старых пространств имен кэша (CacheNamespace.start_collector)"""
+    global _service
+    if _service is None:
+        _service = ReportService()
+        start_collector()
+    return _service
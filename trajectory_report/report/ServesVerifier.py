@@ -0,0 +1,159 @@
+# (проверка служебных записок по кластерам сотрудников)
+# Служебные записки на проверке (approval = 3) проверяются все сразу:
+# subscriberID сотрудника на дату определяется по журналу, кластеры
+# берутся из кэша отчета, расстояния от объекта до кластеров считаются
+# одним векторным вычислением. Для каждой записки сохраняется
+# предлагаемое решение (таблица serves_verdict), окончательное решение
+# по-прежнему принимается вручную.
+#
+#     verdicts = verify_serves('2023-08-01', '2023-08-31')
+#     write_verdicts(verdicts)
+# Запуск (за текущий и прошлый месяц):
+#     python -m trajectory_report.report.ServesVerifier
+import datetime as dt
+from typing import List, Optional, Union
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete, insert
+
+from trajectory_report import database
+from trajectory_report.config import REPORT_BASE
+from trajectory_report.exceptions import ReportException
+from trajectory_report.models import ServesVerdict
+from trajectory_report.profiling import span
+from trajectory_report.report import construct_select as cs
+from trajectory_report.report.ConstructReport import (cache_window_start,
+                                                      report_data_factory)
+from trajectory_report.report.JournalIndex import JournalIndex
+
+# Кластер сотрудника в пределах REPORT_BASE['RADIUS'] от объекта
+VERDICT_CONFIRMED = 'confirmed'
+# Кластеры за день есть, но все дальше RADIUS
+VERDICT_NOT_FOUND = 'not_found'
+# Нечего проверять: нет устройства, кластеров или координат объекта
+VERDICT_NO_DATA = 'no_data'
+
+# Кол-во записок в одном запросе при сохранении решений
+WRITE_CHUNK = 1000
+
+
+def _distance_m(lat1: np.ndarray, lon1: np.ndarray,
+                lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """Расстояние в метрах (та же формула, что и в отчете)"""
+    p = np.pi / 180
+    a = 0.5 - np.cos((lat2 - lat1) * p) / 2 \
+        + np.cos(lat1 * p) * np.cos(lat2 * p) \
+        * (1 - np.cos((lon2 - lon1) * p)) / 2
+    return 12742000 * np.arcsin(np.sqrt(a))
+
+
+def _clusters(date_from: dt.date, date_to: dt.date, name_ids: List[int],
+              use_cache: bool) -> tuple:
+    """Журнал и кластеры сотрудников name_ids за период (из кэша отчета).
+    Если у сотрудников нет заявленных выходов - пустые таблицы."""
+    try:
+        data = report_data_factory(date_from, date_to, name_ids=name_ids,
+                                   use_cache=use_cache,
+                                   tables={'clusters'})
+    except ReportException:
+        return (pd.DataFrame(columns=['name_id', 'subscriberID',
+                                      'period_init', 'period_end']),
+                pd.DataFrame(columns=['subscriberID', 'date', 'latitude',
+                                      'longitude']))
+    return data['_journal'], data['_clusters']
+
+
+def verify_serves(date_from: Union[dt.date, str],
+                  date_to: Union[dt.date, str],
+                  use_cache: bool = True) -> pd.DataFrame:
+    """
+    Предлагаемые решения по служебным запискам на проверке за период.
+    Возвращает id, name_id, object_id, date, distance (до ближайшего
+    кластера, м), verdict (VERDICT_*).
+    """
+    date_from = dt.date.fromisoformat(str(date_from))
+    date_to = dt.date.fromisoformat(str(date_to))
+    with span('serves.fetch') as s, database.DB_ENGINE.connect() as conn:
+        serves = pd.read_sql(cs.pending_serves(date_from, date_to), conn)
+        s.rows_out = len(serves)
+    if not len(serves):
+        return serves.assign(distance=pd.Series(dtype=float),
+                             verdict=pd.Series(dtype=str))[
+            ['id', 'name_id', 'object_id', 'date', 'distance', 'verdict']]
+
+    journal, clusters = _clusters(date_from, date_to,
+                                  serves.name_id.unique().tolist(), use_cache)
+
+    with span('serves.verify', rows_in=len(serves)) as s:
+        serves = JournalIndex(journal).attach(serves)
+        found = serves[serves['j_exist']
+                       & serves['latitude'].notna()
+                       & serves['longitude'].notna()]
+        found = pd.DataFrame({
+            'id': found['id'].to_numpy(),
+            'subscriberID': found['subscriberID'].astype(np.int64).to_numpy(),
+            'date': pd.to_datetime(found['date']).to_numpy(),
+            'latitude_object': found['latitude'].astype(float).to_numpy(),
+            'longitude_object': found['longitude'].astype(float).to_numpy(),
+        })
+        clusters = clusters[['subscriberID', 'date', 'latitude',
+                             'longitude']].dropna()
+        clusters = pd.DataFrame({
+            'subscriberID': clusters['subscriberID'].astype(np.int64)
+            .to_numpy(),
+            'date': pd.to_datetime(clusters['date']).to_numpy(),
+            'latitude_clusters': clusters['latitude'].astype(float)
+            .to_numpy(),
+            'longitude_clusters': clusters['longitude'].astype(float)
+            .to_numpy(),
+        })
+        # Каждая записка с каждым кластером сотрудника за тот же день
+        pairs = pd.merge(found, clusters, on=['subscriberID', 'date'])
+        pairs['distance'] = _distance_m(
+            pairs['latitude_object'].to_numpy(),
+            pairs['longitude_object'].to_numpy(),
+            pairs['latitude_clusters'].to_numpy(),
+            pairs['longitude_clusters'].to_numpy())
+        nearest = pairs.groupby('id')['distance'].min()
+
+        serves['distance'] = serves['id'].map(nearest).round()
+        serves['verdict'] = np.select(
+            [serves['distance'] <= REPORT_BASE['RADIUS'],
+             serves['distance'].notna()],
+            [VERDICT_CONFIRMED, VERDICT_NOT_FOUND], VERDICT_NO_DATA)
+        s.rows_out = int((serves['verdict'] == VERDICT_CONFIRMED).sum())
+    return serves[['id', 'name_id', 'object_id', 'date', 'distance',
+                   'verdict']]
+
+
+def write_verdicts(verdicts: pd.DataFrame) -> int:
+    """Сохраняет решения verify_serves в serves_verdict (предыдущие
+    решения по этим запискам заменяются). Возвращает кол-во записок."""
+    checked_at = dt.datetime.now().replace(microsecond=0)
+    rows = [{'serve_id': int(serve_id), 'verdict': verdict,
+             'distance': None if pd.isna(distance) else int(distance),
+             'checked_at': checked_at}
+            for serve_id, verdict, distance in zip(
+                verdicts['id'], verdicts['verdict'], verdicts['distance'])]
+    with database.DB_ENGINE.begin() as conn:
+        for i in range(0, len(rows), WRITE_CHUNK):
+            chunk = rows[i:i + WRITE_CHUNK]
+            conn.execute(delete(ServesVerdict).where(
+                ServesVerdict.serve_id.in_([j['serve_id'] for j in chunk])))
+            conn.execute(insert(ServesVerdict), chunk)
+    return len(rows)
+
+
+def main(date_from: Optional[Union[dt.date, str]] = None,
+         date_to: Optional[Union[dt.date, str]] = None) -> int:
+    """Проверка записок за период (по умолчанию - окно кэша, с начала
+    прошлого месяца по сегодня) и сохранение решений"""
+    verdicts = verify_serves(date_from or cache_window_start(),
+                             date_to or dt.date.today())
+    return write_verdicts(verdicts)
+
+
+if __name__ == "__main__":
+    import sys
+    print(f'{main(*sys.argv[1:3])} serves have been checked.')
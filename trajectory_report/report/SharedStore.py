@@ -0,0 +1,243 @@
+# (общее для процессов хранилище справочных таблиц отчета)
+# Каждый процесс веб-сервера распаковывал из redis собственную копию
+# employees, objects, journal, schedules и кластеров за два месяца.
+# Здесь эти таблицы хранятся в файлах Arrow IPC на локальном диске
+# (по умолчанию /dev/shm). Файлы открываются через memory map, поэтому
+# все процессы читают одну копию в page cache, а в pandas переводятся
+# только строки, нужные отчету (фильтр выполняется на стороне Arrow).
+#
+# Таблицы выгружает один загрузчик (cron, после gather/clusters):
+#     python -m trajectory_report.report.SharedStore
+# Каждая выгрузка пишется в отдельный каталог (поколение), затем ссылка
+# current атомарно переключается на него. Читатель один раз на запрос
+# отчета читает ссылку (SharedStoreReader.snapshot) и берет все таблицы
+# из этого поколения. Замененное поколение удаляется не раньше, чем через
+# SHARED_STORE['GRACE_SECONDS'], поэтому запрос, начатый до
+# переключения, успевает дочитать его файлы.
+# Требует pyarrow (pip install trajectory_report[parquet]).
+import datetime as dt
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+import pandas as pd
+
+from trajectory_report import database
+from trajectory_report.config import SHARED_STORE
+from trajectory_report.report import construct_select as cs
+from trajectory_report.report.CacheNamespace import namespace
+
+# Таблицы хранилища и select, которыми они выгружаются из БД
+TABLES = {
+    'employees': cs.employees,
+    'objects': cs.objects,
+    'journal': cs.journal,
+    'schedules': cs.employee_schedules,
+    'clusters': cs.clusters,
+}
+# Столбец, по которому таблица фильтруется для отчета
+FILTER_COLUMNS = {
+    'journal': 'name_id',
+    'schedules': 'name_id',
+    'clusters': 'subscriberID',
+}
+
+
+def _root(path: Optional[str] = None) -> str:
+    # Каталог зависит от пространства имен кэша: после изменения
+    # параметров или схемы старые файлы не читаются
+    return os.path.join(path or SHARED_STORE['PATH'], namespace())
+
+
+def publish(tables: Dict[str, pd.DataFrame],
+            clusters_to: Optional[dt.date] = None,
+            path: Optional[str] = None) -> str:
+    """
+    Записывает таблицы в новое поколение и переключает на него ссылку
+    current. clusters_to - последний день, кластеры за который есть в
+    таблице clusters (более поздние дни читаются из redis).
+    Хранится SHARED_STORE['KEEP_GENERATIONS'] последних поколений, более
+    старые удаляются, если они заменены больше
+    SHARED_STORE['GRACE_SECONDS'] назад.
+    Возвращает имя поколения.
+    """
+    import pyarrow as pa
+
+    root = _root(path)
+    generation = str(time.time_ns())
+    directory = os.path.join(root, generation)
+    os.makedirs(directory)
+    for name, df in tables.items():
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.OSFile(os.path.join(directory, f'{name}.arrow'), 'wb') as f, \
+                pa.ipc.new_file(f, table.schema) as writer:
+            writer.write_table(table)
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({'published_at': time.time(),
+                   'clusters_to': clusters_to and clusters_to.isoformat(),
+                   'tables': list(tables)}, f)
+
+    # Атомарная замена ссылки: новая ссылка создается рядом и
+    # переименовывается поверх старой
+    link = os.path.join(root, 'current')
+    tmp_link = f'{link}.{generation}'
+    os.symlink(generation, tmp_link)
+    os.replace(tmp_link, link)
+
+    # Имя поколения - время выгрузки (нс), поэтому поколение заменено в
+    # момент, указанный в имени следующего
+    generations = sorted((i for i in os.listdir(root) if i.isdigit()),
+                         key=int)
+    grace_ns = SHARED_STORE['GRACE_SECONDS'] * 10 ** 9
+    for old, replaced_by in zip(
+            generations[:-SHARED_STORE['KEEP_GENERATIONS']],
+            generations[1:]):
+        if int(generation) - int(replaced_by) >= grace_ns:
+            shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return generation
+
+
+def load(path: Optional[str] = None) -> str:
+    """Выгрузка таблиц из БД в хранилище. Кластеры - с начала прошлого
+    месяца (как в кэше redis) по вчерашний день."""
+    from trajectory_report.report.ConstructReport import cache_window_start
+
+    clusters_to = dt.date.today() - dt.timedelta(days=1)
+    tables = dict()
+    with database.DB_ENGINE.connect() as conn:
+        for name, select_ in TABLES.items():
+            if name == 'clusters':
+                select_ = select_(cache_window_start(), clusters_to)
+            else:
+                select_ = select_(date_from=cache_window_start())
+            tables[name] = pd.read_sql(select_, conn)
+    return publish(tables, clusters_to, path)
+
+
+class Generation:
+    """
+    Таблицы одного поколения хранилища (memory map). Поколение не
+    меняется: все таблицы одного отчета читаются из него, даже если ссылка
+    current уже переключена на следующее (файлы старого поколения
+    удаляются не сразу, см. publish).
+    """
+
+    def __init__(self, directory: str, meta: dict):
+        self.name = os.path.basename(directory)
+        self.meta = meta
+        self._directory = directory
+        self._lock = threading.Lock()
+        self._tables: dict = dict()
+
+    def available(self, invalidated: Optional[dict] = None) -> set:
+        """
+        Таблицы, которые можно взять из хранилища. invalidated -
+        {таблица: время изменения} (см. ConstructReport.invalidate):
+        таблицы, изменившиеся после выгрузки, читаются из redis.
+        """
+        published_at = self.meta['published_at']
+        invalidated = invalidated or dict()
+        return {i for i in self.meta['tables']
+                if float(invalidated.get(i, 0)) < published_at
+                and (i != 'clusters' or self.clusters_to)}
+
+    @property
+    def clusters_to(self) -> Optional[dt.date]:
+        clusters_to = self.meta.get('clusters_to')
+        return dt.date.fromisoformat(clusters_to) if clusters_to else None
+
+    def _table(self, name: str):
+        import pyarrow as pa
+
+        with self._lock:
+            table = self._tables.get(name)
+            if table is None:
+                source = pa.memory_map(os.path.join(self._directory,
+                                                    f'{name}.arrow'))
+                table = pa.ipc.open_file(source).read_all()
+                self._tables[name] = table
+        return table
+
+    def read(self, name: str,
+             values: Optional[Iterable] = None,
+             date_from: Optional[dt.date] = None,
+             date_to: Optional[dt.date] = None) -> pd.DataFrame:
+        """Таблица name, отфильтрованная по FILTER_COLUMNS[name] in values
+        и по дате, в виде DataFrame"""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        table = self._table(name)
+        mask = None
+
+        def and_(condition):
+            return condition if mask is None else pc.and_(mask, condition)
+
+        if values is not None:
+            column = table[FILTER_COLUMNS[name]]
+            mask = and_(pc.is_in(column, value_set=pa.array(
+                list(values), type=column.type)))
+        if date_from is not None:
+            mask = and_(pc.greater_equal(table['date'], date_from))
+        if date_to is not None:
+            mask = and_(pc.less_equal(table['date'], date_to))
+        if mask is not None:
+            table = table.filter(mask)
+        return table.to_pandas(date_as_object=True)
+
+
+class SharedStoreReader:
+    """Текущее поколение хранилища для процесса"""
+
+    def __init__(self, path: Optional[str] = None):
+        self._root = _root(path)
+        self._lock = threading.Lock()
+        self._current: Optional[Generation] = None
+
+    def snapshot(self) -> Optional[Generation]:
+        """
+        Поколение, на которое указывает ссылка current (None - хранилище
+        пусто). Ссылка читается один раз на отчет: проверка доступных
+        таблиц и чтение должны использовать одно поколение.
+        Открытые таблицы поколения переиспользуются, пока ссылка не
+        переключится.
+        """
+        try:
+            name = os.readlink(os.path.join(self._root, 'current'))
+            current = self._current
+            if current is None or current.name != name:
+                directory = os.path.join(self._root, name)
+                with open(os.path.join(directory, 'meta.json')) as f:
+                    current = Generation(directory, json.load(f))
+                with self._lock:
+                    self._current = current
+        except OSError:
+            # Хранилище пусто или поколение удалено между чтением ссылки
+            # и meta.json: таблицы читаются из redis
+            return None
+        return current
+
+
+_reader: Optional[SharedStoreReader] = None
+
+
+def attach() -> Optional[SharedStoreReader]:
+    """Читатель хранилища для текущего процесса. None - хранилище
+    выключено или не установлен pyarrow."""
+    global _reader
+    if not SHARED_STORE['ENABLED']:
+        return None
+    if _reader is None:
+        try:
+            import pyarrow
+        except ImportError:
+            return None
+        _reader = SharedStoreReader()
+    return _reader
+
+
+if __name__ == "__main__":
+    print(f'Shared store generation {load()} has been published.')
@@ -0,0 +1,200 @@
+# (инкрементальное формирование кластеров по текущим локациям)
+import datetime as dt
+import json
+from math import sin, cos, sqrt, atan2, pi
+from typing import List, Optional, TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+from trajectory_report.config import STAY_LOCATIONS_CONFIG, CLUSTERS_CONFIG
+from trajectory_report import database
+from trajectory_report.report import construct_select as cs
+from trajectory_report.report.CacheNamespace import key as cache_key
+
+if TYPE_CHECKING:
+    import redis
+
+
+CLUSTERS_COLUMNS = ['subscriberID', 'date', 'datetime', 'longitude',
+                    'latitude', 'leaving_datetime', 'cluster']
+
+
+def _distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Haversine, как в skmob.utils.gislib.getDistance"""
+    lat1, lon1, lat2, lon2 = (i * pi / 180 for i in (lat1, lon1, lat2, lon2))
+    a = sin((lat2 - lat1) / 2) ** 2 + \
+        cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 6371.0 * 2 * atan2(sqrt(a), sqrt(1 - a))
+
+
+class SubscriberStops:
+    """
+    Состояние формирования остановок одного subscriberID за день.
+    Алгоритм повторяет skmob.preprocessing.detection.stops: точки
+    накапливаются, пока находятся в пределах spatial_radius_km от первой
+    точки группы. Когда очередная точка выходит за радиус, группа
+    становится остановкой (если она длилась дольше minutes_for_a_stop).
+    Отличие в том, что точки можно подавать порциями: незавершенная
+    группа хранится в состоянии до следующего вызова.
+    Номера кластеров присваиваются сразу: остановка получает номер
+    ближайшей остановки в пределах cluster_radius_km, либо новый.
+    """
+
+    def __init__(self, state: Optional[dict] = None):
+        state = state or dict()
+        # Первая точка текущей (открытой) группы
+        self.anchor: Optional[list] = state.get('anchor')
+        # Координаты точек открытой группы, для медианы
+        self.lats: List[float] = state.get('lats', [])
+        self.lons: List[float] = state.get('lons', [])
+        # Время последней обработанной точки
+        self.last_t: Optional[str] = state.get('last_t')
+        # Завершенные остановки: [lat, lon, datetime, leaving_datetime, cluster]
+        self.stops: List[list] = state.get('stops', [])
+
+    def to_dict(self) -> dict:
+        return {'anchor': self.anchor, 'lats': self.lats, 'lons': self.lons,
+                'last_t': self.last_t, 'stops': self.stops}
+
+    def _reset(self, lat: float, lon: float, t: dt.datetime) -> None:
+        self.anchor = [lat, lon, t.isoformat()]
+        self.lats, self.lons = [], []
+
+    def _cluster(self, lat: float, lon: float) -> int:
+        for s_lat, s_lon, _, _, cluster in self.stops:
+            if _distance_km(lat, lon, s_lat, s_lon) <= \
+                    CLUSTERS_CONFIG['cluster_radius_km']:
+                return cluster
+        return max([i[4] for i in self.stops], default=-1) + 1
+
+    def add(self, lat: float, lon: float, t: dt.datetime) -> None:
+        """Обработать очередную точку. Точки старше последней
+        обработанной пропускаются."""
+        minutes = STAY_LOCATIONS_CONFIG['minutes_for_a_stop']
+        if self.last_t is not None:
+            last_t = dt.datetime.fromisoformat(self.last_t)
+            if t <= last_t:
+                return
+            if (t - last_t).total_seconds() / 60 > \
+                    STAY_LOCATIONS_CONFIG['no_data_for_minutes']:
+                # Нет данных слишком долго: это не остановка
+                self._reset(lat, lon, t)
+        if self.anchor is None:
+            self._reset(lat, lon, t)
+
+        lat_0, lon_0, t_0 = self.anchor
+        t_0 = dt.datetime.fromisoformat(t_0)
+        if _distance_km(lat_0, lon_0, lat, lon) > \
+                STAY_LOCATIONS_CONFIG['spatial_radius_km']:
+            if self.lats and (t - t_0).total_seconds() / 60 > minutes:
+                s_lat, s_lon = np.median(self.lats), np.median(self.lons)
+                self.stops.append([float(s_lat), float(s_lon),
+                                   t_0.isoformat(), t.isoformat(),
+                                   self._cluster(s_lat, s_lon)])
+            self._reset(lat, lon, t)
+        self.lats.append(lat)
+        self.lons.append(lon)
+        self.last_t = t.isoformat()
+
+    def provisional(self) -> Optional[list]:
+        """Открытая группа как предварительная остановка, если она уже
+        длится дольше minutes_for_a_stop. leaving_datetime - время
+        последней точки."""
+        if self.anchor is None or not self.lats:
+            return None
+        t_0 = dt.datetime.fromisoformat(self.anchor[2])
+        last_t = dt.datetime.fromisoformat(self.last_t)
+        if (last_t - t_0).total_seconds() / 60 <= \
+                STAY_LOCATIONS_CONFIG['minutes_for_a_stop']:
+            return None
+        s_lat, s_lon = np.median(self.lats), np.median(self.lons)
+        return [float(s_lat), float(s_lon), self.anchor[2], self.last_t,
+                self._cluster(s_lat, s_lon)]
+
+
+class IncrementalStopDetector:
+    """
+    Кластеры за текущий день без пересчета всех локаций дня.
+    Состояние каждого subscriberID (SubscriberStops) и водяной знак -
+    последний обработанный locationID - хранятся в redis. При каждом
+    вызове из БД запрашиваются только локации с locationID больше
+    водяного знака, поэтому стоимость запроса отчета зависит от кол-ва
+    новых локаций, а не от всех локаций за день.
+    Обновление состояния защищено блокировкой redis, чтобы несколько
+    процессов не обработали одни и те же локации дважды.
+    """
+    # Время жизни ключей после окончания дня, в секундах
+    EXPIRE_AFTER_DAY = 6 * 60 * 60
+
+    def __init__(self, r_conn: 'redis.Redis', date: Optional[dt.date] = None):
+        self._r_conn = r_conn
+        self._date = date or dt.date.today()
+        prefix = cache_key(f'current_stops:{self._date.isoformat()}')
+        self._state_key = f'{prefix}:state'
+        self._watermark_key = f'{prefix}:watermark'
+        self._lock_key = f'{prefix}:lock'
+
+    def update(self) -> int:
+        """Обработать новые локации. Возвращает кол-во обработанных."""
+        with self._r_conn.lock(self._lock_key, timeout=120):
+            watermark = int(self._r_conn.get(self._watermark_key) or 0)
+            with database.DB_ENGINE.connect() as conn:
+                locations = pd.read_sql(
+                    cs.new_locations(self._date, watermark), conn)
+            if not len(locations):
+                return 0
+
+            subs_ids = locations.subscriberID.unique().tolist()
+            states = dict(zip(subs_ids,
+                              self._r_conn.hmget(self._state_key, subs_ids)))
+            updated = dict()
+            locations = locations.sort_values(['subscriberID', 'locationDate'])
+            for subs_id, locs in locations.groupby('subscriberID'):
+                state = states.get(subs_id)
+                stops = SubscriberStops(json.loads(state) if state else None)
+                for row in locs.itertuples():
+                    stops.add(row.latitude, row.longitude,
+                              row.locationDate.to_pydatetime())
+                updated[subs_id] = json.dumps(stops.to_dict())
+
+            expire_at = dt.datetime.combine(
+                self._date + dt.timedelta(days=1), dt.time()) \
+                + dt.timedelta(seconds=self.EXPIRE_AFTER_DAY)
+            pipe = self._r_conn.pipeline()
+            pipe.hset(self._state_key, mapping=updated)
+            pipe.set(self._watermark_key, int(locations.locationID.max()))
+            pipe.expireat(self._state_key, expire_at)
+            pipe.expireat(self._watermark_key, expire_at)
+            pipe.execute()
+            return len(locations)
+
+    def clusters(self, subs_ids: List[int],
+                 provisional: bool = False) -> pd.DataFrame:
+        """Кластеры за день по subscriberID, в формате prepare_clusters.
+        provisional - добавить незавершенные остановки (сотрудник ещё
+        находится на месте). prepare_clusters их не формирует."""
+        self.update()
+        res = []
+        states = self._r_conn.hmget(self._state_key, subs_ids) \
+            if subs_ids else []
+        for subs_id, state in zip(subs_ids, states):
+            if not state:
+                continue
+            stops = SubscriberStops(json.loads(state))
+            rows = list(stops.stops)
+            if provisional and stops.provisional():
+                rows.append(stops.provisional())
+            for lat, lon, t_0, t_1, cluster in rows:
+                res.append({'subscriberID': subs_id,
+                            'datetime': dt.datetime.fromisoformat(t_0),
+                            'longitude': lon,
+                            'latitude': lat,
+                            'leaving_datetime': dt.datetime.fromisoformat(t_1),
+                            'cluster': cluster})
+        clusters = pd.DataFrame(res, columns=CLUSTERS_COLUMNS)
+        clusters['datetime'] = pd.to_datetime(clusters['datetime'])
+        clusters['leaving_datetime'] = \
+            pd.to_datetime(clusters['leaving_datetime'])
+        clusters['date'] = clusters['datetime'].dt.date
+        return clusters
@@ -1,8 +1,20 @@
 import warnings
-from trajectory_report.report.Report import (Report,
-                                             OneEmployeeReport,
-                                             ReportWithAdditionalColumns)
 import pandas as pd
 
 warnings.filterwarnings("ignore","Pandas doesn't allow columns to be created via a new attribute name - see https://pandas.pydata.org/pandas-docs/stable/indexing.html#attribute-access", UserWarning)
-pd.options.mode.chained_assignment = None  # default='warn'
\ No newline at end of file
+pd.options.mode.chained_assignment = None  # default='warn'
+
+# Классы отчетов загружаются при первом обращении, чтобы импорт
+# trajectory_report.report.ClusterGenerator и других модулей пакета
+# (например, в gather) не загружал Report.py
+_LAZY = {'Report': 'trajectory_report.report.Report',
+         'OneEmployeeReport': 'trajectory_report.report.Report',
+         'ReportWithAdditionalColumns': 'trajectory_report.report.Report',
+         'ReportService': 'trajectory_report.report.ReportService'}
+
+
+def __getattr__(name: str):
+    if name in _LAZY:
+        import importlib
+        return getattr(importlib.import_module(_LAZY[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
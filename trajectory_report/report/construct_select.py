@@ -2,7 +2,7 @@
 import datetime as dt
 from typing import Optional, List, Union
 
-from sqlalchemy import select, Select
+from sqlalchemy import select, Select, func, and_, or_
 
 from trajectory_report.models import (Statements,
                                       Employees,
@@ -13,7 +13,8 @@ from trajectory_report.models import (Statements,
                                       Coordinates,
                                       Clusters,
                                       Comment,
-                                      Frequency)
+                                      Frequency,
+                                      location)
 
 
 def statements(date_from: dt.date,
@@ -30,7 +31,8 @@ def statements(date_from: dt.date,
         ObjectsSite.longitude,
         ObjectsSite.latitude,
         Statements.date,
-        Statements.statement) \
+        Statements.statement,
+        Statements.division) \
         .join(Employees) \
         .join(ObjectsSite) \
         .where(Statements.date >= date_from) \
@@ -134,6 +136,25 @@ def serves(date_from: dt.date,
     return sel
 
 
+def pending_serves(date_from: dt.date,
+                   date_to: Optional[dt.date] = None,
+                   **kwargs) -> Select:
+    """Служебные записки на проверке (approval = 3) с координатами
+    объектов"""
+    sel: Select = select(Serves.id,
+                         Serves.name_id,
+                         Serves.object_id,
+                         Serves.date,
+                         ObjectsSite.longitude,
+                         ObjectsSite.latitude) \
+        .join(ObjectsSite, Serves.object_id == ObjectsSite.object_id) \
+        .where(Serves.approval == 3) \
+        .where(Serves.date >= date_from)
+    if date_to:
+        sel = sel.where(Serves.date <= date_to)
+    return sel
+
+
 def current_locations(subscriber_ids: Optional[List[int]] = None,
                       **kwargs) -> Select:
     """get current locations by subscriber_ids"""
@@ -148,6 +169,20 @@ def current_locations(subscriber_ids: Optional[List[int]] = None,
     return sel
 
 
+def new_locations(date: dt.date, location_id_from: int = 0) -> Select:
+    """Локации за день, добавленные после location_id_from"""
+    sel: Select = select(Coordinates.locationID,
+                         Coordinates.subscriberID,
+                         Coordinates.locationDate,
+                         Coordinates.longitude,
+                         Coordinates.latitude) \
+        .where(Coordinates.requestDate >= date) \
+        .where(Coordinates.requestDate < date+dt.timedelta(days=1)) \
+        .where(Coordinates.locationID > location_id_from) \
+        .where(Coordinates.locationDate != None)
+    return sel
+
+
 def clusters(date_from: dt.date,
              date_to: Optional[dt.date] = None,
              subscriber_ids: Optional[List[int]] = None,
@@ -170,6 +205,65 @@ def clusters(date_from: dt.date,
     return sel
 
 
+def attends_in_radius(date_from: dt.date,
+                      date_to: dt.date,
+                      radius: int,
+                      division: Optional[Union[int, str]] = None,
+                      name_ids: Optional[List[int]] = None,
+                      object_ids: Optional[List[int]] = None) -> Select:
+    """Пары (заявленный выход, кластер), где кластер находится в пределах
+    radius метров от объекта. Кластеры сопоставляются с выходами через
+    journal, расстояние считается в БД (ST_Distance_Sphere), поэтому из БД
+    передаются только посещения.
+    MBRContains по прямоугольнику вокруг объекта позволяет использовать
+    SPATIAL индекс clusters_location до точного расчета расстояния.
+    Нужна миграция migrations.spatial_location."""
+    # Радиус в градусах широты и долготы для прямоугольника вокруг объекта
+    d_lat = radius / 111320
+    d_lon = d_lat / func.cos(func.radians(ObjectsSite.latitude))
+    envelope = func.ST_MakeEnvelope(
+        func.point(ObjectsSite.longitude - d_lon, ObjectsSite.latitude - d_lat),
+        func.point(ObjectsSite.longitude + d_lon, ObjectsSite.latitude + d_lat)
+    )
+    sel = select(
+        Statements.name_id,
+        Employees.name,
+        Statements.object_id,
+        ObjectsSite.name.label('object'),
+        Statements.date,
+        Clusters.subscriberID,
+        Clusters.datetime,
+        Clusters.leaving_datetime) \
+        .join(Employees) \
+        .join(ObjectsSite) \
+        .join(Journal, and_(
+            Journal.name_id == Statements.name_id,
+            Journal.period_init <= Statements.date,
+            or_(Journal.period_end == None,
+                Journal.period_end >= Statements.date))) \
+        .join(Clusters, and_(
+            Clusters.subscriberID == Journal.subscriberID,
+            Clusters.date == Statements.date)) \
+        .where(Statements.date >= date_from) \
+        .where(Statements.date <= date_to) \
+        .where(Statements.object_id != 1) \
+        .where(func.MBRContains(envelope, location(Clusters))) \
+        .where(func.ST_Distance_Sphere(location(ObjectsSite),
+                                       location(Clusters),
+                                       6371000) <= radius) \
+        .select_from(Statements)
+    if isinstance(division, int):
+        sel = sel.where(Statements.division == division)
+    if isinstance(division, str):
+        sel = sel.join(Division, Statements.division == Division.id)
+        sel = sel.where(Division.division == division)
+    if name_ids:
+        sel = sel.where(Statements.name_id.in_(name_ids))
+    if object_ids:
+        sel = sel.where(Statements.object_id.in_(object_ids))
+    return sel
+
+
 def statements_one_emp(date: dt.date,
                        name_id: int,
                        division: Union[int, str]
@@ -210,6 +304,34 @@ def locations_one_emp(date: dt.date, subscriber_id: int) -> Select:
     return sel
 
 
+def locations_version_one_emp(date: dt.date, subscriber_id: int) -> Select:
+    """Кол-во и последний locationID локаций устройства за день: меняются
+    при добавлении или удалении локаций (запрос по индексу
+    subsIdRequestDate, без чтения строк)"""
+    sel: Select = select(func.count(Coordinates.locationID),
+                         func.max(Coordinates.locationID)) \
+        .where(Coordinates.subscriberID == subscriber_id) \
+        .where(Coordinates.requestDate >= date) \
+        .where(Coordinates.requestDate < date+dt.timedelta(days=1))
+    return sel
+
+
+def locations(date_from: dt.date,
+              date_to: Optional[dt.date] = None,
+              subscriber_ids: Optional[List[int]] = None,
+              **kwargs) -> Select:
+    """Запросы локаций (в т.ч. без ответа) за период по subscriber_ids"""
+    date_to = date_to or date_from
+    sel: Select = select(Coordinates.subscriberID,
+                         Coordinates.requestDate,
+                         Coordinates.locationDate) \
+        .where(Coordinates.requestDate >= date_from) \
+        .where(Coordinates.requestDate < date_to+dt.timedelta(days=1))
+    if subscriber_ids:
+        sel = sel.where(Coordinates.subscriberID.in_(subscriber_ids))
+    return sel
+
+
 def journal_one_emp(name_id: int) -> Select:
     sel: Select = select(Journal.name_id,
                          Journal.subscriberID,
@@ -226,7 +348,7 @@ def comment(division: Optional[int] = None,
                          Comment.object_id,
                          Comment.comment)
     if isinstance(division, int):
-        sel = sel.where(Statements.division == division)
+        sel = sel.where(Comment.division_id == division)
     if isinstance(division, str):
         sel = sel.join(Division, Comment.division_id == Division.id)
         sel = sel.where(Division.division == division)
@@ -242,7 +364,7 @@ def frequency(division: Optional[int] = None,
                          Frequency.object_id,
                          Frequency.frequency)
     if isinstance(division, int):
-        sel = sel.where(Statements.division == division)
+        sel = sel.where(Frequency.division_id == division)
     if isinstance(division, str):
         sel = sel.join(Division, Frequency.division_id == Division.id)
         sel = sel.where(Division.division == division)